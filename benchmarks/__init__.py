@@ -0,0 +1 @@
+"""Benchmarks for btlewrap, run them with "python -m benchmarks.run"."""
@@ -0,0 +1,311 @@
+"""Run the btlewrap benchmarks and print the results as json.
+
+Usage:
+    python -m benchmarks.run [--quick] [--only NAME] [--output FILE]
+
+The results of two releases can be compared key by key, all durations are
+in microseconds.
+"""
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from contextlib import contextmanager
+from threading import Barrier, Lock, Thread
+from typing import Callable, Dict, Iterator, List  # noqa: F401
+from test.tools import fake_bluez_env
+from btlewrap.base import BluetoothInterface, BluetoothBackendException, _DeviceScan
+from btlewrap.gatttool import GatttoolBackend
+from btlewrap.gatttool_io import _LineReader, _parse_read_output, _read_scan
+from btlewrap.metrics import InMemoryMetrics
+from btlewrap.retry import RetryPolicy
+from btlewrap.version import __version__
+from benchmarks.simulated import SimulatedBackend
+
+# adapter name that no real program uses, so the benchmarks get their own lock
+_ADAPTER = "bench0"
+
+_NOTIFICATION_LINE = (
+    "Notification handle = 0x000e value: 54 3d 32 37 2e 33 20 48 3d 32 37 2e 30 00"
+)
+
+
+def _summary(durations: List[float]) -> Dict[str, float]:
+    """Statistics of a list of durations in seconds."""
+    durations = sorted(durations)
+    total = sum(durations)
+    return {
+        "iterations": len(durations),
+        "total_s": total,
+        "ops_per_s": len(durations) / total if total else 0.0,
+        "mean_us": statistics.mean(durations) * 1e6,
+        "p50_us": durations[len(durations) // 2] * 1e6,
+        "p95_us": durations[int(len(durations) * 0.95)] * 1e6,
+        "max_us": durations[-1] * 1e6,
+    }
+
+
+def _measure(func: Callable, iterations: int) -> Dict[str, float]:
+    """Call @func @iterations times and summarize the durations."""
+    durations = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return _summary(durations)
+
+
+def bench_operation_overhead(scale: float) -> Dict:
+    """Cost of BluetoothInterface and its context manager around a read.
+
+    interface_read_metrics is the same with an InMemoryMetrics sink.
+    """
+    iterations = max(int(20000 * scale), 10)
+    interface = BluetoothInterface(SimulatedBackend, adapter=_ADAPTER)
+    backend = interface._backend  # pylint: disable=protected-access
+    backend.connect("00:00:00:00:00:00")
+    direct = _measure(lambda: backend.read_handle(0x38), iterations)
+
+    def _connected_read():
+        with interface.connect("00:00:00:00:00:00") as connection:
+            connection.read_handle(0x38)
+
+    wrapped = _measure(_connected_read, iterations)
+    interface = BluetoothInterface(
+        SimulatedBackend, adapter=_ADAPTER, metrics=InMemoryMetrics()
+    )
+    metered = _measure(_connected_read, iterations)
+    return {
+        "direct_read": direct,
+        "interface_read": wrapped,
+        "interface_read_metrics": metered,
+        "overhead_us": wrapped["mean_us"] - direct["mean_us"],
+        "metrics_overhead_us": metered["mean_us"] - wrapped["mean_us"],
+    }
+
+
+def bench_lock_contention(scale: float, threads: int = 8) -> Dict:
+    """Wait time for the adapter lock with @threads threads on one adapter."""
+    iterations = max(int(200 * scale), 5)
+    interface = BluetoothInterface(
+        SimulatedBackend, adapter=_ADAPTER, latency=0.0005, connect_latency=0
+    )
+    waits = []  # type: List[float]
+    waits_lock = Lock()
+    barrier = Barrier(threads)
+
+    def _worker():
+        barrier.wait()
+        own = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            with interface.connect("00:00:00:00:00:00") as connection:
+                own.append(time.perf_counter() - start)
+                connection.read_handle(0x38)
+        with waits_lock:
+            waits.extend(own)
+
+    workers = [Thread(target=_worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    return {
+        "threads": threads,
+        "connections_per_s": threads * iterations / elapsed,
+        "lock_wait": _summary(waits),
+    }
+
+
+@contextmanager
+def _fake_bluez(**settings) -> Iterator[None]:
+    """Run the fake gatttool and hcitool of test/tools, see fake_bluez_env()."""
+    previous = dict(os.environ)
+    os.environ.update(fake_bluez_env(**settings))
+    try:
+        yield
+    finally:
+        os.environ.clear()
+        os.environ.update(previous)
+
+
+def bench_retry_path(scale: float) -> Dict:
+    """Reads of GatttoolBackend against the fake gatttool, with and without retries.
+
+    three_attempts fails to connect every time, so each read runs gatttool
+    three times. Retries have no delay, per_retry_us is the cost of one retry.
+    """
+    iterations = max(int(20 * scale), 2)
+    backend = GatttoolBackend(
+        _ADAPTER, retry_policy=RetryPolicy(max_attempts=3, base_delay=0)
+    )
+    backend.connect("00:00:00:00:00:00")
+
+    def _failing_read():
+        try:
+            backend.read_handle(0x38)
+        except BluetoothBackendException:
+            pass
+
+    with _fake_bluez():
+        first_try = _measure(lambda: backend.read_handle(0x38), iterations)
+    with _fake_bluez(fail="connect"):
+        three_attempts = _measure(_failing_read, iterations)
+    return {
+        "first_try": first_try,
+        "three_attempts": three_attempts,
+        "per_retry_us": (three_attempts["mean_us"] - first_try["mean_us"]) / 2,
+    }
+
+
+def bench_gatttool_parsing(scale: float) -> Dict:
+    """Throughput of the parsers for gatttool output.
+
+    Notifications are read like from a running "gatttool --listen", through
+    the line reader thread.
+    """
+    iterations = max(int(20000 * scale), 10)
+    read_output = "Characteristic value/descriptor: 00 11 aa ff 12 34 56 78"
+    listen_output = "\n".join(
+        ["Characteristic value was written successfully"] + [_NOTIFICATION_LINE] * 100
+    ).encode()
+    backend = GatttoolBackend(_ADAPTER)
+
+    def _listen():
+        reader = _LineReader(io.BytesIO(listen_output))
+        # pylint: disable=protected-access
+        for _ in backend._read_notifications(reader, 10):
+            pass
+
+    read = _measure(lambda: _parse_read_output(read_output), iterations)
+    listen = _measure(_listen, max(iterations // 100, 10))
+    return {
+        "read_output": read,
+        "notification_lines_per_s": 100 * listen["ops_per_s"],
+    }
+
+
+def bench_scan_parsing(scale: float, devices: int = 50) -> Dict:
+    """Throughput of reading "hcitool lescan" output with many duplicates.
+
+    The lines go through the same reader and parser as in iter_scan().
+    """
+    lines = max(int(10000 * scale), devices)
+    output = "\n".join(
+        ["LE Scan ..."]
+        + [
+            "AA:BB:CC:DD:{:02X}:{:02X} ({})".format(
+                number // 256 % 256,
+                number % 256,
+                "unknown" if number % 3 else "sensor",
+            )
+            for number in (line % devices for line in range(lines))
+        ]
+    ).encode()
+
+    def _scan():
+        reader = _LineReader(io.BytesIO(output), buffer_size=64)
+        scan = _DeviceScan(unknown_name="unknown")
+        try:
+            for _ in _read_scan(reader, scan, time.monotonic() + 60):
+                pass
+        finally:
+            reader.close()
+
+    result = _measure(_scan, 5)
+    return {
+        "lines": lines,
+        "devices": devices,
+        "lines_per_s": lines / (result["total_s"] / result["iterations"]),
+    }
+
+
+def bench_notifications(scale: float, burst: int = 1000) -> Dict:
+    """Throughput of iter_notifications with bursts of notifications."""
+    backend = SimulatedBackend(_ADAPTER, notification_burst=burst)
+    rounds = max(int(20 * scale), 2)
+
+    def _consume():
+        for _ in backend.iter_notifications(0x0E, 10, max_count=burst):
+            pass
+
+    result = _measure(_consume, rounds)
+    return {
+        "burst": burst,
+        "notifications_per_s": burst * result["ops_per_s"],
+    }
+
+
+def bench_write_stream(scale: float, chunks: int = 200) -> Dict:
+    """Bulk writes with write_handles against write_stream.
+
+    Only acknowledged writes wait for the simulated device.
+    """
+    backend = SimulatedBackend(_ADAPTER, latency=0.0002)
+    backend.connect("00:00:00:00:00:00")
+    data = [bytes(20)] * chunks
+    rounds = max(int(20 * scale), 2)
+    acknowledged = _measure(
+        lambda: backend.write_handles([(0x33, chunk) for chunk in data]), rounds
+    )
+    streamed = _measure(lambda: backend.write_stream(0x33, data), rounds)
+    return {
+        "chunks": chunks,
+        "write_handles": acknowledged,
+        "write_stream": streamed,
+        "speedup": acknowledged["mean_us"] / streamed["mean_us"],
+    }
+
+
+BENCHMARKS = {
+    "operation_overhead": bench_operation_overhead,
+    "lock_contention": bench_lock_contention,
+    "retry_path": bench_retry_path,
+    "gatttool_parsing": bench_gatttool_parsing,
+    "scan_parsing": bench_scan_parsing,
+    "notifications": bench_notifications,
+    "write_stream": bench_write_stream,
+}  # type: Dict[str, Callable[[float], Dict]]
+
+
+def run(names: List[str], scale: float = 1.0) -> Dict:
+    """Run the benchmarks @names and return the results with some metadata."""
+    return {
+        "btlewrap_version": __version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "scale": scale,
+        "benchmarks": {name: BENCHMARKS[name](scale) for name in names},
+    }
+
+
+def main(argv=None):
+    """Command line interface."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--only", action="append", choices=sorted(BENCHMARKS), help="run only these"
+    )
+    parser.add_argument(
+        "--quick", action="store_true", help="run fewer iterations, e.g. for CI"
+    )
+    parser.add_argument("--output", help="write the json to this file")
+    args = parser.parse_args(argv)
+    results = run(args.only or list(BENCHMARKS), 0.1 if args.quick else 1.0)
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            output_file.write(text + "\n")
+    else:
+        sys.stdout.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
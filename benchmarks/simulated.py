@@ -0,0 +1,82 @@
+"""Backend that simulates a device with configurable latency and failures."""
+import random
+import time
+from typing import Dict, Optional  # noqa: F401
+from btlewrap.base import AbstractBackend, BluetoothBackendException
+
+
+class SimulatedBackend(AbstractBackend):
+    """Simulated device for benchmarks.
+
+    Every operation sleeps for @latency seconds and fails with a
+    BluetoothBackendException with probability @failure_rate. Waiting for
+    notifications delivers @notification_burst notifications at once. The
+    random generator is seeded, so runs can be compared.
+    """
+
+    # pylint: disable=too-many-arguments
+
+    def __init__(
+        self,
+        adapter: str = "hci0",
+        address_type: str = "public",
+        *,
+        latency: float = 0,
+        connect_latency: Optional[float] = None,
+        failure_rate: float = 0,
+        notification_burst: int = 1,
+        seed: int = 0
+    ):
+        super().__init__(adapter, address_type)
+        self.latency = latency
+        self.connect_latency = latency if connect_latency is None else connect_latency
+        self.failure_rate = failure_rate
+        self.notification_burst = notification_burst
+        self.values = {}  # type: Dict[int, bytes]
+        self.operations = 0
+        self.failures = 0
+        self._random = random.Random(seed)
+        self._mac = None  # type: Optional[str]
+
+    def _operation(self, latency: float):
+        self.operations += 1
+        if latency > 0:
+            time.sleep(latency)
+        if self.failure_rate and self._random.random() < self.failure_rate:
+            self.failures += 1
+            raise BluetoothBackendException("Simulated failure")
+
+    def connect(self, mac: str):
+        self._operation(self.connect_latency)
+        self._mac = mac
+
+    def disconnect(self):
+        self._mac = None
+
+    def is_connected(self) -> bool:
+        """Check if the simulated device is connected."""
+        return self._mac is not None
+
+    def read_handle(self, handle: int) -> bytes:
+        self._operation(self.latency)
+        return self.values.get(handle, bytes([handle & 0xFF] * 4))
+
+    def write_handle(self, handle: int, value: bytes, response: bool = True) -> bool:
+        # write commands do not wait for the device
+        self._operation(self.latency if response else 0)
+        self.values[handle] = value
+        return True
+
+    def wait_for_notification(self, handle: int, delegate, notification_timeout: float):
+        self._operation(self.latency)
+        for number in range(self.notification_burst):
+            delegate.handleNotification(handle, number.to_bytes(4, "little"))
+        return True
+
+    @staticmethod
+    def check_backend() -> bool:
+        return True
+
+    @staticmethod
+    def supports_scanning() -> bool:
+        return False
@@ -1,5 +1,8 @@
 """Public interface for btlewrap."""
+import importlib
 import sys
+from threading import Lock
+from typing import Dict, List  # noqa: F401
 from btlewrap.version import __version__  # noqa: F401
 
 # This check must be run first, so that it fails before loading the other modules.
@@ -15,22 +18,58 @@ if sys.version_info < (3, 4):
 # pylint: disable=wrong-import-position
 from btlewrap.base import (  # noqa: F401,E402
     BluetoothBackendException,
+    BluetoothTimeoutError,
+    CircuitOpenError,
 )
+from btlewrap.retry import RetryPolicy  # noqa: F401,E402
 
-from btlewrap.bluepy import (
-    BluepyBackend,
-)
-from btlewrap.gatttool import (
-    GatttoolBackend,
-)
-from btlewrap.pygatt import (
-    PygattBackend,
-)
+# the backend modules are only imported when they are used
+_BACKEND_MODULES = {
+    "BluepyBackend": "btlewrap.bluepy",
+    "GatttoolBackend": "btlewrap.gatttool",
+    "L2capBackend": "btlewrap.l2cap",
+    "PygattBackend": "btlewrap.pygatt",
+}
+
+_AVAILABILITY = {}  # type: Dict[str, bool]
+_AVAILABILITY_LOCK = Lock()
+
+
+def _load_backend(name: str) -> type:
+    backend = getattr(importlib.import_module(_BACKEND_MODULES[name]), name)
+    globals()[name] = backend
+    return backend
+
+
+if sys.version_info < (3, 7):
+    # module level __getattr__ requires Python 3.7, import the backends right away
+    from btlewrap.bluepy import BluepyBackend  # noqa: F401
+    from btlewrap.gatttool import GatttoolBackend  # noqa: F401
+    from btlewrap.l2cap import L2capBackend  # noqa: F401
+    from btlewrap.pygatt import PygattBackend  # noqa: F401
+else:
+
+    def __getattr__(name: str):
+        if name in _BACKEND_MODULES:
+            return _load_backend(name)
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
 
+    def __dir__():
+        return sorted(set(globals()) | set(_BACKEND_MODULES))
 
-_ALL_BACKENDS = [BluepyBackend, GatttoolBackend, PygattBackend]
 
+def available_backends(refresh: bool = False) -> List[type]:
+    """Returns a list of all available backends.
 
-def available_backends():
-    """Returns a list of all available backends."""
-    return [b for b in _ALL_BACKENDS if b.check_backend()]
+    The availability is only checked once per process, use refresh=True to
+    check again, e.g. after installing a backend.
+    """
+    backends = []
+    with _AVAILABILITY_LOCK:
+        for name in _BACKEND_MODULES:
+            backend = _load_backend(name)
+            if refresh or name not in _AVAILABILITY:
+                _AVAILABILITY[name] = backend.check_backend()
+            if _AVAILABILITY[name]:
+                backends.append(backend)
+    return backends
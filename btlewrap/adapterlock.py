@@ -0,0 +1,214 @@
+"""Lock of an adapter that is shared by several processes.
+
+The adapter lock of BluetoothInterface only serializes the threads of one
+process. Independent services using the same adapter collide on the radio
+and end up in slow retries. AdapterLock queues the connections of all
+processes that use the same lock directory: the waiting processes are
+served first come, first served, and a process that died while holding or
+waiting for the adapter is removed from the queue.
+
+All state is in the lock directory:
+
+  <adapter>.lock              guards the queue, only held for a moment
+  <adapter>.queue             waiting processes, the first one holds the adapter
+  <adapter>.<token>.ticket    locked by its owner as long as it is queued
+
+The tickets are locked with flock(), so the kernel releases them when their
+owner dies, also if its pid was reused or belongs to another pid namespace.
+"""
+import fcntl
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple  # noqa: F401
+from uuid import uuid4
+from btlewrap.base import BluetoothTimeoutError
+
+_LOGGER = logging.getLogger(__name__)
+
+# /run/lock is writable by all users on most distributions
+DEFAULT_DIRECTORY = "/run/lock/btlewrap"
+
+_POLL_INTERVAL = 0.05
+
+_QueueEntry = Tuple[str, int]
+
+
+class AdapterTicket:  # pylint: disable=too-few-public-methods
+    """Place of a connection in the queue of an adapter.
+
+    The ticket file stays locked until the ticket is closed.
+    """
+
+    def __init__(self, adapter: str, token: str, path: str):
+        self.adapter = adapter
+        self.token = token
+        self.path = path
+        # pylint: disable=consider-using-with
+        self._file = open(path, "w", encoding="utf-8")
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+
+    def close(self):
+        """Remove and unlock the ticket file."""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        self._file.close()
+
+
+class AdapterLock:
+    """Lock of the adapters, shared by all processes using the same @directory.
+
+    acquire() waits until all processes that queued before are done, at most
+    until the deadline or @timeout seconds. The queue is checked every
+    @poll_interval seconds. All services sharing an adapter need write
+    access to @directory, it is created if required.
+    """
+
+    def __init__(
+        self,
+        directory: str = DEFAULT_DIRECTORY,
+        timeout: Optional[float] = None,
+        poll_interval: float = _POLL_INTERVAL,
+    ):
+        self.directory = directory
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+
+    def acquire(self, adapter: str, deadline: Optional[float] = None) -> AdapterTicket:
+        """Wait for @adapter, at most until @deadline.
+
+        The @deadline is a time.monotonic() value. Raises a
+        BluetoothTimeoutError if the adapter was not free in time.
+        """
+        if self.timeout is not None:
+            limit = time.monotonic() + self.timeout
+            deadline = limit if deadline is None else min(deadline, limit)
+        ticket = self._enqueue(adapter)
+        try:
+            while True:
+                holder = self._holder(adapter)
+                if holder is None or holder[0] == ticket.token:
+                    return ticket
+                wait = self.poll_interval
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise BluetoothTimeoutError(
+                            "Timeout while waiting for adapter {} held by process {}.".format(
+                                adapter, holder[1]
+                            )
+                        )
+                    wait = min(wait, remaining)
+                time.sleep(wait)
+        except:  # noqa: E722
+            self.release(ticket)
+            raise
+
+    def release(self, ticket: AdapterTicket):
+        """Leave the queue, the next process gets the adapter."""
+        try:
+            with self._queue(ticket.adapter) as queue:
+                queue[:] = [entry for entry in queue if entry[0] != ticket.token]
+        finally:
+            ticket.close()
+
+    @contextmanager
+    def hold(self, adapter: str, timeout: Optional[float] = None) -> Iterator[None]:
+        """Hold @adapter in a with statement, e.g. for a scan."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        ticket = self.acquire(adapter, deadline)
+        try:
+            yield
+        finally:
+            self.release(ticket)
+
+    def holder(self, adapter: str) -> Optional[int]:
+        """Get the pid of the process holding @adapter, None if it is free."""
+        holder = self._holder(adapter)
+        return None if holder is None else holder[1]
+
+    def waiting(self, adapter: str) -> List[int]:
+        """Get the pids of the processes queued for @adapter, the holder first."""
+        with self._queue(adapter) as queue:
+            return [pid for _, pid in queue]
+
+    def _enqueue(self, adapter: str) -> AdapterTicket:
+        token = "{}-{}".format(os.getpid(), uuid4().hex[:12])
+        os.makedirs(self.directory, exist_ok=True)
+        # the ticket is locked before it is queued, so it never looks stale
+        ticket = AdapterTicket(adapter, token, self._path(adapter, token, "ticket"))
+        try:
+            with self._queue(adapter) as queue:
+                queue.append((token, os.getpid()))
+        except:  # noqa: E722
+            ticket.close()
+            raise
+        return ticket
+
+    def _holder(self, adapter: str) -> Optional[_QueueEntry]:
+        with self._queue(adapter) as queue:
+            return queue[0] if queue else None
+
+    @contextmanager
+    def _queue(self, adapter: str) -> Iterator[List[_QueueEntry]]:
+        """Lock the queue of @adapter and get its live entries.
+
+        Changes to the list are written back when the context is left.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path(adapter, "lock"), "a", encoding="utf-8") as guard:
+            fcntl.flock(guard, fcntl.LOCK_EX)
+            entries, valid = self._read(adapter)
+            queue = [entry for entry in entries if self._is_alive(adapter, entry)]
+            yield queue
+            if queue != entries or not valid:
+                self._write(adapter, queue)
+
+    def _is_alive(self, adapter: str, entry: _QueueEntry) -> bool:
+        """Check if the owner of a queue entry still holds its ticket."""
+        path = self._path(adapter, entry[0], "ticket")
+        try:
+            with open(path, encoding="utf-8") as ticket:
+                fcntl.flock(ticket, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        except FileNotFoundError:
+            pass
+        else:
+            os.remove(path)
+        _LOGGER.warning(
+            "Removing stale process %d from the queue of adapter %s", entry[1], adapter
+        )
+        return False
+
+    def _read(self, adapter: str) -> Tuple[List[_QueueEntry], bool]:
+        """Read the queue file, also tell if all its lines were valid."""
+        entries = []  # type: List[_QueueEntry]
+        valid = True
+        try:
+            with open(self._path(adapter, "queue"), encoding="utf-8") as queue_file:
+                for line in queue_file:
+                    try:
+                        token, pid = line.split()
+                        entries.append((token, int(pid)))
+                    except ValueError:
+                        _LOGGER.warning("Ignoring invalid queue entry %r", line)
+                        valid = False
+        except FileNotFoundError:
+            pass
+        return entries, valid
+
+    def _write(self, adapter: str, queue: List[_QueueEntry]):
+        """Replace the queue file, the guard must be held."""
+        path = self._path(adapter, "queue")
+        temp_path = "{}.tmp".format(path)
+        with open(temp_path, "w", encoding="utf-8") as queue_file:
+            queue_file.writelines("{} {}\n".format(token, pid) for token, pid in queue)
+        os.replace(temp_path, path)
+
+    def _path(self, adapter: str, *suffixes: str) -> str:
+        name = ".".join((str(adapter).replace(os.sep, "_"),) + suffixes)
+        return os.path.join(self.directory, name)
@@ -0,0 +1,152 @@
+"""Parsing and filtering of Bluetooth LE advertisements."""
+import uuid
+from typing import Iterable, List, NamedTuple, Optional, Tuple, Union  # noqa: F401
+
+# AD types, see the "Assigned Numbers" of the Bluetooth SIG
+AD_TYPE_UUID16_INCOMPLETE = 0x02
+AD_TYPE_UUID16_COMPLETE = 0x03
+AD_TYPE_UUID32_INCOMPLETE = 0x04
+AD_TYPE_UUID32_COMPLETE = 0x05
+AD_TYPE_UUID128_INCOMPLETE = 0x06
+AD_TYPE_UUID128_COMPLETE = 0x07
+AD_TYPE_COMPLETE_NAME = 0x09
+AD_TYPE_SERVICE_DATA_UUID16 = 0x16
+AD_TYPE_SERVICE_DATA_UUID32 = 0x20
+AD_TYPE_SERVICE_DATA_UUID128 = 0x21
+AD_TYPE_MANUFACTURER_DATA = 0xFF
+
+# 16 and 32 bit uuids are short forms of uuids ending in this
+_BASE_UUID_SUFFIX = "-0000-1000-8000-00805f9b34fb"
+
+# AD type -> (size of one uuid, payload is service data)
+_UUID_TYPES = {
+    AD_TYPE_UUID16_INCOMPLETE: (2, False),
+    AD_TYPE_UUID16_COMPLETE: (2, False),
+    AD_TYPE_UUID32_INCOMPLETE: (4, False),
+    AD_TYPE_UUID32_COMPLETE: (4, False),
+    AD_TYPE_UUID128_INCOMPLETE: (16, False),
+    AD_TYPE_UUID128_COMPLETE: (16, False),
+    AD_TYPE_SERVICE_DATA_UUID16: (2, True),
+    AD_TYPE_SERVICE_DATA_UUID32: (4, True),
+    AD_TYPE_SERVICE_DATA_UUID128: (16, True),
+}
+
+
+class AdvertisementRecord(NamedTuple):
+    """One AD structure of an advertisement.
+
+    adv_type is the AD type, e.g. 0x16 for service data or 0xFF for
+    manufacturer data. payload is the data of the AD structure without its
+    length and type bytes.
+    """
+
+    mac: str
+    rssi: int
+    adv_type: int
+    payload: bytes
+
+    def service_uuid(self) -> Optional[str]:
+        """UUID of service data records, None for all other records."""
+        size, is_service_data = _UUID_TYPES.get(self.adv_type, (0, False))
+        if not is_service_data or len(self.payload) < size:
+            return None
+        return _uuid_from_bytes(self.payload[:size])
+
+    def service_data(self) -> Optional[bytes]:
+        """Payload of service data records without the UUID."""
+        size, is_service_data = _UUID_TYPES.get(self.adv_type, (0, False))
+        if not is_service_data:
+            return None
+        return self.payload[size:]
+
+
+def normalize_uuid(value: Union[int, str, uuid.UUID]) -> str:
+    """Get the full 128 bit form of a UUID, e.g. 0xfe95 or "FE95".
+
+    Raises ValueError for anything that is not a 16, 32 or 128 bit uuid.
+    """
+    if isinstance(value, int):
+        return "{:08x}{}".format(value, _BASE_UUID_SUFFIX)
+    text = str(value).lower()
+    try:
+        if len(text) in (4, 8):
+            return "{:08x}{}".format(int(text, 16), _BASE_UUID_SUFFIX)
+        return str(uuid.UUID(text))
+    except ValueError:
+        raise ValueError("Invalid uuid {}".format(value)) from None
+
+
+def short_uuid(value: str) -> str:
+    """Get the 16 bit form of a normalized uuid, if it has one."""
+    if value.startswith("0000") and value.endswith(_BASE_UUID_SUFFIX):
+        return value[4:8]
+    return value
+
+
+def _uuid_from_bytes(data: bytes) -> str:
+    """Convert a little endian UUID of 2, 4 or 16 bytes."""
+    if len(data) == 16:
+        return str(uuid.UUID(bytes=data[::-1]))
+    return normalize_uuid(int.from_bytes(data, "little"))
+
+
+def parse_advertising_data(data: bytes) -> List[Tuple[int, bytes]]:
+    """Split advertising data into its (AD type, payload) structures."""
+    structures = []
+    position = 0
+    while position < len(data):
+        length = data[position]
+        # a length of 0 marks the padding at the end
+        if length == 0 or position + 1 + length > len(data):
+            break
+        start = position + 2
+        position += 1 + length
+        structures.append((data[start - 1], bytes(data[start:position])))
+    return structures
+
+
+def advertised_uuids(adv_type: int, payload: bytes) -> List[str]:
+    """UUIDs listed in or used as key of an AD structure."""
+    size, is_service_data = _UUID_TYPES.get(adv_type, (0, False))
+    if size == 0:
+        return []
+    if is_service_data:
+        payload = payload[:size]
+    starts = range(0, len(payload) - size + 1, size)
+    return [_uuid_from_bytes(bytes(payload[start:][:size])) for start in starts]
+
+
+class AdvertisementFilter:  # pylint: disable=too-few-public-methods
+    """Select the advertisements of some devices or services.
+
+    An advertisement passes if its mac is in @macs and if it contains one of
+    the @service_uuids, in a UUID list or as service data. None means no
+    filtering.
+    """
+
+    def __init__(
+        self,
+        macs: Optional[Iterable[str]] = None,
+        service_uuids: Optional[Iterable[Union[int, str, uuid.UUID]]] = None,
+    ):
+        self.macs = None if macs is None else {mac.upper() for mac in macs}
+        self.service_uuids = None
+        if service_uuids is not None:
+            self.service_uuids = {normalize_uuid(value) for value in service_uuids}
+
+    def records(
+        self, mac: str, rssi: int, structures: List[Tuple[int, bytes]]
+    ) -> List[AdvertisementRecord]:
+        """Get the records of an advertisement, an empty list if it is filtered."""
+        if self.macs is not None and mac.upper() not in self.macs:
+            return []
+        if self.service_uuids is not None and not any(
+            uuid_ in self.service_uuids
+            for adv_type, payload in structures
+            for uuid_ in advertised_uuids(adv_type, payload)
+        ):
+            return []
+        return [
+            AdvertisementRecord(mac, rssi, adv_type, payload)
+            for adv_type, payload in structures
+        ]
@@ -0,0 +1,477 @@
+"""asyncio interface for btlewrap.
+
+gatttool is run natively with asyncio subprocesses, all other backends are
+run in an executor so that they do not block the event loop.
+
+This is a thin path: the connect timeout and the deadline of the backend
+are honoured and the adapter is shared with synchronous BluetoothInterfaces
+of the same process, but there are no metrics, circuit breaker, read cache,
+keep-alive, device registry or AdapterLock. Use BluetoothInterface if these
+are needed.
+"""
+import asyncio
+import functools
+import logging
+import os
+import signal
+import threading
+import time
+import weakref
+from concurrent.futures import Executor  # noqa: F401
+from typing import AsyncIterator, Callable, Optional, Tuple  # noqa: F401
+from btlewrap.base import (
+    AbstractBackend,
+    BluetoothBackendException,
+    BluetoothTimeoutError,
+    _BackendConnection,
+    _KeepAlive,
+)
+from btlewrap.gatttool import GatttoolBackend
+from btlewrap.gatttool_io import (
+    _NOTIFICATION_REGEX,
+    _parse_read_output,
+    _parse_write_output,
+)
+from btlewrap.retry import RetryAttempt
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class AsyncBluetoothInterface:
+    """asyncio version of BluetoothInterface.
+
+    Usage:
+        interface = AsyncBluetoothInterface(GatttoolBackend)
+        async with interface.connect(mac) as backend:
+            value = await backend.read_handle(0x38)
+    """
+
+    _locks = weakref.WeakKeyDictionary()  # type: weakref.WeakKeyDictionary
+
+    def __init__(
+        self,
+        backend: type,
+        *,
+        adapter: str = "hci0",
+        address_type: str = "public",
+        executor: Optional[Executor] = None,
+        **kwargs,
+    ):
+        if issubclass(backend, GatttoolBackend) and not kwargs.get("interactive"):
+            self._backend = AsyncGatttoolBackend(
+                adapter=adapter, address_type=address_type, **kwargs
+            )
+        else:
+            self._backend = _ExecutorBackend(
+                backend(adapter=adapter, address_type=address_type, **kwargs),
+                executor,
+            )
+
+    def connect(
+        self, mac: str, timeout: Optional[float] = None
+    ) -> "_AsyncBackendConnection":
+        """Connect to the sensor.
+
+        @timeout limits the whole connection in seconds, like the timeout of
+        BluetoothInterface.connect(): waiting for the adapter, connecting and
+        all operations including their retries.
+        """
+        return _AsyncBackendConnection(self, mac, timeout)
+
+    def is_connected(self) -> bool:
+        """Check if we are connected to a sensor on this adapter."""
+        return _BackendConnection.is_connected(self._backend.adapter)
+
+    def _adapter_lock(self) -> asyncio.Lock:
+        """Get the asyncio lock of the adapter for the running event loop."""
+        locks = self._locks.setdefault(asyncio.get_event_loop(), {})
+        adapter = self._backend.adapter
+        if adapter not in locks:
+            locks[adapter] = asyncio.Lock()
+        return locks[adapter]
+
+
+class _AsyncBackendConnection:
+    """Async context manager for a bluetooth connection.
+
+    Coroutines waiting for the same adapter queue on an asyncio lock. The
+    thread lock of the adapter is taken as well, so that synchronous
+    BluetoothInterfaces in other threads are not disturbed. It is waited for
+    in an executor, the event loop is not blocked.
+    """
+
+    def __init__(
+        self, interface: AsyncBluetoothInterface, mac: str, timeout: Optional[float]
+    ):
+        self._interface = interface
+        self._backend = interface._backend  # pylint: disable=protected-access
+        self._mac = mac
+        self._timeout = timeout
+        self._previous_deadline = None  # type: Optional[float]
+        self._lock = None  # type: Optional[asyncio.Lock]
+        # pylint: disable=protected-access
+        self._thread_lock = _BackendConnection._adapter_lock(self._backend.adapter)
+
+    async def __aenter__(self):
+        deadline = None if self._timeout is None else time.monotonic() + self._timeout
+        self._lock = self._interface._adapter_lock()  # pylint: disable=protected-access
+        try:
+            await asyncio.wait_for(self._lock.acquire(), _remaining(deadline))
+        except asyncio.TimeoutError:
+            raise self._lock_timeout() from None
+        try:
+            await self._acquire_thread_lock(deadline)
+        except:  # noqa: E722
+            self._lock.release()
+            raise
+        try:
+            self._previous_deadline = self._backend.deadline
+            if deadline is not None:
+                self._backend.deadline = deadline
+            _KeepAlive.close_lingering(self._backend.adapter, None)
+            await self._backend.connect(self._mac)
+        # release locks on any exceptions otherwise they will never be unlocked
+        except:  # noqa: E722
+            self._release()
+            raise
+        return self._backend
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        try:
+            await self._backend.disconnect()
+        finally:
+            self._release()
+
+    async def _acquire_thread_lock(self, deadline: Optional[float]):
+        """Wait for the thread lock of the adapter, at most until @deadline."""
+        waiter = _ThreadLockWaiter(self._thread_lock)
+        if not await waiter.acquire(_remaining(deadline)):
+            raise self._lock_timeout()
+
+    def _lock_timeout(self) -> BluetoothTimeoutError:
+        return BluetoothTimeoutError(
+            "Timeout while waiting for adapter {}.".format(self._backend.adapter)
+        )
+
+    def _release(self):
+        self._backend.deadline = self._previous_deadline
+        self._thread_lock.release()
+        self._lock.release()
+
+
+class _ThreadLockWaiter:  # pylint: disable=too-few-public-methods
+    """Wait for a threading.Lock in an executor.
+
+    The executor cannot be interrupted. If the waiting coroutine is
+    cancelled, the lock is released by whoever comes last, the coroutine or
+    the executor thread, so it is never left locked.
+    """
+
+    def __init__(self, lock: threading.Lock):
+        self._lock = lock
+        self._guard = threading.Lock()
+        self._acquired = False
+        self._abandoned = False
+
+    async def acquire(self, timeout: Optional[float]) -> bool:
+        """Wait at most @timeout seconds, False if the lock was not acquired."""
+        loop = asyncio.get_event_loop()
+        try:
+            return await loop.run_in_executor(
+                None, self._acquire, -1 if timeout is None else timeout
+            )
+        except asyncio.CancelledError:
+            with self._guard:
+                self._abandoned = True
+                if self._acquired:
+                    self._lock.release()
+            raise
+
+    def _acquire(self, timeout: float) -> bool:
+        acquired = self._lock.acquire(timeout=timeout)
+        with self._guard:
+            if acquired and self._abandoned:
+                self._lock.release()
+            self._acquired = acquired and not self._abandoned
+            return self._acquired
+
+
+def _remaining(deadline: Optional[float]) -> Optional[float]:
+    """Seconds left until @deadline, None if there is none."""
+    if deadline is None:
+        return None
+    return max(deadline - time.monotonic(), 0)
+
+
+class _ExecutorBackend:  # pylint: disable=too-few-public-methods
+    """Run the methods of a synchronous backend in an executor.
+
+    Cancelling a call only cancels the waiting coroutine, the backend
+    operation itself runs to its end in the executor.
+    """
+
+    def __init__(self, backend, executor: Optional[Executor]):
+        self._backend = backend
+        self._executor = executor
+
+    @property
+    def deadline(self) -> Optional[float]:
+        """Deadline of the synchronous backend, see AbstractBackend.time_limit()."""
+        return self._backend.deadline
+
+    @deadline.setter
+    def deadline(self, deadline: Optional[float]):
+        self._backend.deadline = deadline
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self._backend, name)
+        if not callable(attribute):
+            return attribute
+
+        async def _call(*args, **kwargs):
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(
+                self._executor, functools.partial(attribute, *args, **kwargs)
+            )
+
+        return _call
+
+
+class AsyncGatttoolBackend:
+    """gatttool backend based on asyncio subprocesses.
+
+    Timeouts and cancellation stop the gatttool process group, so no process
+    is left behind. The arguments are those of GatttoolBackend, which keeps
+    the configuration and the deadline. Its configuration attributes and
+    deadline helpers, e.g. retry_policy, timeout and time_limit(), are
+    available here as well. Its operations are not, they would block.
+    """
+
+    # pylint: disable=protected-access
+    _DATA_MODE_LISTEN = AbstractBackend._DATA_MODE_LISTEN
+    # attributes of the wrapped GatttoolBackend that are safe to use here
+    _FORWARDED = frozenset(
+        (
+            "adapter",
+            "address_type",
+            "retries",
+            "retry_policy",
+            "timeout",
+            "time_limit",
+            "remaining_time",
+            "check_deadline",
+        )
+    )
+
+    def __init__(self, adapter: str = "hci0", **kwargs):
+        self._gatttool = GatttoolBackend(adapter, **kwargs)
+        self._mac = None  # type: Optional[str]
+
+    def __getattr__(self, name: str):
+        if name not in self._FORWARDED:
+            raise AttributeError(
+                "{} has no attribute {}".format(type(self).__name__, name)
+            )
+        return getattr(self._gatttool, name)
+
+    @property
+    def deadline(self) -> Optional[float]:
+        """Deadline of all operations, see AbstractBackend.time_limit()."""
+        return self._gatttool.deadline
+
+    @deadline.setter
+    def deadline(self, deadline: Optional[float]):
+        self._gatttool.deadline = deadline
+
+    async def connect(self, mac: str):
+        """Connection handling is not required when using gatttool, but we still need the mac."""
+        self._mac = mac
+
+    async def disconnect(self):
+        """Connection handling is not required when using gatttool."""
+        self._mac = None
+
+    def is_connected(self) -> bool:
+        """Check if we are connected to the backend."""
+        return self._mac is not None
+
+    async def read_handle(self, handle: int) -> bytes:
+        """Read a handle from the sensor."""
+        args = ["--char-read", "-a", GatttoolBackend.byte_to_handle(handle)]
+        run = functools.partial(self._run_gatttool, args)
+        async for result, _ in self._attempts(run, self.timeout):
+            value = _parse_read_output(result)
+            if value is not None:
+                return value
+        raise BluetoothBackendException("Exit read_ble, no data")
+
+    async def write_handle(
+        self, handle: int, value: bytes, response: bool = True
+    ) -> bool:
+        """Write a value to a handle, with a write command if @response is False."""
+        args = [
+            "--char-write-req" if response else "--char-write",
+            "-a",
+            GatttoolBackend.byte_to_handle(handle),
+            "-n",
+            GatttoolBackend.bytes_to_string(value),
+        ]
+        run = functools.partial(self._run_gatttool, args)
+        async for result, returncode in self._attempts(run, self.timeout):
+            if response and _parse_write_output(result):
+                return True
+            # gatttool prints nothing for a write command, only its exit code
+            # tells if it could connect and send it
+            if not response and returncode == 0:
+                return True
+        raise BluetoothBackendException("Exit write_ble, no data")
+
+    async def wait_for_notification(
+        self,
+        handle: int,
+        delegate,
+        notification_timeout: float,
+        *,
+        max_count: Optional[int] = None,
+        predicate: Optional[Callable[[int, bytes], bool]] = None,
+    ) -> bool:
+        """Listen for notifications and pass them to the delegate.
+
+        Notifications are passed on as soon as gatttool prints them. Listening
+        stops after @max_count notifications or as soon as
+        predicate(handle, value) returns True, see
+        GatttoolBackend.wait_for_notification.
+        """
+        args = [
+            "--char-write-req",
+            "-a",
+            GatttoolBackend.byte_to_handle(handle),
+            "-n",
+            GatttoolBackend.bytes_to_string(self._DATA_MODE_LISTEN),
+            "--listen",
+        ]
+
+        def _deliver(value: bytes) -> bool:
+            """Pass a notification on, True if listening can stop."""
+            delegate.handleNotification(handle, value)
+            return predicate is not None and predicate(handle, value)
+
+        run = functools.partial(self._listen, args, _deliver, max_count)
+        async for written in self._attempts(run, notification_timeout):
+            if written:
+                return True
+        raise BluetoothBackendException("Exit write_ble, no data")
+
+    async def _attempts(self, run, timeout: float):
+        """Run gatttool until the caller is satisfied.
+
+        Yields the result of each await run(timeout), e.g. the output and the
+        exit code of _run_gatttool(). Raises a BluetoothTimeoutError instead
+        of giving up if the deadline has passed.
+        """
+        if not self.is_connected():
+            raise BluetoothBackendException("Not connected to any device.")
+        attempt = RetryAttempt(self.retry_policy, self.deadline)
+        while True:
+            yield await run(attempt.timeout(self.remaining_time(timeout)))
+            delay = attempt.next_delay()
+            if delay is None:
+                self.check_deadline()
+                return
+            _LOGGER.debug("Waiting for %s seconds before retrying", delay)
+            await asyncio.sleep(delay)
+            attempt.number += 1
+
+    async def _start_gatttool(self, args, timeout: float, stderr: int):
+        """Start gatttool in its own process group."""
+        cmd = [
+            "gatttool",
+            "--device={}".format(self._mac),
+            "--addr-type={}".format(self.address_type),
+            "--adapter={}".format(self.adapter),
+        ] + args
+        _LOGGER.debug("Running gatttool with a timeout of %d: %s", timeout, cmd)
+        try:
+            return await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=stderr,
+                start_new_session=True,
+            )
+        except OSError as exception:
+            raise BluetoothBackendException() from exception
+
+    async def _listen(
+        self, args, deliver: Callable[[bytes], bool], max_count, timeout: float
+    ) -> bool:
+        """Run "gatttool --listen" once and deliver the notifications as they arrive.
+
+        Returns True if registering for notifications was successful.
+        """
+        process = await self._start_gatttool(args, timeout, asyncio.subprocess.DEVNULL)
+        written = False
+        count = 0
+        try:
+            async for line in _read_lines(process.stdout, timeout):
+                notification = _NOTIFICATION_REGEX.search(line)
+                if notification is not None:
+                    count += 1
+                    value = bytes(
+                        [int(x, 16) for x in notification.group("value").split()]
+                    )
+                    if deliver(value) or count == max_count:
+                        break
+                elif _parse_write_output(line):
+                    written = True
+        finally:
+            if process.returncode is None:
+                # listening always hangs, stop the process group
+                _kill_process_group(process.pid)
+            await process.wait()
+        return written or count > 0
+
+    async def _run_gatttool(self, args, timeout: float) -> Tuple[str, Optional[int]]:
+        """Run gatttool once and return its output and exit code."""
+        process = await self._start_gatttool(args, timeout, asyncio.subprocess.PIPE)
+        try:
+            result = (await asyncio.wait_for(process.communicate(), timeout))[0]
+            returncode = process.returncode
+            _LOGGER.debug("Finished gatttool")
+        except asyncio.TimeoutError:
+            # send signal to the process group
+            _kill_process_group(process.pid)
+            result = (await process.communicate())[0]
+            returncode = None
+            _LOGGER.debug("Killed hanging gatttool")
+        except asyncio.CancelledError:
+            _kill_process_group(process.pid)
+            await process.wait()
+            raise
+        result = result.decode("utf-8").strip(" \n\t")
+        _LOGGER.debug('Got "%s" from gatttool', result)
+        return result, returncode
+
+
+async def _read_lines(stream, timeout: float) -> AsyncIterator[str]:
+    """Yield the lines of @stream until its end, at most for @timeout seconds."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            raw_line = await asyncio.wait_for(
+                stream.readline(), max(deadline - time.monotonic(), 0)
+            )
+        except asyncio.TimeoutError:
+            return
+        if not raw_line:
+            return
+        line = raw_line.decode("utf-8", "replace").strip(" \n\t")
+        _LOGGER.debug("Got %s from gatttool", line)
+        yield line
+
+
+def _kill_process_group(pid: int):
+    """Send SIGINT to the process group of gatttool."""
+    try:
+        os.killpg(pid, signal.SIGINT)
+    except ProcessLookupError:
+        pass
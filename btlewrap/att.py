@@ -0,0 +1,420 @@
+"""Attribute Protocol (ATT) codec and client.
+
+The codec functions only convert between values and PDUs. AttClient runs
+the request/response protocol on any connected socket-like object that
+sends and receives one PDU per call, e.g. an L2CAP SOCK_SEQPACKET socket
+on the ATT channel or one end of a socketpair in tests.
+"""
+from collections import deque
+import logging
+import socket
+import struct
+import time
+from typing import Deque, List, Optional, Tuple  # noqa: F401
+from uuid import UUID
+from btlewrap.advertisement import normalize_uuid
+from btlewrap.base import BluetoothBackendException, BluetoothTimeoutError
+
+_LOGGER = logging.getLogger(__name__)
+
+# opcodes, see Bluetooth Core Specification Vol 3, Part F, 3.4.8
+ERROR_RESPONSE = 0x01
+EXCHANGE_MTU_REQUEST = 0x02
+EXCHANGE_MTU_RESPONSE = 0x03
+READ_BY_TYPE_REQUEST = 0x08
+READ_BY_TYPE_RESPONSE = 0x09
+READ_REQUEST = 0x0A
+READ_RESPONSE = 0x0B
+READ_BLOB_REQUEST = 0x0C
+READ_BLOB_RESPONSE = 0x0D
+READ_MULTIPLE_REQUEST = 0x0E
+READ_MULTIPLE_RESPONSE = 0x0F
+WRITE_REQUEST = 0x12
+WRITE_RESPONSE = 0x13
+WRITE_COMMAND = 0x52
+HANDLE_VALUE_NOTIFICATION = 0x1B
+HANDLE_VALUE_INDICATION = 0x1D
+HANDLE_VALUE_CONFIRMATION = 0x1E
+# since Bluetooth 5.2
+READ_MULTIPLE_VARIABLE_REQUEST = 0x20
+READ_MULTIPLE_VARIABLE_RESPONSE = 0x21
+
+# requests a server may send to the client, they must be answered
+_SERVER_REQUESTS = frozenset(
+    [0x02, 0x04, 0x06, 0x08, 0x0A, 0x0C, 0x0E, 0x10, 0x12, 0x16, 0x18, 0x20]
+)
+
+DEFAULT_MTU = 23
+# largest MTU supported by the ATT bearer
+MAX_MTU = 517
+# longest attribute value
+MAX_ATTRIBUTE_LENGTH = 512
+# attribute type of characteristic declarations
+CHARACTERISTIC_DECLARATION = 0x2803
+# ATT transactions time out after 30 seconds
+TRANSACTION_TIMEOUT = 30.0
+
+ERROR_REQUEST_NOT_SUPPORTED = 0x06
+ERROR_INVALID_OFFSET = 0x07
+ERROR_ATTRIBUTE_NOT_FOUND = 0x0A
+ERROR_ATTRIBUTE_NOT_LONG = 0x0B
+
+ERROR_NAMES = {
+    0x01: "Invalid Handle",
+    0x02: "Read Not Permitted",
+    0x03: "Write Not Permitted",
+    0x04: "Invalid PDU",
+    0x05: "Insufficient Authentication",
+    0x06: "Request Not Supported",
+    0x07: "Invalid Offset",
+    0x08: "Insufficient Authorization",
+    0x09: "Prepare Queue Full",
+    0x0A: "Attribute Not Found",
+    0x0B: "Attribute Not Long",
+    0x0C: "Insufficient Encryption Key Size",
+    0x0D: "Invalid Attribute Value Length",
+    0x0E: "Unlikely Error",
+    0x0F: "Insufficient Encryption",
+    0x10: "Unsupported Group Type",
+    0x11: "Insufficient Resources",
+}
+
+
+class AttError(BluetoothBackendException):
+    """The device answered a request with an ATT Error Response."""
+
+    def __init__(self, request_opcode: int, handle: int, code: int):
+        super().__init__(
+            "ATT request 0x{:02x} on handle 0x{:04x} failed: {} (0x{:02x})".format(
+                request_opcode, handle, ERROR_NAMES.get(code, "Unknown Error"), code
+            )
+        )
+        self.request_opcode = request_opcode
+        self.handle = handle
+        self.code = code
+
+
+def encode_exchange_mtu(mtu: int, response: bool = False) -> bytes:
+    """Exchange MTU Request, or Response if @response is True."""
+    opcode = EXCHANGE_MTU_RESPONSE if response else EXCHANGE_MTU_REQUEST
+    return struct.pack("<BH", opcode, mtu)
+
+
+def encode_read_request(handle: int) -> bytes:
+    """Read Request for the value of @handle."""
+    return struct.pack("<BH", READ_REQUEST, handle)
+
+
+def encode_read_blob(handle: int, offset: int) -> bytes:
+    """Read Blob Request for the part of the value of @handle starting at @offset."""
+    return struct.pack("<BHH", READ_BLOB_REQUEST, handle, offset)
+
+
+def encode_read_multiple(handles: List[int], variable: bool = False) -> bytes:
+    """Read Multiple Request, or Read Multiple Variable Length Request if @variable is True."""
+    if len(handles) < 2:
+        raise ValueError("Read Multiple needs at least two handles")
+    opcode = READ_MULTIPLE_VARIABLE_REQUEST if variable else READ_MULTIPLE_REQUEST
+    return struct.pack("<B{}H".format(len(handles)), opcode, *handles)
+
+
+def encode_read_by_type(start: int, end: int, attribute_type: int) -> bytes:
+    """Read By Type Request for the attributes of a 16 bit type between two handles."""
+    return struct.pack("<BHHH", READ_BY_TYPE_REQUEST, start, end, attribute_type)
+
+
+def encode_write(handle: int, value: bytes, command: bool = False) -> bytes:
+    """Write Request, or Write Command without response if @command is True."""
+    opcode = WRITE_COMMAND if command else WRITE_REQUEST
+    return struct.pack("<BH", opcode, handle) + bytes(value)
+
+
+def encode_handle_value(handle: int, value: bytes, indication: bool = False) -> bytes:
+    """Handle Value Notification, or Indication if @indication is True."""
+    opcode = HANDLE_VALUE_INDICATION if indication else HANDLE_VALUE_NOTIFICATION
+    return struct.pack("<BH", opcode, handle) + bytes(value)
+
+
+def encode_error(request_opcode: int, handle: int, code: int) -> bytes:
+    """Error Response to a request."""
+    return struct.pack("<BBHB", ERROR_RESPONSE, request_opcode, handle, code)
+
+
+def decode_error(pdu: bytes) -> AttError:
+    """Get the AttError of an Error Response."""
+    if len(pdu) < 5:
+        raise BluetoothBackendException("Invalid ATT error response")
+    _, request_opcode, handle, code = struct.unpack_from("<BBHB", pdu)
+    return AttError(request_opcode, handle, code)
+
+
+def decode_handle_value(pdu: bytes) -> Tuple[int, bytes]:
+    """Get (handle, value) of a notification, an indication or a request with a handle."""
+    if len(pdu) < 3:
+        raise BluetoothBackendException("Invalid ATT PDU 0x{:02x}".format(pdu[0]))
+    return struct.unpack_from("<H", pdu, 1)[0], bytes(pdu[3:])
+
+
+def decode_length_values(pdu: bytes) -> List[Tuple[int, bytes]]:
+    """Get the (length, value) tuples of a Read Multiple Variable Length Response.
+
+    The response ends after mtu - 1 bytes, so the last value may be shorter
+    than its length and values of further handles may be missing.
+    """
+    result = []
+    offset = 1
+    while offset + 2 <= len(pdu):
+        length = struct.unpack_from("<H", pdu, offset)[0]
+        offset += 2
+        end = offset + length
+        result.append((length, bytes(pdu[offset:end])))
+        offset = end
+    return result
+
+
+def decode_read_by_type(pdu: bytes) -> List[Tuple[int, bytes]]:
+    """Get the (handle, value) pairs of a Read By Type Response."""
+    if len(pdu) < 2 or pdu[1] < 2:
+        raise BluetoothBackendException("Invalid ATT Read By Type response")
+    size = pdu[1]
+    result = []
+    for offset in range(2, len(pdu) - size + 1, size):
+        value_start = offset + 2
+        end = offset + size
+        result.append(
+            (struct.unpack_from("<H", pdu, offset)[0], bytes(pdu[value_start:end]))
+        )
+    return result
+
+
+def decode_characteristic(value: bytes) -> Tuple[int, int, str]:
+    """Get (properties, value handle, uuid) of a characteristic declaration."""
+    if len(value) == 5:
+        uuid = normalize_uuid(struct.unpack_from("<H", value, 3)[0])
+    elif len(value) == 19:
+        uuid = str(UUID(bytes=bytes(reversed(value[3:]))))
+    else:
+        raise BluetoothBackendException("Invalid characteristic declaration")
+    properties, value_handle = struct.unpack_from("<BH", value)
+    return properties, value_handle, uuid
+
+
+def decode_mtu(pdu: bytes) -> int:
+    """Get the MTU of an Exchange MTU Request or Response."""
+    if len(pdu) < 3:
+        raise BluetoothBackendException("Invalid ATT MTU exchange")
+    return struct.unpack_from("<H", pdu, 1)[0]
+
+
+class AttClient:
+    """ATT client on a connected socket.
+
+    Only one request is outstanding at a time. Notifications and
+    indications arriving in the meantime are queued, at most
+    @buffer_size of them, indications are confirmed right away. If the
+    queue is full the oldest notification is dropped, self.dropped counts
+    them.
+    """
+
+    def __init__(self, sock, buffer_size: int = 256):
+        self._sock = sock
+        self.mtu = DEFAULT_MTU
+        self.notifications = deque(maxlen=buffer_size)  # type: Deque[Tuple[int, bytes]]
+        self.dropped = 0
+
+    def close(self):
+        """Close the socket."""
+        self._sock.close()
+
+    def exchange_mtu(self, mtu: int, timeout: float = TRANSACTION_TIMEOUT) -> int:
+        """Negotiate the MTU, return the MTU used from now on."""
+        response = self.request(
+            encode_exchange_mtu(mtu), EXCHANGE_MTU_RESPONSE, timeout
+        )
+        self.mtu = max(min(mtu, decode_mtu(response)), DEFAULT_MTU)
+        return self.mtu
+
+    def read(self, handle: int, timeout: float = TRANSACTION_TIMEOUT) -> bytes:
+        """Read the value of @handle.
+
+        Values longer than mtu - 1 bytes are truncated by the device.
+        """
+        return self.request(encode_read_request(handle), READ_RESPONSE, timeout)[1:]
+
+    def read_blob(
+        self, handle: int, offset: int, timeout: float = TRANSACTION_TIMEOUT
+    ) -> bytes:
+        """Read the part of the value of @handle starting at @offset."""
+        return self.request(
+            encode_read_blob(handle, offset), READ_BLOB_RESPONSE, timeout
+        )[1:]
+
+    def read_long(
+        self, handle: int, buffer: bytearray, timeout: float = TRANSACTION_TIMEOUT
+    ) -> int:
+        """Read a value of any length into @buffer, return its length.
+
+        The value is read with a Read Request, followed by Read Blob Requests
+        as long as the responses are full. The parts are copied into @buffer,
+        a bytearray or writable memoryview, so it must be large enough for
+        the value. @timeout is the time for all requests together.
+        """
+        view = memoryview(buffer)
+        deadline = time.monotonic() + timeout
+        response = self.request(encode_read_request(handle), READ_RESPONSE, timeout)
+        offset = 0
+        while True:
+            size = len(response) - 1
+            end = offset + size
+            if end > len(view):
+                raise BluetoothBackendException(
+                    "Value of handle 0x{:04x} is longer than {} bytes".format(
+                        handle, len(view)
+                    )
+                )
+            view[offset:end] = memoryview(response)[1:]
+            offset = end
+            if size < self.mtu - 1:
+                return offset
+            try:
+                response = self.request(
+                    encode_read_blob(handle, offset),
+                    READ_BLOB_RESPONSE,
+                    deadline - time.monotonic(),
+                )
+            except AttError as error:
+                # the value ended exactly at the end of the last response
+                if error.code in (ERROR_INVALID_OFFSET, ERROR_ATTRIBUTE_NOT_LONG):
+                    return offset
+                raise
+
+    def read_by_type(
+        self,
+        start: int,
+        end: int,
+        attribute_type: int,
+        timeout: float = TRANSACTION_TIMEOUT,
+    ) -> List[Tuple[int, bytes]]:
+        """Read (handle, value) of attributes of a type, as many as fit into one response."""
+        return decode_read_by_type(
+            self.request(
+                encode_read_by_type(start, end, attribute_type),
+                READ_BY_TYPE_RESPONSE,
+                timeout,
+            )
+        )
+
+    def read_multiple(
+        self, handles: List[int], timeout: float = TRANSACTION_TIMEOUT
+    ) -> bytes:
+        """Read the values of @handles with one request.
+
+        The response is the concatenation of the values, at most mtu - 1 bytes.
+        """
+        return self.request(
+            encode_read_multiple(handles), READ_MULTIPLE_RESPONSE, timeout
+        )[1:]
+
+    def read_multiple_variable(
+        self, handles: List[int], timeout: float = TRANSACTION_TIMEOUT
+    ) -> List[Tuple[int, bytes]]:
+        """Read the values of @handles with one request, see decode_length_values."""
+        return decode_length_values(
+            self.request(
+                encode_read_multiple(handles, variable=True),
+                READ_MULTIPLE_VARIABLE_RESPONSE,
+                timeout,
+            )
+        )
+
+    def write(self, handle: int, value: bytes, timeout: float = TRANSACTION_TIMEOUT):
+        """Write @value to @handle and wait for the Write Response."""
+        self.request(encode_write(handle, value), WRITE_RESPONSE, timeout)
+
+    def write_command(
+        self, handle: int, value: bytes, timeout: float = TRANSACTION_TIMEOUT
+    ):
+        """Write @value to @handle without waiting for a response.
+
+        Blocks for up to @timeout seconds while the send buffer of the socket
+        is full, which limits how far the commands get ahead of the device.
+        """
+        self._send(encode_write(handle, value, command=True), timeout)
+
+    def request(self, pdu: bytes, response_opcode: int, timeout: float) -> bytes:
+        """Send a request and wait for its response PDU.
+
+        Raises an AttError if the device answers with an Error Response.
+        """
+        self._send(pdu, timeout)
+        deadline = time.monotonic() + timeout
+        while True:
+            response = self._receive(deadline - time.monotonic())
+            if response is None:
+                raise BluetoothTimeoutError(
+                    "No response to ATT request 0x{:02x}".format(pdu[0])
+                )
+            if response[0] == response_opcode:
+                return response
+            if response[0] == ERROR_RESPONSE and response[1] == pdu[0]:
+                raise decode_error(response)
+            _LOGGER.debug("Ignoring unexpected ATT PDU 0x%02x", response[0])
+
+    def next_notification(self, timeout: float) -> Optional[Tuple[int, bytes]]:
+        """Get the next (handle, value) notification, None after @timeout seconds."""
+        deadline = time.monotonic() + timeout
+        while not self.notifications:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._receive(remaining) is None:
+                break
+        if self.notifications:
+            return self.notifications.popleft()
+        return None
+
+    def _send(self, pdu: bytes, timeout: float = TRANSACTION_TIMEOUT):
+        try:
+            self._sock.settimeout(max(timeout, 0.0001))
+            self._sock.send(pdu)
+        except socket.timeout as exception:
+            raise BluetoothTimeoutError(
+                "Timeout while sending ATT PDU 0x{:02x}".format(pdu[0])
+            ) from exception
+        except OSError as exception:
+            raise BluetoothBackendException("Sending ATT PDU failed") from exception
+
+    def _queue_notification(self, notification: Tuple[int, bytes]):
+        if len(self.notifications) == self.notifications.maxlen:
+            self.dropped += 1
+            _LOGGER.warning(
+                "Notification buffer is full, dropped %d notifications so far",
+                self.dropped,
+            )
+        self.notifications.append(notification)
+
+    def _receive(self, timeout: float) -> Optional[bytes]:
+        """Receive one PDU, handle PDUs that do not belong to a request.
+
+        Returns None on timeout, notifications and requests of the server
+        are handled and returned as well.
+        """
+        try:
+            self._sock.settimeout(max(timeout, 0.0001))
+            pdu = self._sock.recv(MAX_MTU)
+        except socket.timeout:
+            return None
+        except OSError as exception:
+            raise BluetoothBackendException("Receiving ATT PDU failed") from exception
+        if not pdu:
+            raise BluetoothBackendException("Connection closed by the device")
+        opcode = pdu[0]
+        if opcode in (HANDLE_VALUE_NOTIFICATION, HANDLE_VALUE_INDICATION):
+            self._queue_notification(decode_handle_value(pdu))
+            if opcode == HANDLE_VALUE_INDICATION:
+                self._send(bytes([HANDLE_VALUE_CONFIRMATION]))
+        elif opcode == EXCHANGE_MTU_REQUEST:
+            self._send(encode_exchange_mtu(self.mtu, response=True))
+        elif opcode in _SERVER_REQUESTS:
+            # this client has no attributes of its own
+            handle = struct.unpack_from("<H", pdu, 1)[0] if len(pdu) >= 3 else 0
+            self._send(encode_error(opcode, handle, ERROR_REQUEST_NOT_SUPPORTED))
+        return pdu
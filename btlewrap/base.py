@@ -1,12 +1,60 @@
 """Bluetooth Backends available for miflora and other btle sensors."""
-from threading import Lock
-from typing import List, Tuple, Optional
+from contextlib import contextmanager
+import logging
+from queue import Queue, Empty, Full
+from threading import Event, Lock, Thread, Timer
+import time
+from typing import (  # noqa: F401
+    TYPE_CHECKING,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Tuple,
+    Optional,
+)
+from btlewrap.advertisement import AdvertisementRecord
+from btlewrap.breaker import CircuitBreaker
+from btlewrap.cache import CachingBackend, ReadCache
+from btlewrap.metrics import MeteredBackend, MetricsSink, metric_labels
+from btlewrap.registry import DeviceRegistry
+from btlewrap.retry import RetryPolicy
+
+if TYPE_CHECKING:
+    # btlewrap.adapterlock and btlewrap.discovery import this module
+    from btlewrap.adapterlock import AdapterLock, AdapterTicket  # noqa: F401
+    from btlewrap.discovery import DiscoveryCache  # noqa: F401
+
+# retry policy while a circuit breaker probes a device
+_PROBE_POLICY = RetryPolicy(max_attempts=1)
+
+# seconds the consumer waits for a notification worker to stop
+_WORKER_STOP_GRACE = 0.5
+
+_LOGGER = logging.getLogger(__name__)
 
 
 class BluetoothInterface:
     """Wrapper around the bluetooth adapters.
 
     This class takes care of locking and the context managers.
+    With a ReadCache, reads of cached handles are answered without
+    talking to the device. With linger > 0 the connection is kept open
+    for linger seconds after the context was closed, so that the next
+    connect() to the same mac does not have to reconnect.
+    The outcomes of all connections are recorded in the DeviceRegistry, if
+    one is given. With max_absence, connecting to a device that was not seen
+    for max_absence seconds fails right away, except for one probe every
+    max_absence seconds.
+    With a MetricsSink, lock waits, connects, operations, retries and
+    timeouts are measured, see btlewrap.metrics.
+    With a CircuitBreaker, devices that failed repeatedly are not connected
+    for a while, connect() raises a CircuitOpenError right away instead.
+    With a DiscoveryCache, the connections offer read_uuid() and
+    write_uuid(), see btlewrap.discovery.
+    With an AdapterLock, connections also wait for the connections of other
+    processes on the same adapter, see btlewrap.adapterlock. A lingering
+    connection holds it until the connection is closed.
     """
 
     def __init__(
@@ -15,65 +63,415 @@ class BluetoothInterface:
         *,
         adapter: str = "hci0",
         address_type: str = "public",
+        read_cache: Optional[ReadCache] = None,
+        linger: float = 0,
+        registry: Optional[DeviceRegistry] = None,
+        max_absence: Optional[float] = None,
+        metrics: Optional[MetricsSink] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        discovery_cache: Optional["DiscoveryCache"] = None,
+        adapter_lock: Optional["AdapterLock"] = None,
         **kwargs
     ):
         self._backend = backend(adapter=adapter, address_type=address_type, **kwargs)
         self._backend.check_backend()
+        self._backend.metrics = metrics
+        self._backend.breaker = breaker
+        self.read_cache = read_cache
+        self.discovery_cache = discovery_cache
+        self.adapter_lock = adapter_lock
+        self.registry = registry
+        self.max_absence = max_absence
+        self._keep_alive = None  # type: Optional[_KeepAlive]
+        if linger > 0:
+            self._keep_alive = _KeepAlive(self._backend, linger, adapter_lock)
 
     def __del__(self):
         if self.is_connected():
             self._backend.disconnect()
 
-    def connect(self, mac) -> "_BackendConnection":
-        """Connect to the sensor."""
-        return _BackendConnection(self._backend, mac)
+    def close(self):
+        """Close a lingering connection right away."""
+        if self._keep_alive is not None:
+            self._keep_alive.close()
 
-    @staticmethod
-    def is_connected() -> bool:
-        """Check if we are connected to the sensor."""
-        return _BackendConnection.is_connected()
+    def connect(
+        self,
+        mac,
+        timeout: Optional[float] = None,
+        *,
+        model: Optional[str] = None,
+        firmware: Optional[str] = None
+    ) -> "_BackendConnection":
+        """Connect to the sensor.
+
+        With a @timeout, waiting for the adapter, connecting and all
+        operations in the context, including their retries, must finish
+        within @timeout seconds. Otherwise a BluetoothTimeoutError is raised.
+        @model and @firmware select the mapping of the DiscoveryCache, devices
+        with the same model and firmware share it.
+        """
+        discovery = None
+        if self.discovery_cache is not None:
+            discovery = (
+                self.discovery_cache,
+                self.discovery_cache.key(mac, model, firmware),
+            )
+        return _BackendConnection(
+            self._backend,
+            mac,
+            self.read_cache,
+            self._keep_alive,
+            registry=self.registry,
+            max_absence=self.max_absence,
+            metrics=self._backend.metrics,
+            breaker=self._backend.breaker,
+            timeout=timeout,
+            discovery=discovery,
+            adapter_lock=self.adapter_lock,
+        )
+
+    def connection_stats(self) -> Dict[str, int]:
+        """Get the number of real connects, reused and closed connections.
+
+        Only available with linger > 0.
+        """
+        if self._keep_alive is None:
+            return {}
+        return self._keep_alive.stats()
+
+    def is_connected(self) -> bool:
+        """Check if we are connected to a sensor on this adapter."""
+        return _BackendConnection.is_connected(self._backend.adapter)
 
 
 class _BackendConnection:  # pylint: disable=too-few-public-methods
     """Context Manager for a bluetooth connection.
 
     This creates the context for the connection and manages locking.
+    There is one lock per adapter, so that connections on different
+    adapters can be used in parallel. An AdapterLock is taken after it,
+    so only one thread per process queues for the other processes.
     """
 
-    _lock = Lock()
+    _locks = {}  # type: Dict[Optional[str], Lock]
+    _locks_lock = Lock()
 
-    def __init__(self, backend: "AbstractBackend", mac: str):
+    def __init__(
+        self,
+        backend: "AbstractBackend",
+        mac: str,
+        read_cache: Optional[ReadCache] = None,
+        keep_alive: Optional["_KeepAlive"] = None,
+        *,
+        registry: Optional[DeviceRegistry] = None,
+        max_absence: Optional[float] = None,
+        metrics: Optional[MetricsSink] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        timeout: Optional[float] = None,
+        discovery: Optional[Tuple["DiscoveryCache", Tuple[str, str]]] = None,
+        adapter_lock: Optional["AdapterLock"] = None
+    ):
         self._backend = backend  # type: AbstractBackend
         self._mac = mac  # type: str
+        self._read_cache = read_cache
+        self._keep_alive = keep_alive
+        self._registry = registry
+        self._max_absence = max_absence
+        self._metrics = metrics
+        self._breaker = breaker
+        self._timeout = timeout
+        self._discovery = discovery
+        self._previous_deadline = None  # type: Optional[float]
+        self._lock = self._adapter_lock(backend.adapter)
         self._has_lock = False
+        self._process_lock = adapter_lock
+        self._ticket = None  # type: Optional[AdapterTicket]
+
+    @classmethod
+    def _adapter_lock(cls, adapter: Optional[str]) -> Lock:
+        """Get the lock for an adapter, create it if required."""
+        with cls._locks_lock:
+            if adapter not in cls._locks:
+                cls._locks[adapter] = Lock()
+            return cls._locks[adapter]
 
     def __enter__(self) -> "AbstractBackend":
-        self._lock.acquire()
-        self._has_lock = True
+        self._check_absence()
+        probing = self._check_circuit()
+        start = time.monotonic()
+        deadline = None if self._timeout is None else start + self._timeout
+        try:
+            self._acquire_lock(deadline)
+        except:  # noqa: E722
+            # waiting for the adapter says nothing about the device
+            self._release_probe(probing)
+            raise
+        self._observe("lock_wait_seconds", "connect", start)
+        start = time.monotonic()
         try:
-            self._backend.connect(self._mac)
+            self._previous_deadline = self._backend.deadline
+            if deadline is not None:
+                self._backend.deadline = deadline
+            _KeepAlive.close_lingering(self._backend.adapter, self._keep_alive)
+            if self._keep_alive is not None:
+                self._keep_alive.connect(self._mac)
+            else:
+                self._backend.connect(self._mac)
         # release lock on any exceptions otherwise it will never be unlocked
         except:  # noqa: E722
-            self._cleanup()
+            self._record(False)
+            self._count_metric("errors_total", "connect")
+            self._cleanup(failed=True)
             raise
-        return self._backend
+        self._observe("connect_seconds", "connect", start)
+        backend = self._backend
+        # cache hits are not measured, they never reach the device
+        if self._metrics is not None:
+            backend = MeteredBackend(
+                backend, self._mac, self._metrics, type(self._backend).__name__
+            )
+        if self._read_cache is not None:
+            backend = CachingBackend(backend, self._mac, self._read_cache)
+        if self._discovery is not None:
+            cache, key = self._discovery
+            backend = cache.resolver(backend, key)
+        return backend
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self._cleanup()
+        self._record(
+            exc_type is None or not issubclass(exc_type, BluetoothBackendException)
+        )
+        self._cleanup(failed=exc_type is not None)
+
+    def _check_absence(self):
+        """Fail fast if the device was not seen for a while."""
+        if self._registry is None or self._max_absence is None:
+            return
+        if self._registry.should_skip(self._mac, self._max_absence):
+            raise BluetoothBackendException(
+                "Device {} was not seen in the last {} seconds.".format(
+                    self._mac, self._max_absence
+                )
+            )
+
+    def _acquire_lock(self, deadline: Optional[float]):
+        """Wait for the adapter lock, at most until @deadline."""
+        if deadline is None:
+            self._lock.acquire()
+        elif not self._lock.acquire(timeout=max(deadline - time.monotonic(), 0)):
+            self._count_metric("timeouts_total", "lock")
+            raise BluetoothTimeoutError(
+                "Timeout while waiting for adapter {}.".format(self._backend.adapter)
+            )
+        if self._process_lock is not None:
+            try:
+                self._acquire_ticket(deadline)
+            except BluetoothTimeoutError:
+                self._lock.release()
+                self._count_metric("timeouts_total", "lock")
+                raise
+            except:  # noqa: E722
+                self._lock.release()
+                raise
+        self._has_lock = True
+
+    def _acquire_ticket(self, deadline: Optional[float]):
+        """Get the place in the queue of the AdapterLock.
+
+        A lingering connection of this process holds a ticket that it only
+        gives back when it is closed. It is closed first, or its ticket is
+        taken over if the connection is reused.
+        """
+        _KeepAlive.close_lingering(self._backend.adapter, self._keep_alive)
+        if self._keep_alive is not None:
+            self._ticket = self._keep_alive.take_ticket()
+        if self._ticket is None:
+            self._ticket = self._process_lock.acquire(self._backend.adapter, deadline)
+
+    def _release_probe(self, probing: bool):
+        if probing:
+            self._breaker.release_probe(self._mac)
+
+    def _check_circuit(self) -> bool:
+        """Fail fast if the circuit breaker is open for the device.
+
+        Returns True if this connection is the probe of a half open circuit.
+        """
+        if self._breaker is None:
+            return False
+        retry_in = self._breaker.check(self._mac)
+        if retry_in is not None:
+            self._count_metric("rejected_total", "connect")
+            raise CircuitOpenError(self._mac, retry_in)
+        return self._breaker.is_probing(self._mac)
+
+    def _count_metric(self, name: str, operation: str):
+        # pylint: disable=protected-access
+        self._backend._count_metric(name, operation, self._mac)
+
+    def _observe(self, name: str, operation: str, start: float):
+        """Add the time since @start to a histogram, if metrics are enabled."""
+        if self._metrics is not None:
+            self._metrics.observe(
+                name,
+                time.monotonic() - start,
+                metric_labels(
+                    type(self._backend).__name__,
+                    self._backend.adapter,
+                    self._mac,
+                    operation,
+                ),
+            )
+
+    def _record(self, success: bool):
+        if self._breaker is not None:
+            self._breaker.record(self._mac, success)
+        if self._registry is not None:
+            self._registry.record_connection(
+                self._mac, success, self._backend.address_type
+            )
 
     def __del__(self):
-        self._cleanup()
+        self._cleanup(failed=True)
 
-    def _cleanup(self):
+    def _cleanup(self, failed: bool = False):
         if self._has_lock:
-            self._backend.disconnect()
-            self._lock.release()
-            self._has_lock = False
+            # disconnecting is always allowed, also after a timeout
+            self._backend.deadline = self._previous_deadline
+            try:
+                if self._keep_alive is not None:
+                    # a lingering connection gives the ticket back when it is closed
+                    ticket, self._ticket = self._ticket, None
+                    self._keep_alive.release(failed, ticket)
+                else:
+                    self._backend.disconnect()
+            finally:
+                try:
+                    if self._ticket is not None:
+                        self._process_lock.release(self._ticket)
+                        self._ticket = None
+                finally:
+                    self._lock.release()
+                    self._has_lock = False
+
+    @classmethod
+    def is_connected(cls, adapter: Optional[str]) -> bool:
+        """Check if there is a BackendConnection on the adapter."""
+        return cls._adapter_lock(adapter).locked()
+
+
+class _KeepAlive:
+    """Keeps the connection of a backend open after its context was closed.
+
+    All methods except close() are called while the adapter lock is held.
+    There is at most one lingering connection per adapter, it is closed as
+    soon as the adapter is used for anything else or after the idle timeout.
+    With an AdapterLock, the ticket of the last connection is kept until
+    the lingering connection is closed, so other processes do not use the
+    adapter while the link is up.
+    """
 
-    @staticmethod
-    def is_connected() -> bool:
-        """Check if the BackendConnection is connected."""
-        return _BackendConnection._lock.locked()  # pylint: disable=no-member
+    _lingering = {}  # type: Dict[Optional[str], _KeepAlive]
+
+    def __init__(
+        self,
+        backend: "AbstractBackend",
+        idle_timeout: float,
+        adapter_lock: Optional["AdapterLock"] = None,
+    ):
+        self._backend = backend
+        self._idle_timeout = idle_timeout
+        self._adapter_lock = adapter_lock
+        self._ticket = None  # type: Optional[AdapterTicket]
+        self._mac = None  # type: Optional[str]
+        self._timer = None  # type: Optional[Timer]
+        self._stats = {"connects": 0, "reuses": 0, "disconnects": 0}
+
+    @classmethod
+    def close_lingering(cls, adapter: Optional[str], keep: Optional["_KeepAlive"]):
+        """Close a lingering connection on the adapter, unless it is @keep."""
+        lingering = cls._lingering.pop(adapter, None)
+        if lingering is not None and lingering is not keep:
+            lingering.disconnect()
+
+    def connect(self, mac: str):
+        """Connect to @mac, reuse the open connection if possible."""
+        self._cancel_timer()
+        if self._mac is not None and self._mac.upper() == mac.upper():
+            self._stats["reuses"] += 1
+            return
+        self.disconnect()
+        self._backend.connect(mac)
+        self._mac = mac
+        self._stats["connects"] += 1
+
+    def release(self, failed: bool, ticket: Optional["AdapterTicket"] = None):
+        """The context was closed, keep the connection for the idle timeout.
+
+        The @ticket of the AdapterLock is given back when the connection is
+        closed.
+        """
+        self._ticket = ticket
+        if failed or self._mac is None:
+            self.disconnect()
+            return
+        self._lingering[self._backend.adapter] = self
+        self._timer = Timer(self._idle_timeout, self._expire)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def take_ticket(self) -> Optional["AdapterTicket"]:
+        """Take over the ticket of the AdapterLock to reuse the connection."""
+        ticket, self._ticket = self._ticket, None
+        return ticket
+
+    def disconnect(self):
+        """Really disconnect from the device."""
+        self._cancel_timer()
+        try:
+            if self._mac is not None:
+                self._mac = None
+                self._stats["disconnects"] += 1
+                self._backend.disconnect()
+        finally:
+            ticket = self.take_ticket()
+            if ticket is not None:
+                self._adapter_lock.release(ticket)
+
+    def close(self):
+        """Close a lingering connection."""
+        lock = _BackendConnection._adapter_lock(  # pylint: disable=protected-access
+            self._backend.adapter
+        )
+        with lock:
+            if self._lingering.get(self._backend.adapter) is self:
+                del self._lingering[self._backend.adapter]
+            self.disconnect()
+
+    def stats(self) -> Dict[str, int]:
+        """Get the connection statistics."""
+        return dict(self._stats)
+
+    def _expire(self):
+        lock = _BackendConnection._adapter_lock(  # pylint: disable=protected-access
+            self._backend.adapter
+        )
+        # if the adapter is busy, whoever holds it takes care of this connection
+        if not lock.acquire(blocking=False):
+            return
+        try:
+            if self._lingering.get(self._backend.adapter) is self:
+                del self._lingering[self._backend.adapter]
+                self._timer = None
+                self.disconnect()
+        finally:
+            lock.release()
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
 
 
 class BluetoothBackendException(Exception):
@@ -82,6 +480,109 @@ class BluetoothBackendException(Exception):
     This is a wrapper for other exception specific to each library."""
 
 
+class BluetoothTimeoutError(BluetoothBackendException):
+    """An operation did not finish within its timeout or deadline."""
+
+
+class CircuitOpenError(BluetoothBackendException):
+    """The circuit breaker does not allow to connect to the device right now."""
+
+    def __init__(self, mac: str, retry_in: float):
+        super().__init__(
+            "Circuit of {} is open after repeated failures, "
+            "next try in {:.0f} seconds.".format(mac, retry_in)
+        )
+        self.mac = mac
+        self.retry_in = retry_in
+
+
+class _DeviceScan:
+    """Deduplicates the devices found by a scan.
+
+    Only one entry per mac is kept, so the memory stays bounded even if a
+    device is reported thousands of times.
+    """
+
+    def __init__(
+        self,
+        targets: Optional[Iterable[str]] = None,
+        max_devices: Optional[int] = None,
+        unknown_name: Optional[str] = None,
+    ):
+        self._targets = None if targets is None else {mac.upper() for mac in targets}
+        self._max_devices = max_devices
+        self._unknown_name = unknown_name
+        self._devices = {}  # type: Dict[str, Tuple[str, str]]
+
+    def add(self, mac: str, name: str) -> bool:
+        """Add a device, return True if it is new or its name is known now."""
+        known = self._devices.get(mac.upper())
+        if known is not None and known[1] != self._unknown_name:
+            return False
+        if known is not None and name == self._unknown_name:
+            return False
+        self._devices[mac.upper()] = (mac, name)
+        return True
+
+    def complete(self) -> bool:
+        """Check if all targets or the maximum number of devices were found."""
+        if self._max_devices is not None and len(self._devices) >= self._max_devices:
+            return True
+        return self._targets is not None and self._targets.issubset(self._devices)
+
+    def devices(self) -> List[Tuple[str, str]]:
+        """Get (mac, name) of all devices that were found."""
+        return list(self._devices.values())
+
+
+class _ListeningStopped(Exception):
+    """Raised by _NotificationBuffer to end wait_for_notification early."""
+
+
+class _NotificationBuffer:
+    """Bounded buffer between a thread receiving notifications and a consumer.
+
+    It is used as delegate for wait_for_notification. Producers give up once
+    the consumer stopped, so they never block forever on a full buffer, and
+    the next notification after that ends wait_for_notification.
+    """
+
+    def __init__(self, buffer_size: int):
+        self._queue = Queue(maxsize=buffer_size)  # type: Queue
+        self._stopped = Event()
+
+    def handleNotification(
+        self, handle: int, value: bytes
+    ):  # pylint: disable=invalid-name
+        """Called by the backend for every notification."""
+        if self._stopped.is_set():
+            raise _ListeningStopped()
+        self.put((handle, value))
+
+    def put(self, item):
+        """Add a notification, an exception or None for the end of the stream."""
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except Full:
+                pass
+
+    def get(self, timeout: float) -> Optional[Tuple[int, bytes]]:
+        """Get the next notification, None if there are no more."""
+        try:
+            item = self._queue.get(timeout=max(timeout, 0))
+        except Empty:
+            return None
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def stop(self):
+        """The consumer does not want more notifications."""
+        self._stopped.set()
+
+
 class AbstractBackend:
     """Abstract base class for talking to Bluetooth LE devices.
 
@@ -90,11 +591,75 @@ class AbstractBackend:
 
     _DATA_MODE_LISTEN = bytes([0x01, 0x00])
 
+    # set by BluetoothInterface, None disables the metrics
+    metrics = None  # type: Optional[MetricsSink]
+    # set by BluetoothInterface, None disables the circuit breaker
+    breaker = None  # type: Optional[CircuitBreaker]
+    # time.monotonic() timestamp limiting all operations, see time_limit()
+    deadline = None  # type: Optional[float]
+
     def __init__(self, adapter: str, address_type: str, **kwargs):
         self.adapter = adapter
         self.address_type = address_type
         self.kwargs = kwargs
 
+    def _count_metric(self, name: str, operation: str, mac: Optional[str] = None):
+        """Increment the counter @name, e.g. retries_total, if metrics are enabled."""
+        if self.metrics is not None:
+            self.metrics.increment(
+                name, metric_labels(type(self).__name__, self.adapter, mac, operation)
+            )
+
+    @contextmanager
+    def time_limit(self, timeout: Optional[float]):
+        """Limit all operations in the context to @timeout seconds in total.
+
+        This includes their retries and the delays between them. Operations
+        that cannot finish in time raise a BluetoothTimeoutError.
+        """
+        previous = self.deadline
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+            if previous is None or deadline < previous:
+                self.deadline = deadline
+        try:
+            yield self
+        finally:
+            self.deadline = previous
+
+    def check_deadline(self):
+        """Raise a BluetoothTimeoutError if the deadline has passed."""
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise BluetoothTimeoutError("Deadline of the operation exceeded.")
+
+    def remaining_time(self, timeout: Optional[float] = None) -> Optional[float]:
+        """Limit @timeout to the time left until the deadline.
+
+        Returns @timeout if there is no deadline and raises a
+        BluetoothTimeoutError if the deadline has passed.
+        """
+        if self.deadline is None:
+            return timeout
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            raise BluetoothTimeoutError("Deadline of the operation exceeded.")
+        return remaining if timeout is None else min(timeout, remaining)
+
+    def _effective_retry_policy(
+        self, policy: RetryPolicy, mac: Optional[str]
+    ) -> RetryPolicy:
+        """Get the retry policy for an operation on @mac.
+
+        While the circuit breaker probes the device, a single attempt is made.
+        """
+        if (
+            self.breaker is not None
+            and mac is not None
+            and self.breaker.is_probing(mac)
+        ):
+            return _PROBE_POLICY
+        return policy
+
     def connect(self, mac: str):
         """connect to a device with the given @mac.
 
@@ -105,10 +670,12 @@ class AbstractBackend:
 
         Only required by some backends"""
 
-    def write_handle(self, handle: int, value: bytes):
+    def write_handle(self, handle: int, value: bytes, response: bool = True):
         """Write a value to a handle.
 
-        You must be connected to a device first."""
+        With @response False an ATT Write Command is sent, it does not wait
+        for the device to acknowledge the write. You must be connected to a
+        device first."""
         raise NotImplementedError
 
     def wait_for_notification(self, handle: int, delegate, notification_timeout: float):
@@ -121,12 +688,142 @@ class AbstractBackend:
         """
         raise NotImplementedError
 
+    def iter_notifications(
+        self,
+        handle: int,
+        timeout: float,
+        *,
+        max_count: Optional[int] = None,
+        idle_timeout: Optional[float] = None,
+        buffer_size: int = 64
+    ) -> Iterator[Tuple[int, bytes]]:
+        """Register for notifications on @handle and yield (handle, value) as they arrive.
+
+        Iteration ends after @timeout seconds, after @max_count notifications or
+        if no notification was received for @idle_timeout seconds. At most
+        @buffer_size notifications are buffered if the caller is slower than
+        the device.
+
+        This default implementation runs wait_for_notification in a daemon
+        thread, backends override this if they can do it natively. When the
+        iteration ends, the thread stops at the next notification. Closing
+        the iterator waits briefly for that; if the device stays silent, the
+        thread is left to end with @timeout and may still use the backend
+        until then.
+        """
+        buffer = _NotificationBuffer(buffer_size)
+
+        def _listen():
+            try:
+                self.wait_for_notification(handle, buffer, timeout)
+            except Exception as exception:  # pylint: disable=broad-except
+                buffer.put(exception)
+            else:
+                buffer.put(None)
+
+        worker = Thread(target=_listen, daemon=True)
+        worker.start()
+        deadline = time.monotonic() + timeout
+        count = 0
+        try:
+            while max_count is None or count < max_count:
+                wait = deadline - time.monotonic()
+                if idle_timeout is not None:
+                    wait = min(wait, idle_timeout)
+                item = buffer.get(wait)
+                if item is None:
+                    return
+                count += 1
+                yield item
+        finally:
+            buffer.stop()
+            worker.join(_WORKER_STOP_GRACE)
+            if worker.is_alive():
+                _LOGGER.debug(
+                    "Listening on handle 0x%04x continues until its timeout", handle
+                )
+
     def read_handle(self, handle: int) -> bytes:
         """Read a handle from the sensor.
 
         You must be connected to a device first."""
         raise NotImplementedError
 
+    def read_handles(self, handles: List[int]) -> Dict[int, bytes]:
+        """Read several handles from the sensor.
+
+        Backends override this if they can read a batch cheaper than
+        handle by handle. You must be connected to a device first."""
+        return {handle: self.read_handle(handle) for handle in handles}
+
+    def read_multiple(
+        self, handles: List[int], sizes: Optional[List[int]] = None
+    ) -> Dict[int, bytes]:
+        """Read several handles with as few requests as possible.
+
+        @sizes are the lengths of the values if they are fixed, backends
+        that send ATT requests themselves need them to split the response
+        of a Read Multiple Request. Other backends read with read_handles.
+        You must be connected to a device first."""
+        if sizes is not None and len(sizes) != len(handles):
+            raise ValueError("Expected one size per handle")
+        return self.read_handles(handles)
+
+    def read_long(self, handle: int) -> bytes:
+        """Read a value that may be longer than what fits into one ATT response.
+
+        Backends that send ATT requests themselves continue with Read Blob
+        requests, the others read with read_handle. You must be connected
+        to a device first."""
+        return self.read_handle(handle)
+
+    def discover_characteristics(self) -> Dict[str, int]:
+        """Get the value handles of the characteristics of the device by uuid.
+
+        The uuids are lower case 128 bit strings. Service discovery takes
+        several round trips, BluetoothInterface(discovery_cache=...) does it
+        once per device. You must be connected to a device first."""
+        raise NotImplementedError
+
+    def write_handles(self, values: List[Tuple[int, bytes]]):
+        """Write a sequence of (handle, value) pairs in the given order.
+
+        You must be connected to a device first."""
+        for handle, value in values:
+            self.write_handle(handle, value)
+        return True
+
+    def write_stream(
+        self, handle: int, chunks: Iterable[bytes], checkpoint_interval: int = 16
+    ) -> int:
+        """Write a stream of chunks to @handle, e.g. a firmware image.
+
+        The chunks are sent as Write Commands without waiting for the device.
+        Every @checkpoint_interval chunks, and for the last chunk, a Write
+        Request is sent instead, so at most that many chunks are in flight and
+        failures are reported. Each chunk must fit into one ATT PDU, MTU - 3
+        bytes. Returns the number of bytes written.
+
+        You must be connected to a device first."""
+        if checkpoint_interval < 1:
+            raise ValueError("checkpoint_interval must be at least 1")
+        written = 0
+        count = 0
+        pending = None  # type: Optional[bytes]
+        # look one chunk ahead to acknowledge the last one
+        for chunk in chunks:
+            if pending is not None:
+                count += 1
+                self.write_handle(
+                    handle, pending, response=count % checkpoint_interval == 0
+                )
+                written += len(pending)
+            pending = chunk
+        if pending is not None:
+            self.write_handle(handle, pending, response=True)
+            written += len(pending)
+        return written
+
     @staticmethod
     def check_backend() -> bool:
         """Check if the backend is available on the current system.
@@ -137,11 +834,54 @@ class AbstractBackend:
 
     @staticmethod
     def scan_for_devices(
-        timeout: int, adapter: Optional[str] = None
+        timeout: int,
+        adapter: Optional[str] = None,
+        *,
+        targets: Optional[Iterable[str]] = None,
+        max_devices: Optional[int] = None
     ) -> List[Tuple[str, str]]:
         """Scan for additional devices.
 
         Returns a list of all the mac addresses of Xiaomi Mi Flower sensor that could be found.
+        The scan stops early once all @targets or @max_devices devices were found.
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def iter_scan(
+        cls,
+        timeout: int,
+        adapter: Optional[str] = None,
+        *,
+        targets: Optional[Iterable[str]] = None,
+        max_devices: Optional[int] = None
+    ) -> Iterator[Tuple[str, str]]:
+        """Scan for devices and yield (mac, name) as soon as a device was found.
+
+        Every mac is yielded once, and once more if its name was unknown at
+        first. The scan stops early once all @targets or @max_devices
+        devices were found.
+
+        This default implementation yields the result of scan_for_devices,
+        backends override this if they can stream the results.
+        """
+        yield from cls.scan_for_devices(
+            timeout, adapter, targets=targets, max_devices=max_devices
+        )
+
+    @staticmethod
+    def listen_advertisements(
+        timeout: Optional[float] = None,
+        adapter: str = "hci0",
+        *,
+        macs: Optional[Iterable[str]] = None,
+        service_uuids: Optional[Iterable] = None
+    ) -> Iterator[AdvertisementRecord]:
+        """Passively listen for advertisements without connecting to the devices.
+
+        Yields one AdvertisementRecord per AD structure as the advertisements
+        arrive, only for devices in @macs and devices advertising one of the
+        @service_uuids (if given). Listens forever if @timeout is None.
         """
         raise NotImplementedError
 
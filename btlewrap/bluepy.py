@@ -1,17 +1,41 @@
 """Backend for Miflora using the bluepy library."""
+from collections import deque
+from functools import partial
 import re
 import logging
 import time
-from typing import List, Tuple, Callable
-from btlewrap.base import AbstractBackend, BluetoothBackendException
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from btlewrap.advertisement import (
+    AdvertisementFilter,
+    AdvertisementRecord,
+    parse_advertising_data,
+)
+from btlewrap.base import AbstractBackend, BluetoothBackendException, _DeviceScan
+from btlewrap.metrics import OPERATIONS
+from btlewrap.retry import RetryPolicy
 
 _LOGGER = logging.getLogger(__name__)
 RETRY_LIMIT = 3
 RETRY_DELAY = 0.1
+# seconds between checks for the timeout while listening for advertisements
+_SCAN_PROCESS_INTERVAL = 1.0
+DEFAULT_RETRY_POLICY = RetryPolicy(
+    max_attempts=RETRY_LIMIT, base_delay=RETRY_DELAY, multiplier=1
+)
+
+
+def _count_retry(backend, method: str, _error: BaseException):
+    """Count a retry of @method in the metrics of @backend."""
+    # pylint: disable=protected-access
+    backend._count_metric("retries_total", OPERATIONS.get(method, method), backend.mac)
 
 
 def wrap_exception(func: Callable) -> Callable:
-    """Decorator to wrap BTLEExceptions into BluetoothBackendException."""
+    """Decorator to wrap BTLEExceptions into BluetoothBackendException.
+
+    Failed calls are retried according to the retry_policy of the backend,
+    no retry is started after the deadline of the backend.
+    """
     try:
         # only do the wrapping if bluepy is installed.
         # otherwise it's pointless anyway
@@ -20,29 +44,135 @@ def wrap_exception(func: Callable) -> Callable:
         return func
 
     def _func_wrapper(*args, **kwargs):
-        error_count = 0
-        last_error = None
-        while error_count < RETRY_LIMIT:
-            try:
-                return func(*args, **kwargs)
-            except BTLEException as exception:
-                error_count += 1
-                last_error = exception
-                time.sleep(RETRY_DELAY)
-                _LOGGER.debug(
-                    "Call to %s failed, try %d of %d", func, error_count, RETRY_LIMIT
-                )
-        raise BluetoothBackendException() from last_error
+        policy = DEFAULT_RETRY_POLICY
+        on_retry = None
+        backend = None
+        if args and isinstance(args[0], BluepyBackend):
+            backend = args[0]
+            # pylint: disable=protected-access
+            policy = backend._effective_retry_policy(backend.retry_policy, backend.mac)
+            if backend.metrics is not None:
+                on_retry = partial(_count_retry, backend, func.__name__)
+            # disconnecting is always allowed, also after a timeout
+            if func.__name__ != "disconnect":
+                backend.check_deadline()
+        try:
+            return policy.call(
+                func,
+                *args,
+                retry_on=(BTLEException,),
+                on_retry=on_retry,
+                deadline=None if backend is None else backend.deadline,
+                **kwargs,
+            )
+        except BTLEException as exception:
+            if backend is not None:
+                backend.check_deadline()
+            raise BluetoothBackendException() from exception
 
     return _func_wrapper
 
 
+class _CollectingDelegate:  # pylint: disable=too-few-public-methods
+    """bluepy delegate that stores all notifications in a deque.
+
+    If the deque is full the oldest notification is dropped, self.dropped
+    counts them.
+    """
+
+    def __init__(self, received: deque):
+        self._received = received
+        self.dropped = 0
+
+    def handleNotification(
+        self, handle: int, value: bytes
+    ):  # pylint: disable=invalid-name
+        """Called by bluepy for every notification."""
+        if len(self._received) == self._received.maxlen:
+            self.dropped += 1
+            _LOGGER.warning(
+                "Notification buffer is full, dropped %d notifications so far",
+                self.dropped,
+            )
+        self._received.append((handle, value))
+
+
+class _DiscoveryDelegate:  # pylint: disable=too-few-public-methods
+    """bluepy scan delegate that stores what @convert makes of each device."""
+
+    def __init__(self, results: deque, convert: Callable):
+        self._results = results
+        self._convert = convert
+
+    def handleDiscovery(
+        self, device, is_new_device: bool, is_new_data: bool
+    ):  # pylint: disable=invalid-name,unused-argument
+        """Called by bluepy for every advertisement that was received."""
+        self._results.extend(self._convert(device))
+
+
+def _advertisement_structures(device) -> List[Tuple[int, bytes]]:
+    """Get the AD structures of the last advertisement of a bluepy ScanEntry."""
+    raw_data = getattr(device, "rawData", None)
+    if raw_data is not None:
+        return parse_advertising_data(raw_data)
+    return list(device.scanData.items())
+
+
+def _run_scanner(
+    scanner,
+    results: deque,
+    timeout: Optional[float],
+    passive: bool,
+    complete: Callable[[], bool] = lambda: False,
+) -> Iterator:
+    """Scan and yield the results of the delegate as they arrive."""
+    from bluepy.btle import BTLEException
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    try:
+        scanner.clear()
+        scanner.start(passive=passive)
+        try:
+            while True:
+                while results:
+                    yield results.popleft()
+                wait = _SCAN_PROCESS_INTERVAL
+                if deadline is not None:
+                    wait = min(wait, deadline - time.monotonic())
+                if wait <= 0 or complete():
+                    return
+                scanner.process(wait)
+        finally:
+            scanner.stop()
+    except BTLEException as exception:
+        raise BluetoothBackendException() from exception
+
+
+def _adapter_index(adapter: str) -> int:
+    """Get the number of an adapter name like "hci0"."""
+    match_result = re.search(r"hci([\d]+)", adapter)
+    if match_result is None:
+        raise BluetoothBackendException(
+            'Invalid pattern "{}" for BLuetooth adpater. '
+            'Expetected something like "hci0".'.format(adapter)
+        )
+    return int(match_result.group(1))
+
+
 class BluepyBackend(AbstractBackend):
     """Backend for Miflora using the bluepy library."""
 
-    def __init__(self, adapter: str = "hci0", address_type: str = "public"):
+    def __init__(
+        self,
+        adapter: str = "hci0",
+        address_type: str = "public",
+        retry_policy: Optional[RetryPolicy] = None,
+    ):
         """Create new instance of the backend."""
         super(BluepyBackend, self).__init__(adapter, address_type)
+        self.retry_policy = retry_policy or DEFAULT_RETRY_POLICY
+        self.mac = None  # type: Optional[str]
         self._peripheral = None
 
     @wrap_exception
@@ -50,13 +180,8 @@ class BluepyBackend(AbstractBackend):
         """Connect to a device."""
         from bluepy.btle import Peripheral
 
-        match_result = re.search(r"hci([\d]+)", self.adapter)
-        if match_result is None:
-            raise BluetoothBackendException(
-                'Invalid pattern "{}" for BLuetooth adpater. '
-                'Expetected something like "hci0".'.format(self.adapter)
-            )
-        iface = int(match_result.group(1))
+        self.mac = mac
+        iface = _adapter_index(self.adapter)
         self._peripheral = Peripheral(mac, iface=iface, addrType=self.address_type)
 
     @wrap_exception
@@ -67,6 +192,7 @@ class BluepyBackend(AbstractBackend):
 
         self._peripheral.disconnect()
         self._peripheral = None
+        self.mac = None
 
     @wrap_exception
     def read_handle(self, handle: int) -> bytes:
@@ -79,14 +205,51 @@ class BluepyBackend(AbstractBackend):
         return self._peripheral.readCharacteristic(handle)
 
     @wrap_exception
-    def write_handle(self, handle: int, value: bytes):
+    def write_handle(self, handle: int, value: bytes, response: bool = True):
         """Write a handle from the device.
 
         You must be connected to do this.
         """
         if self._peripheral is None:
             raise BluetoothBackendException("not connected to backend")
-        return self._peripheral.writeCharacteristic(handle, value, True)
+        return self._peripheral.writeCharacteristic(handle, value, response)
+
+    @wrap_exception
+    def read_handles(self, handles: List[int]) -> Dict[int, bytes]:
+        """Read several handles back to back.
+
+        You must be connected to do this.
+        """
+        if self._peripheral is None:
+            raise BluetoothBackendException("not connected to backend")
+        return {
+            handle: self._peripheral.readCharacteristic(handle) for handle in handles
+        }
+
+    @wrap_exception
+    def discover_characteristics(self) -> Dict[str, int]:
+        """Discover the characteristics with bluepy.
+
+        You must be connected to do this.
+        """
+        if self._peripheral is None:
+            raise BluetoothBackendException("not connected to backend")
+        handles = {}  # type: Dict[str, int]
+        for characteristic in self._peripheral.getCharacteristics():
+            handles.setdefault(str(characteristic.uuid), characteristic.getHandle())
+        return handles
+
+    @wrap_exception
+    def write_handles(self, values: List[Tuple[int, bytes]]):
+        """Write several handles back to back.
+
+        You must be connected to do this.
+        """
+        if self._peripheral is None:
+            raise BluetoothBackendException("not connected to backend")
+        for handle, value in values:
+            self._peripheral.writeCharacteristic(handle, value, True)
+        return True
 
     @wrap_exception
     def wait_for_notification(self, handle: int, delegate, notification_timeout: float):
@@ -94,7 +257,44 @@ class BluepyBackend(AbstractBackend):
             raise BluetoothBackendException("not connected to backend")
         self.write_handle(handle, self._DATA_MODE_LISTEN)
         self._peripheral.withDelegate(delegate)
-        return self._peripheral.waitForNotifications(notification_timeout)
+        return self._peripheral.waitForNotifications(
+            self.remaining_time(notification_timeout)
+        )
+
+    def iter_notifications(
+        self,
+        handle: int,
+        timeout: float,
+        *,
+        max_count: Optional[int] = None,
+        idle_timeout: Optional[float] = None,
+        buffer_size: int = 64,
+    ) -> Iterator[Tuple[int, bytes]]:
+        """Register for notifications and yield them as bluepy receives them.
+
+        See AbstractBackend.iter_notifications.
+        """
+        if self._peripheral is None:
+            raise BluetoothBackendException("not connected to backend")
+        received = deque(maxlen=buffer_size)  # type: deque
+        self.write_handle(handle, self._DATA_MODE_LISTEN)
+        self._peripheral.withDelegate(_CollectingDelegate(received))
+        deadline = time.monotonic() + self.remaining_time(timeout)
+        count = 0
+        while max_count is None or count < max_count:
+            if not received:
+                wait = deadline - time.monotonic()
+                if idle_timeout is not None:
+                    wait = min(wait, idle_timeout)
+                if wait <= 0 or not self._wait_for_notifications(wait):
+                    return
+                continue
+            count += 1
+            yield received.popleft()
+
+    @wrap_exception
+    def _wait_for_notifications(self, timeout: float) -> bool:
+        return self._peripheral.waitForNotifications(timeout)
 
     @staticmethod
     def supports_scanning() -> bool:
@@ -112,23 +312,69 @@ class BluepyBackend(AbstractBackend):
         return False
 
     @staticmethod
-    @wrap_exception
-    def scan_for_devices(timeout: float, adapter="hci0") -> List[Tuple[str, str]]:
+    def scan_for_devices(
+        timeout: float,
+        adapter="hci0",
+        *,
+        targets: Optional[Iterable[str]] = None,
+        max_devices: Optional[int] = None,
+    ) -> List[Tuple[str, str]]:
         """Scan for bluetooth low energy devices.
 
+        Note this must be run as root!"""
+        scan = _DeviceScan()
+        for mac, name in BluepyBackend.iter_scan(
+            timeout, adapter, targets=targets, max_devices=max_devices
+        ):
+            scan.add(mac, name)
+        return scan.devices()
+
+    @staticmethod
+    def iter_scan(
+        timeout: float,
+        adapter="hci0",
+        *,
+        targets: Optional[Iterable[str]] = None,
+        max_devices: Optional[int] = None,
+    ) -> Iterator[Tuple[str, str]]:
+        """Scan for bluetooth low energy devices and yield them as they are found.
+
         Note this must be run as root!"""
         from bluepy.btle import Scanner
 
-        match_result = re.search(r"hci([\d]+)", adapter)
-        if match_result is None:
-            raise BluetoothBackendException(
-                'Invalid pattern "{}" for BLuetooth adpater. '
-                'Expetected something like "hci0".'.format(adapter)
-            )
-        iface = int(match_result.group(1))
+        scan = _DeviceScan(targets, max_devices)
+
+        def _new_device(device) -> List[Tuple[str, str]]:
+            name = device.getValueText(9)
+            return [(device.addr, name)] if scan.add(device.addr, name) else []
+
+        found = deque()  # type: deque
+        scanner = Scanner(iface=_adapter_index(adapter)).withDelegate(
+            _DiscoveryDelegate(found, _new_device)
+        )
+        yield from _run_scanner(scanner, found, timeout, False, scan.complete)
+
+    @staticmethod
+    def listen_advertisements(
+        timeout: Optional[float] = None,
+        adapter: str = "hci0",
+        *,
+        macs: Optional[Iterable[str]] = None,
+        service_uuids: Optional[Iterable] = None,
+    ) -> Iterator[AdvertisementRecord]:
+        """Passively listen for advertisements with the bluepy Scanner.
+
+        Note this must be run as root!"""
+        from bluepy.btle import Scanner
+
+        adv_filter = AdvertisementFilter(macs, service_uuids)
+
+        def _records(device) -> List[AdvertisementRecord]:
+            structures = _advertisement_structures(device)
+            return adv_filter.records(device.addr, device.rssi, structures)
 
-        scanner = Scanner(iface=iface)
-        result = []
-        for device in scanner.scan(timeout):
-            result.append((device.addr, device.getValueText(9)))
-        return result
+        records = deque()  # type: deque
+        scanner = Scanner(iface=_adapter_index(adapter)).withDelegate(
+            _DiscoveryDelegate(records, _records)
+        )
+        yield from _run_scanner(scanner, records, timeout, True)
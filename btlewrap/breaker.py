@@ -0,0 +1,138 @@
+"""Circuit breaker for devices that keep failing."""
+import logging
+from threading import Lock
+import time
+from typing import Callable, Dict, Optional  # noqa: F401
+
+_LOGGER = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class _Circuit:  # pylint: disable=too-few-public-methods
+    """State of the circuit of one device."""
+
+    __slots__ = ("state", "failures", "opened_at")
+
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+
+
+class CircuitBreaker:
+    """Thread-safe circuit breaker per mac.
+
+    After @failure_threshold consecutive failed connections the circuit of a
+    device opens: BluetoothInterface.connect() fails right away with a
+    CircuitOpenError instead of blocking the adapter with retries and
+    timeouts. After @cooldown seconds one connection is let through as a
+    probe (half open), the backends make only a single attempt for it. If it
+    succeeds the circuit closes, otherwise it opens again.
+
+    @listener is called with (mac, old state, new state) on every transition.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 3,
+        cooldown: float = 300,
+        *,
+        listener: Optional[Callable[[str, str, str], None]] = None
+    ):
+        if failure_threshold < 1:
+            raise ValueError("failure_threshold must be at least 1")
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.listener = listener
+        self._circuits = {}  # type: Dict[str, _Circuit]
+        self._lock = Lock()
+
+    def state(self, mac: str) -> str:
+        """Get the state of the circuit of @mac: closed, open or half_open."""
+        circuit = self._circuits.get(mac.upper())
+        return CLOSED if circuit is None else circuit.state
+
+    def states(self) -> Dict[str, str]:
+        """Get the state of all devices whose circuit is not closed."""
+        with self._lock:
+            return {
+                mac: circuit.state
+                for mac, circuit in self._circuits.items()
+                if circuit.state != CLOSED
+            }
+
+    def is_probing(self, mac: str) -> bool:
+        """Check if the current connection to @mac is the probe of a half open circuit."""
+        return self.state(mac) == HALF_OPEN
+
+    def check(self, mac: str) -> Optional[float]:
+        """Check if connecting to @mac is allowed.
+
+        Returns None if it is, otherwise the seconds until the next probe.
+        Once the cooldown is over, the first caller gets the probe.
+        """
+        with self._lock:
+            circuit = self._circuits.get(mac.upper())
+            if circuit is None or circuit.state == CLOSED:
+                return None
+            remaining = circuit.opened_at + self.cooldown - time.monotonic()
+            if circuit.state == HALF_OPEN or remaining > 0:
+                return max(remaining, 0)
+            circuit.state = HALF_OPEN
+        self._notify(mac, OPEN, HALF_OPEN)
+        return None
+
+    def record(self, mac: str, success: bool):
+        """Add the outcome of a connection to @mac."""
+        with self._lock:
+            circuit = self._circuits.get(mac.upper())
+            if circuit is None:
+                if success:
+                    return
+                circuit = self._circuits[mac.upper()] = _Circuit()
+            old_state = circuit.state
+            if success:
+                circuit.state = CLOSED
+                circuit.failures = 0
+            else:
+                circuit.failures += 1
+                if old_state == HALF_OPEN or circuit.failures >= self.failure_threshold:
+                    circuit.state = OPEN
+                    circuit.opened_at = time.monotonic()
+        if old_state != circuit.state:
+            self._notify(mac, old_state, circuit.state)
+
+    def release_probe(self, mac: str):
+        """Give the probe of @mac back without an outcome.
+
+        Used if the probe never reached the device, e.g. because the adapter
+        was busy. The circuit opens again and the next caller gets the probe.
+        """
+        with self._lock:
+            circuit = self._circuits.get(mac.upper())
+            if circuit is None or circuit.state != HALF_OPEN:
+                return
+            circuit.state = OPEN
+            circuit.opened_at = time.monotonic() - self.cooldown
+        self._notify(mac, HALF_OPEN, OPEN)
+
+    def reset(self, mac: Optional[str] = None):
+        """Close the circuit of @mac, or of all devices if @mac is None."""
+        with self._lock:
+            if mac is None:
+                circuits = self._circuits
+                self._circuits = {}
+            else:
+                circuit = self._circuits.pop(mac.upper(), None)
+                circuits = {} if circuit is None else {mac.upper(): circuit}
+        for reset_mac, circuit in circuits.items():
+            if circuit.state != CLOSED:
+                self._notify(reset_mac, circuit.state, CLOSED)
+
+    def _notify(self, mac: str, old_state: str, new_state: str):
+        _LOGGER.info("Circuit of %s changed from %s to %s", mac, old_state, new_state)
+        if self.listener is not None:
+            self.listener(mac, old_state, new_state)
@@ -0,0 +1,184 @@
+"""Cache for handles that do not change between polls."""
+from collections import OrderedDict
+from threading import Lock
+import time
+from typing import Dict, Iterable, List, Optional, Tuple  # noqa: F401
+
+# use as ttl for handles that never change, e.g. the device name
+FOREVER = float("inf")
+
+
+class ReadCache:
+    """LRU cache for the values of handles, keyed by (mac, handle, variant).
+
+    The variant separates values of the same handle that were read in
+    different ways, e.g. long reads from plain reads, which may be truncated.
+    Only handles with a ttl > 0 are cached. The ttl of a handle is taken from
+    @ttls, all other handles use @default_ttl. At most @max_size values are
+    kept, the least recently used ones are evicted first.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 256,
+        *,
+        default_ttl: float = 0,
+        ttls: Optional[Dict[int, float]] = None
+    ):
+        self.max_size = max_size
+        self.default_ttl = default_ttl
+        self.ttls = dict(ttls or {})
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # type: OrderedDict
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def ttl(self, handle: int) -> float:
+        """Time to live in seconds for the values of a handle."""
+        return self.ttls.get(handle, self.default_ttl)
+
+    def is_cached(self, handle: int) -> bool:
+        """Check if values of this handle are cached at all."""
+        return self.ttl(handle) > 0
+
+    def get(self, mac: str, handle: int, variant: Tuple = ()) -> Optional[bytes]:
+        """Get a cached value, None if it is not cached or expired."""
+        key = (mac.upper(), handle, variant)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, mac: str, handle: int, value: bytes, variant: Tuple = ()):
+        """Store a value, if the handle is cached."""
+        ttl = self.ttl(handle)
+        if ttl <= 0:
+            return
+        key = (mac.upper(), handle, variant)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, mac: Optional[str] = None, handle: Optional[int] = None):
+        """Remove values of a mac and/or a handle, everything if both are None.
+
+        All variants of the handle are removed.
+        """
+        with self._lock:
+            for key in list(self._entries):
+                if mac is not None and key[0] != mac.upper():
+                    continue
+                if handle is not None and key[1] != handle:
+                    continue
+                del self._entries[key]
+
+    def stats(self) -> Dict[str, int]:
+        """Get hit/miss counters and the current size."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self)}
+
+
+class CachingBackend:
+    """Wraps a connected backend and answers reads from a ReadCache.
+
+    Writing a handle invalidates its cached value. All other attributes are
+    passed on to the backend.
+    """
+
+    def __init__(self, backend, mac: str, cache: ReadCache):
+        self.backend = backend
+        self._mac = mac
+        self._cache = cache
+
+    def __getattr__(self, name: str):
+        return getattr(self.backend, name)
+
+    def read_handle(self, handle: int) -> bytes:
+        """Read a handle from the cache or from the backend."""
+        return self._read(handle, (), self.backend.read_handle)
+
+    def read_long(self, handle: int, *args, **kwargs) -> bytes:
+        """Read a long value from the cache or from the backend.
+
+        Long values are cached apart from read_handle, which may truncate
+        them, and per set of arguments, e.g. max_length.
+        """
+        variant = ("long",) + args + tuple(sorted(kwargs.items()))
+        return self._read(handle, variant, self.backend.read_long, *args, **kwargs)
+
+    def _read(self, handle: int, variant: Tuple, read, *args, **kwargs) -> bytes:
+        if not self._cache.is_cached(handle):
+            return read(handle, *args, **kwargs)
+        value = self._cache.get(self._mac, handle, variant)
+        if value is None:
+            value = read(handle, *args, **kwargs)
+            self._cache.put(self._mac, handle, value, variant)
+        return value
+
+    def read_handles(self, handles: List[int]) -> Dict[int, bytes]:
+        """Read the handles that are not cached with one batch."""
+        return self._read_batch(handles, None, self.backend.read_handles)
+
+    def read_multiple(
+        self, handles: List[int], sizes: Optional[List[int]] = None
+    ) -> Dict[int, bytes]:
+        """Read the handles that are not cached with read_multiple of the backend."""
+        if sizes is not None and len(sizes) != len(handles):
+            raise ValueError("Expected one size per handle")
+        return self._read_batch(handles, sizes, self.backend.read_multiple)
+
+    def _read_batch(
+        self, handles: List[int], sizes: Optional[List[int]], read
+    ) -> Dict[int, bytes]:
+        result = {}  # type: Dict[int, bytes]
+        missing = []  # type: List[int]
+        missing_sizes = []  # type: List[int]
+        for index, handle in enumerate(handles):
+            value = None
+            if self._cache.is_cached(handle):
+                value = self._cache.get(self._mac, handle)
+            if value is None:
+                missing.append(handle)
+                if sizes is not None:
+                    missing_sizes.append(sizes[index])
+            else:
+                result[handle] = value
+        if missing:
+            if sizes is None:
+                values = read(missing)
+            else:
+                values = read(missing, missing_sizes)
+            for handle, value in values.items():
+                self._cache.put(self._mac, handle, value)
+            result.update(values)
+        return {handle: result[handle] for handle in handles}
+
+    def write_handle(self, handle: int, value: bytes, *args, **kwargs):
+        """Write a handle and forget its cached value."""
+        self._cache.invalidate(self._mac, handle)
+        return self.backend.write_handle(handle, value, *args, **kwargs)
+
+    def write_handles(self, values: Iterable[Tuple[int, bytes]]):
+        """Write several handles and forget their cached values."""
+        values = list(values)
+        for handle, _ in values:
+            self._cache.invalidate(self._mac, handle)
+        return self.backend.write_handles(values)
+
+    def write_stream(
+        self, handle: int, chunks: Iterable[bytes], *args, **kwargs
+    ) -> int:
+        """Write a stream of chunks and forget the cached value of the handle."""
+        self._cache.invalidate(self._mac, handle)
+        return self.backend.write_stream(handle, chunks, *args, **kwargs)
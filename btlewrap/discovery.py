@@ -0,0 +1,194 @@
+"""Cache of the characteristic handles found by GATT service discovery.
+
+Service discovery takes several round trips, so DiscoveryCache keeps the
+mapping from characteristic uuid to value handle per (mac or model,
+firmware), in memory and in a compact json file. Each device, or each model
+and firmware, is discovered once. With BluetoothInterface(discovery_cache=...)
+the connected backends offer read_uuid() and write_uuid(), which resolve the
+uuid without talking to the device once the mapping is known.
+"""
+import json
+import logging
+import os
+from threading import Lock
+from typing import Dict, Optional, Tuple, Union  # noqa: F401
+from uuid import UUID
+from btlewrap.advertisement import normalize_uuid, short_uuid
+from btlewrap.base import BluetoothBackendException, BluetoothTimeoutError
+
+_LOGGER = logging.getLogger(__name__)
+
+_FILE_VERSION = 1
+
+DiscoveryKey = Tuple[str, str]
+
+
+class PartialDiscovery(dict):
+    """Result of discover_characteristics() that may lack characteristics.
+
+    Backends return it when they cannot tell that the device listed all of
+    its characteristics, e.g. gatttool -I. ResolvingBackend uses it for the
+    current connection only and does not store it in the DiscoveryCache.
+    """
+
+
+class DiscoveryCache:
+    """Thread-safe cache of uuid to handle mappings, optionally stored in a file.
+
+    The mappings are keyed by (mac or model, firmware), see key(). With a
+    @path the file is read when the cache is created and written after each
+    change. A file that cannot be read is ignored, the devices are then
+    discovered again.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.discoveries = 0
+        self._handles = {}  # type: Dict[DiscoveryKey, Dict[str, int]]
+        self._lock = Lock()
+        if path is not None and os.path.exists(path):
+            self._load()
+
+    def __len__(self):
+        return len(self._handles)
+
+    @staticmethod
+    def key(
+        mac: str, model: Optional[str] = None, firmware: Optional[str] = None
+    ) -> DiscoveryKey:
+        """Build the key of a device.
+
+        Devices of the same @model and @firmware share their mapping,
+        without a @model the mapping belongs to the @mac.
+        """
+        return (model if model else mac.upper(), firmware or "")
+
+    def get(self, key: DiscoveryKey) -> Optional[Dict[str, int]]:
+        """Get the mapping of uuids to handles, None if the device was not discovered."""
+        return self._handles.get(key)
+
+    def put(self, key: DiscoveryKey, handles: Dict[str, int]):
+        """Store the result of a discovery."""
+        with self._lock:
+            self.discoveries += 1
+            self._handles[key] = {
+                normalize_uuid(uuid): handle for uuid, handle in handles.items()
+            }
+            self._save()
+
+    def invalidate(self, key: Optional[DiscoveryKey] = None):
+        """Forget the mapping of @key, or all mappings if @key is None."""
+        with self._lock:
+            if key is None:
+                self._handles.clear()
+            elif self._handles.pop(key, None) is None:
+                return
+            self._save()
+
+    def resolver(self, backend, key: DiscoveryKey) -> "ResolvingBackend":
+        """Wrap a connected backend to address its characteristics by uuid."""
+        return ResolvingBackend(backend, self, key)
+
+    def _save(self):
+        """Write the file, the lock must be held."""
+        if self.path is None:
+            return
+        entries = [
+            [name, firmware, {short_uuid(u): h for u, h in handles.items()}]
+            for (name, firmware), handles in sorted(self._handles.items())
+        ]
+        temp_path = "{}.tmp".format(self.path)
+        with open(temp_path, "w", encoding="utf-8") as cache_file:
+            json.dump(
+                {"version": _FILE_VERSION, "devices": entries},
+                cache_file,
+                separators=(",", ":"),
+            )
+        os.replace(temp_path, self.path)
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as cache_file:
+                data = json.load(cache_file)
+            if data.get("version") != _FILE_VERSION:
+                raise ValueError("version {}".format(data.get("version")))
+            for name, firmware, handles in data["devices"]:
+                self._handles[(name, firmware)] = {
+                    normalize_uuid(uuid): handle for uuid, handle in handles.items()
+                }
+        except (OSError, ValueError, KeyError, TypeError) as exception:
+            _LOGGER.warning(
+                "Ignoring discovery cache %s: %s", self.path, repr(exception)
+            )
+            self._handles.clear()
+
+
+class ResolvingBackend:
+    """Wraps a connected backend and resolves uuids with a DiscoveryCache.
+
+    The device is discovered if the cache has no mapping for it, and once per
+    connection for a uuid that is missing in the mapping. An operation on a
+    resolved handle that fails for another reason than a timeout invalidates
+    the mapping, so the next connection discovers the device again. A
+    PartialDiscovery is not stored in the cache. All other attributes are
+    passed on to the backend.
+    """
+
+    def __init__(self, backend, cache: DiscoveryCache, key: DiscoveryKey):
+        self.backend = backend
+        self._cache = cache
+        self._key = key
+        self._discovered = False
+        self._partial = None  # type: Optional[Dict[str, int]]
+
+    def __getattr__(self, name: str):
+        return getattr(self.backend, name)
+
+    def resolve(self, uuid: Union[str, int, UUID]) -> int:
+        """Get the value handle of the characteristic @uuid."""
+        uuid = normalize_uuid(uuid)
+        handles = self._cache.get(self._key)
+        if handles is None:
+            handles = self._partial
+        if handles is None or (uuid not in handles and not self._discovered):
+            handles = self.discover()
+        handle = handles.get(uuid)
+        if handle is None:
+            raise BluetoothBackendException(
+                "Characteristic {} not found on {}".format(uuid, self._key[0])
+            )
+        return handle
+
+    def discover(self) -> Dict[str, int]:
+        """Run the service discovery of the backend and store the result."""
+        _LOGGER.debug("Discovering the characteristics of %s", self._key)
+        found = self.backend.discover_characteristics()
+        handles = {normalize_uuid(uuid): handle for uuid, handle in found.items()}
+        if isinstance(found, PartialDiscovery):
+            _LOGGER.debug("Not storing the partial discovery of %s", self._key)
+            self._partial = handles
+        else:
+            self._cache.put(self._key, handles)
+        self._discovered = True
+        return handles
+
+    def read_uuid(self, uuid: Union[str, int, UUID]) -> bytes:
+        """Read the value of the characteristic @uuid."""
+        return self._call(uuid, self.backend.read_handle)
+
+    def write_uuid(
+        self, uuid: Union[str, int, UUID], value: bytes, response: bool = True
+    ):
+        """Write the value of the characteristic @uuid."""
+        return self._call(uuid, self.backend.write_handle, value, response=response)
+
+    def _call(self, uuid: Union[str, int, UUID], func, *args, **kwargs):
+        handle = self.resolve(uuid)
+        try:
+            return func(handle, *args, **kwargs)
+        except BluetoothTimeoutError:
+            raise
+        except BluetoothBackendException:
+            # the handle may belong to an other firmware
+            self._cache.invalidate(self._key)
+            raise
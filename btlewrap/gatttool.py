@@ -4,18 +4,58 @@ is part of bluez on Linux.
 No other operating systems are supported at the moment
 """
 
+from contextlib import contextmanager
 from threading import current_thread
+from queue import Empty
 import os
 import logging
 import re
+import shutil
 import time
-from typing import Callable, List, Tuple, Optional
-from subprocess import Popen, PIPE, TimeoutExpired, run
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple, Optional
+from subprocess import DEVNULL, Popen, PIPE, TimeoutExpired
 import signal
-from btlewrap.base import AbstractBackend, BluetoothBackendException
+from btlewrap.advertisement import (
+    AdvertisementFilter,
+    AdvertisementRecord,
+    parse_advertising_data,
+)
+from btlewrap.base import (
+    AbstractBackend,
+    BluetoothBackendException,
+    _DeviceScan,
+)
+from btlewrap.discovery import PartialDiscovery
+from btlewrap.gatttool_io import (
+    _NOTIFICATION_REGEX,
+    _GatttoolSession,
+    _LineReader,
+    _next_wait,
+    _parse_advertising_report,
+    _parse_read_output,
+    _parse_scan_line,
+    _parse_write_output,
+    _read_hci_packets,
+    _read_scan,
+)
+from btlewrap.retry import RetryPolicy
 
 _LOGGER = logging.getLogger(__name__)
 
+_VALUE_REGEX = re.compile(
+    r"Characteristic value/descriptor: (?P<value>([0-9a-fA-F]{2} ?)*)"
+)
+# "characteristics" of gatttool -I prints "handle: 0x0002, char properties: 0x02,
+# char value handle: 0x0003, uuid: 00002a00-0000-1000-8000-00805f9b34fb",
+# "gatttool --characteristics" the same with " = " instead of ": "
+_CHARACTERISTIC_REGEX = re.compile(
+    r"char value handle ?[:=] ?(?P<handle>0x[0-9a-fA-F]+), uuid ?[:=] ?(?P<uuid>[0-9a-fA-F-]{36})"
+)
+# hcitool constant if device name is unknown
+_NAME_UNKNOWN = "unknown"
+# seconds hcitool and hcidump get to exit on SIGINT before they are killed
+_STOP_TIMEOUT = 5
+
 
 def wrap_exception(func: Callable) -> Callable:
     """Wrap all IOErrors to BluetoothBackendException"""
@@ -29,6 +69,33 @@ def wrap_exception(func: Callable) -> Callable:
     return _func_wrapper
 
 
+def _characteristic_handles(matches) -> Dict[str, int]:
+    """Map the uuids of the characteristics found by gatttool to their value handles."""
+    handles = {}  # type: Dict[str, int]
+    for match in matches:
+        # the first characteristic wins if several services use the uuid
+        handles.setdefault(match.group("uuid").lower(), int(match.group("handle"), 16))
+    return handles
+
+
+def _stop_process_group(process: Popen):
+    """Stop a process started in its own session, kill it if SIGINT is not enough.
+
+    SIGINT lets hcitool switch off scanning again, so it is tried first.
+    """
+    if process.poll() is None:
+        try:
+            os.killpg(process.pid, signal.SIGINT)
+        except ProcessLookupError:
+            pass
+    try:
+        process.wait(timeout=_STOP_TIMEOUT)
+    except TimeoutExpired:
+        _LOGGER.debug("Process %d did not stop on SIGINT, killing it", process.pid)
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+
+
 class GatttoolBackend(AbstractBackend):
     """Backend using gatttool."""
 
@@ -41,13 +108,32 @@ class GatttoolBackend(AbstractBackend):
         retries: int = 3,
         timeout: float = 20,
         address_type: str = "public",
+        interactive: bool = False,
+        retry_policy: Optional[RetryPolicy] = None,
+        discovery_idle: float = 5.0,
     ):
+        """Create a new instance.
+
+        @param: retries - number of retries, ignored if a retry_policy is given
+        @param: timeout - timeout in seconds for each call of gatttool
+        @param: interactive - keep one "gatttool -I" process per connection
+            instead of starting gatttool for every operation.
+        @param: retry_policy - defaults to retries with 10, 20, 40, ... seconds delay
+        @param: discovery_idle - seconds without output after which the list of
+            characteristics of "gatttool -I" is taken as complete
+        """
         super(GatttoolBackend, self).__init__(adapter, address_type)
         self.adapter = adapter
         self.retries = retries
+        if retry_policy is None:
+            retry_policy = RetryPolicy(max_attempts=retries + 1, base_delay=10)
+        self.retry_policy = retry_policy
         self.timeout = timeout
         self.address_type = address_type
+        self.interactive = interactive
+        self.discovery_idle = discovery_idle
         self._mac = None
+        self._session = None  # type: Optional[_GatttoolSession]
 
     @staticmethod
     def supports_scanning() -> bool:
@@ -56,23 +142,150 @@ class GatttoolBackend(AbstractBackend):
     def connect(self, mac: str):
         """Connect to sensor.
 
-        Connection handling is not required when using gatttool, but we still need the mac
+        Connection handling is not required when using gatttool, but we still need the mac.
+        In interactive mode this starts gatttool and connects to the sensor.
         """
         self._mac = mac
+        if self.interactive:
+            try:
+                self._session = self._start_session()
+            except BluetoothBackendException:
+                self._mac = None
+                raise
 
     def disconnect(self):
         """Disconnect from sensor.
 
-        Connection handling is not required when using gatttool.
+        Connection handling is only required in interactive mode.
         """
+        if self._session is not None:
+            self._session.close()
+            self._session = None
         self._mac = None
 
+    def _start_session(self) -> _GatttoolSession:
+        """Start an interactive gatttool session for the current mac."""
+        last_error = None
+        policy = self._effective_retry_policy(self.retry_policy, self._mac)
+        for attempt in policy.attempts(self.deadline):
+            if attempt.number > 1:
+                self._count_metric("retries_total", "connect", self._mac)
+            session = _GatttoolSession(
+                self._mac,
+                self.adapter,
+                self.address_type,
+                self.remaining_time(attempt.timeout(self.timeout)),
+            )
+            try:
+                session.start()
+                return session
+            except BluetoothBackendException as exception:
+                last_error = exception
+        self.check_deadline()
+        raise last_error
+
     def is_connected(self) -> bool:
         """Check if we are connected to the backend."""
         return self._mac is not None
 
+    @contextmanager
+    def _batch_session(self):
+        """Use one interactive session for a batch of operations.
+
+        Outside of interactive mode a session is only started for the batch.
+        """
+        if not self.is_connected():
+            raise BluetoothBackendException("Not connected to any device.")
+        if self._session is not None:
+            yield
+            return
+        self._session = self._start_session()
+        try:
+            yield
+        finally:
+            self._session.close()
+            self._session = None
+
+    def read_handles(self, handles: List[int]) -> Dict[int, bytes]:
+        """Read several handles through a single gatttool session."""
+        with self._batch_session():
+            return super().read_handles(handles)
+
+    def write_handles(self, values: List[Tuple[int, bytes]]):
+        """Write several handles through a single gatttool session."""
+        with self._batch_session():
+            return super().write_handles(values)
+
+    @wrap_exception
+    def discover_characteristics(self) -> Dict[str, int]:
+        """Discover the characteristics with "gatttool --characteristics".
+
+        gatttool exits when the discovery is complete. An interactive
+        session does not mark the end of the list, so the "characteristics"
+        command of gatttool -I returns a PartialDiscovery once gatttool
+        printed nothing for discovery_idle seconds.
+        """
+        if not self.is_connected():
+            raise BluetoothBackendException("Not connected to any device.")
+
+        if self._session is None:
+            return _characteristic_handles(self._discover_once())
+        matches = self._session.collect(
+            "characteristics",
+            _CHARACTERISTIC_REGEX,
+            self.remaining_time(self.timeout),
+            self.discovery_idle,
+        )
+        return PartialDiscovery(_characteristic_handles(matches))
+
+    def _discover_once(self) -> List:
+        """Run "gatttool --characteristics", return the regex matches."""
+        policy = self._effective_retry_policy(self.retry_policy, self._mac)
+        for attempt in policy.attempts(self.deadline):
+            if attempt.number > 1:
+                self._count_metric("retries_total", "discover", self._mac)
+            cmd = "gatttool --device={} --addr-type={} --characteristics --adapter={}".format(
+                self._mac, self.address_type, self.adapter
+            )
+            timeout = self.remaining_time(attempt.timeout(self.timeout))
+            _LOGGER.debug("Running gatttool with a timeout of %d: %s", timeout, cmd)
+
+            with Popen(
+                cmd, shell=True, stdout=PIPE, stderr=PIPE, preexec_fn=os.setsid
+            ) as process:
+                try:
+                    result, errors = process.communicate(timeout=timeout)
+                except TimeoutExpired:
+                    self._count_metric("timeouts_total", "discover", self._mac)
+                    # a discovery cut short may lack characteristics, drop it
+                    os.killpg(process.pid, signal.SIGINT)
+                    process.communicate()
+                    _LOGGER.debug("Killed hanging gatttool")
+                    continue
+
+            result = result.decode("utf-8")
+            _LOGGER.debug("Got %s from gatttool", result)
+            # gatttool reports errors of the discovery on stderr
+            if process.returncode == 0 and b"failed" not in errors:
+                return list(_CHARACTERISTIC_REGEX.finditer(result))
+
+        self.check_deadline()
+        raise BluetoothBackendException(
+            "Discovering the characteristics of {} failed".format(self._mac)
+        )
+
+    def write_stream(
+        self, handle: int, chunks: Iterable[bytes], checkpoint_interval: int = 16
+    ) -> int:
+        """Write a stream of chunks through a single gatttool session.
+
+        See AbstractBackend.write_stream.
+        """
+        with self._batch_session():
+            return super().write_stream(handle, chunks, checkpoint_interval)
+
     @wrap_exception
-    def write_handle(self, handle: int, value: bytes):
+    def write_handle(self, handle: int, value: bytes, response: bool = True):
         # noqa: C901
         # pylint: disable=arguments-differ
 
@@ -81,64 +294,95 @@ class GatttoolBackend(AbstractBackend):
         @param: mac - MAC address in format XX:XX:XX:XX:XX:XX
         @param: handle - BLE characteristics handle in format 0xXX
         @param: value - value to write to the given handle
+        @param: response - False sends a write command ("--char-write"),
+            which gatttool does not confirm
         """
 
         if not self.is_connected():
             raise BluetoothBackendException("Not connected to any device.")
 
-        attempt = 0
-        delay = 10
+        if self._session is not None:
+            self._session_write(handle, value, response)
+            return True
+
         _LOGGER.debug("Enter write_ble (%s)", current_thread())
 
-        while attempt <= self.retries:
-            cmd = "gatttool --device={} --addr-type={} --char-write-req -a {} -n {} --adapter={}".format(
+        policy = self._effective_retry_policy(self.retry_policy, self._mac)
+        for attempt in policy.attempts(self.deadline):
+            if attempt.number > 1:
+                self._count_metric("retries_total", "write", self._mac)
+            cmd = "gatttool --device={} --addr-type={} {} -a {} -n {} --adapter={}".format(
                 self._mac,
                 self.address_type,
+                "--char-write-req" if response else "--char-write",
                 self.byte_to_handle(handle),
                 self.bytes_to_string(value),
                 self.adapter,
             )
-            _LOGGER.debug(
-                "Running gatttool with a timeout of %d: %s", self.timeout, cmd
-            )
+            timeout = self.remaining_time(attempt.timeout(self.timeout))
+            _LOGGER.debug("Running gatttool with a timeout of %d: %s", timeout, cmd)
 
+            timed_out = False
             with Popen(
                 cmd, shell=True, stdout=PIPE, stderr=PIPE, preexec_fn=os.setsid
             ) as process:
                 try:
-                    result = process.communicate(timeout=self.timeout)[0]
+                    result = process.communicate(timeout=timeout)[0]
                     _LOGGER.debug("Finished gatttool")
                 except TimeoutExpired:
+                    self._count_metric("timeouts_total", "write", self._mac)
                     # send signal to the process group
                     os.killpg(process.pid, signal.SIGINT)
                     result = process.communicate()[0]
+                    timed_out = True
                     _LOGGER.debug("Killed hanging gatttool")
 
             result = result.decode("utf-8").strip(" \n\t")
-            if "Write Request failed" in result:
-                raise BluetoothBackendException(
-                    "Error writing handle to sensor: {}".format(result)
-                )
             _LOGGER.debug("Got %s from gatttool", result)
-            # Parse the output
-            if "successfully" in result:
+            if response:
+                written = _parse_write_output(result)
+            else:
+                # gatttool prints nothing for a write command, only its exit
+                # code tells if it could connect and send it
+                written = not timed_out and process.returncode == 0
+            if written:
                 _LOGGER.debug("Exit write_ble with result (%s)", current_thread())
                 return True
 
-            attempt += 1
-            _LOGGER.debug("Waiting for %s seconds before retrying", delay)
-            if attempt < self.retries:
-                time.sleep(delay)
-                delay *= 2
-
+        self.check_deadline()
         raise BluetoothBackendException(
             "Exit write_ble, no data ({})".format(current_thread())
         )
 
+    def _session_write(self, handle: int, value: bytes, response: bool):
+        arguments = "{} {}".format(
+            self.byte_to_handle(handle), self.bytes_to_string(value)
+        )
+        if not response:
+            # errors of the write command show up in the answer to the next command
+            self._session.send("char-write-cmd " + arguments)
+            return
+        self._session.command(
+            "char-write-req " + arguments,
+            re.compile("written successfully"),
+            self.remaining_time(self.timeout),
+        )
+
     @wrap_exception
-    def wait_for_notification(self, handle: int, delegate, notification_timeout: float):
+    def wait_for_notification(
+        self,
+        handle: int,
+        delegate,
+        notification_timeout: float,
+        *,
+        max_count: Optional[int] = None,
+        predicate: Optional[Callable[[int, bytes], bool]] = None,
+    ):
+        # pylint: disable=arguments-differ
         """Listen for characteristics changes from a BLE address.
 
+        Notifications are passed to the delegate as soon as gatttool prints them.
+
         @param: mac - MAC address in format XX:XX:XX:XX:XX:XX
         @param: handle - BLE characteristics handle in format 0xXX
                          a value of 0x0100 is written to register for listening
@@ -146,16 +390,70 @@ class GatttoolBackend(AbstractBackend):
             --listen argument and the delegate object's handleNotification is
             called for every returned row
         @param: notification_timeout
+        @param: max_count - stop listening after this number of notifications
+        @param: predicate - stop listening as soon as predicate(handle, value)
+            returns True for a notification
         """
+        notifications = self.iter_notifications(
+            handle, notification_timeout, max_count=max_count
+        )
+        try:
+            for _, value in notifications:
+                delegate.handleNotification(handle, value)
+                if predicate is not None and predicate(handle, value):
+                    break
+        finally:
+            notifications.close()
+        return True
 
+    def iter_notifications(
+        self,
+        handle: int,
+        timeout: float,
+        *,
+        max_count: Optional[int] = None,
+        idle_timeout: Optional[float] = None,
+        buffer_size: int = 64,
+    ) -> Iterator[Tuple[int, bytes]]:
+        """Register for notifications and yield them while gatttool prints them.
+
+        See AbstractBackend.iter_notifications.
+        """
         if not self.is_connected():
             raise BluetoothBackendException("Not connected to any device.")
 
-        attempt = 0
-        delay = 10
+        if self._session is not None:
+            notifications = self._session_listen(handle, timeout, idle_timeout)
+        else:
+            notifications = self._listen(handle, timeout, idle_timeout, buffer_size)
+        count = 0
+        try:
+            while max_count is None or count < max_count:
+                try:
+                    value = next(notifications)
+                except StopIteration:
+                    return
+                except IOError as exception:
+                    raise BluetoothBackendException() from exception
+                count += 1
+                yield handle, value
+        finally:
+            notifications.close()
+
+    def _listen(
+        self,
+        handle: int,
+        notification_timeout: float,
+        idle_timeout: Optional[float] = None,
+        buffer_size: int = 0,
+    ) -> Iterator[bytes]:
+        """Run "gatttool --listen" and yield the notifications as they arrive."""
         _LOGGER.debug("Enter write_ble (%s)", current_thread())
 
-        while attempt <= self.retries:
+        policy = self._effective_retry_policy(self.retry_policy, self._mac)
+        for attempt in policy.attempts(self.deadline):
+            if attempt.number > 1:
+                self._count_metric("retries_total", "notification", self._mac)
             cmd = "gatttool --device={} --addr-type={} --char-write-req -a {} -n {} --adapter={} --listen".format(
                 self._mac,
                 self.address_type,
@@ -170,41 +468,97 @@ class GatttoolBackend(AbstractBackend):
             with Popen(
                 cmd, shell=True, stdout=PIPE, stderr=PIPE, preexec_fn=os.setsid
             ) as process:
+                reader = _LineReader(process.stdout, buffer_size)
                 try:
-                    result = process.communicate(timeout=notification_timeout)[0]
-                    _LOGGER.debug("Finished gatttool")
-                except TimeoutExpired:
-                    # send signal to the process group, because listening always hangs
-                    os.killpg(process.pid, signal.SIGINT)
-                    result = process.communicate()[0]
-                    _LOGGER.debug("Listening stopped forcefully after timeout.")
-
-            result = result.decode("utf-8").strip(" \n\t")
-            if "Write Request failed" in result:
-                raise BluetoothBackendException(
-                    "Error writing handle to sensor: {}".format(result)
-                )
-            _LOGGER.debug("Got %s from gatttool", result)
-            # Parse the output to determine success
-            if "successfully" in result:
-                _LOGGER.debug("Exit write_ble with result (%s)", current_thread())
-                # extract useful data.
-                for element in self.extract_notification_payload(result):
-                    delegate.handleNotification(
-                        handle, bytes([int(x, 16) for x in element.split()])
+                    written = yield from self._read_notifications(
+                        reader,
+                        self.remaining_time(attempt.timeout(notification_timeout)),
+                        idle_timeout,
                     )
-                return True
-
-            attempt += 1
-            _LOGGER.debug("Waiting for %s seconds before retrying", delay)
-            if attempt < self.retries:
-                time.sleep(delay)
-                delay *= 2
+                finally:
+                    reader.close()
+                    if process.poll() is None:
+                        # send signal to the process group, because listening always hangs
+                        os.killpg(process.pid, signal.SIGINT)
+                        _LOGGER.debug("Listening stopped.")
+
+            if written:
+                _LOGGER.debug("Exit write_ble with result (%s)", current_thread())
+                return
 
+        self.check_deadline()
         raise BluetoothBackendException(
             "Exit write_ble, no data ({})".format(current_thread())
         )
 
+    def _read_notifications(
+        self,
+        reader: _LineReader,
+        notification_timeout: float,
+        idle_timeout: Optional[float] = None,
+    ):
+        """Yield notifications from the output of "gatttool --listen".
+
+        The @idle_timeout only applies once the write was confirmed or a
+        notification arrived, connecting may take longer.
+        Returns True if registering for notifications was successful.
+        """
+        deadline = time.monotonic() + notification_timeout
+        written = False
+        listening = False
+        while True:
+            try:
+                line = reader.readline(
+                    _next_wait(deadline, idle_timeout if listening else None)
+                )
+            except Empty:
+                # listening always ends with the timeout
+                break
+            if line is None:
+                break
+            _LOGGER.debug("Got %s from gatttool", line)
+            notification = _NOTIFICATION_REGEX.search(line)
+            if notification is not None:
+                listening = True
+                yield bytes([int(x, 16) for x in notification.group("value").split()])
+            elif _parse_write_output(line):
+                written = listening = True
+        return written
+
+    def _session_listen(
+        self,
+        handle: int,
+        notification_timeout: float,
+        idle_timeout: Optional[float] = None,
+    ) -> Iterator[bytes]:
+        """Listen for notifications through the interactive session."""
+        session = self._session
+        session.command(
+            "char-write-req {} {}".format(
+                self.byte_to_handle(handle),
+                self.bytes_to_string(self._DATA_MODE_LISTEN),
+            ),
+            re.compile("written successfully"),
+            self.remaining_time(self.timeout),
+        )
+        deadline = time.monotonic() + self.remaining_time(notification_timeout)
+        while True:
+            while session.notifications:
+                yield session.notifications.pop(0)[1]
+            try:
+                line = session.readline(
+                    time.monotonic() + _next_wait(deadline, idle_timeout)
+                )
+            except Empty:
+                # listening always ends with the timeout
+                break
+            if line is None:
+                raise BluetoothBackendException(
+                    "gatttool session ended while listening"
+                )
+        while session.notifications:
+            yield session.notifications.pop(0)[1]
+
     @staticmethod
     def extract_notification_payload(process_output):
         """
@@ -243,24 +597,33 @@ class GatttoolBackend(AbstractBackend):
         if not self.is_connected():
             raise BluetoothBackendException("Not connected to any device.")
 
-        attempt = 0
-        delay = 10
+        if self._session is not None:
+            match = self._session.command(
+                "char-read-hnd {}".format(self.byte_to_handle(handle)),
+                _VALUE_REGEX,
+                self.remaining_time(self.timeout),
+            )
+            return bytes([int(x, 16) for x in match.group("value").split()])
+
         _LOGGER.debug("Enter read_ble (%s)", current_thread())
 
-        while attempt <= self.retries:
+        policy = self._effective_retry_policy(self.retry_policy, self._mac)
+        for attempt in policy.attempts(self.deadline):
+            if attempt.number > 1:
+                self._count_metric("retries_total", "read", self._mac)
             cmd = "gatttool --device={} --addr-type={} --char-read -a {} --adapter={}".format(
                 self._mac, self.address_type, self.byte_to_handle(handle), self.adapter
             )
-            _LOGGER.debug(
-                "Running gatttool with a timeout of %d: %s", self.timeout, cmd
-            )
+            timeout = self.remaining_time(attempt.timeout(self.timeout))
+            _LOGGER.debug("Running gatttool with a timeout of %d: %s", timeout, cmd)
             with Popen(
                 cmd, shell=True, stdout=PIPE, stderr=PIPE, preexec_fn=os.setsid
             ) as process:
                 try:
-                    result = process.communicate(timeout=self.timeout)[0]
+                    result = process.communicate(timeout=timeout)[0]
                     _LOGGER.debug("Finished gatttool")
                 except TimeoutExpired:
+                    self._count_metric("timeouts_total", "read", self._mac)
                     # send signal to the process group
                     os.killpg(process.pid, signal.SIGINT)
                     result = process.communicate()[0]
@@ -268,36 +631,24 @@ class GatttoolBackend(AbstractBackend):
 
             result = result.decode("utf-8").strip(" \n\t")
             _LOGGER.debug('Got "%s" from gatttool', result)
-            # Parse the output
-            if "read failed" in result:
-                raise BluetoothBackendException(
-                    "Read error from gatttool: {}".format(result)
-                )
-
-            res = re.search("( [0-9a-fA-F][0-9a-fA-F])+", result)
-            if res:
+            value = _parse_read_output(result)
+            if value is not None:
                 _LOGGER.debug("Exit read_ble with result (%s)", current_thread())
-                return bytes([int(x, 16) for x in res.group(0).split()])
-
-            attempt += 1
-            _LOGGER.debug("Waiting for %s seconds before retrying", delay)
-            if attempt < self.retries:
-                time.sleep(delay)
-                delay *= 2
+                return value
 
+        self.check_deadline()
         raise BluetoothBackendException(
             "Exit read_ble, no data ({})".format(current_thread())
         )
 
     @staticmethod
     def check_backend() -> bool:
-        """Check if gatttool is available on the system."""
-        try:
-            run(["gatttool", "-h"], stdout=PIPE, stderr=PIPE, check=True)
+        """Check if gatttool is available on the system.
+
+        Only the PATH is searched, gatttool is not started."""
+        if shutil.which("gatttool") is not None:
             return True
-        except OSError as os_err:
-            msg = "gatttool not found: {}".format(str(os_err))
-            _LOGGER.error(msg)
+        _LOGGER.error("gatttool not found in PATH")
         return False
 
     @staticmethod
@@ -316,36 +667,103 @@ class GatttoolBackend(AbstractBackend):
 
     @staticmethod
     def scan_for_devices(
-        timeout: int = 10, adapter: Optional[str] = None
+        timeout: int = 10,
+        adapter: Optional[str] = None,
+        *,
+        targets: Optional[Iterable[str]] = None,
+        max_devices: Optional[int] = None,
     ) -> List[Tuple[str, str]]:
-        # call hcitool with a timeout, otherwise it will scan forever
-        cmd = ["timeout", "-s", "SIGINT", f"{timeout}s", "hcitool"]
+        scan = _DeviceScan(unknown_name=_NAME_UNKNOWN)
+        for mac, name in GatttoolBackend.iter_scan(
+            timeout, adapter, targets=targets, max_devices=max_devices
+        ):
+            scan.add(mac, name)
+        return scan.devices()
+
+    @staticmethod
+    def iter_scan(
+        timeout: int = 10,
+        adapter: Optional[str] = None,
+        *,
+        targets: Optional[Iterable[str]] = None,
+        max_devices: Optional[int] = None,
+    ) -> Iterator[Tuple[str, str]]:
+        """Run "hcitool lescan" and yield the devices while they are found."""
+        # pylint: disable=subprocess-popen-preexec-fn,consider-using-with
+        cmd = ["hcitool"]
         if adapter is not None:
             cmd += ["-i", adapter]
         cmd += ["lescan"]
-        # setting check=False as process is killed by timeout
-        proc = run(
-            cmd, stdout=PIPE, stderr=None, timeout=2 * timeout, text=True, check=False
-        )
-        return GatttoolBackend._parse_scan_output(proc.stdout)
+        scan = _DeviceScan(targets, max_devices, unknown_name=_NAME_UNKNOWN)
+        deadline = time.monotonic() + timeout
+        try:
+            process = Popen(cmd, stdout=PIPE, stderr=None, preexec_fn=os.setsid)
+        except OSError as exception:
+            raise BluetoothBackendException() from exception
+        # lescan repeats every device all the time, so only buffer a few lines
+        reader = _LineReader(process.stdout, buffer_size=64)
+        try:
+            yield from _read_scan(reader, scan, deadline)
+        finally:
+            reader.close()
+            # hcitool scans forever unless it is stopped
+            _stop_process_group(process)
+
+    @staticmethod
+    def listen_advertisements(
+        timeout: Optional[float] = None,
+        adapter: str = "hci0",
+        *,
+        macs: Optional[Iterable[str]] = None,
+        service_uuids: Optional[Iterable] = None,
+    ) -> Iterator[AdvertisementRecord]:
+        """Passively listen for advertisements.
+
+        "hcitool lescan --passive" keeps the adapter scanning and the
+        advertising reports are parsed from the HCI events that
+        "hcidump --raw" prints. Note this must be run as root!"""
+        # pylint: disable=subprocess-popen-preexec-fn,consider-using-with
+        adv_filter = AdvertisementFilter(macs, service_uuids)
+        processes = []  # type: List[Popen]
+        try:
+            # start hcidump first, so that no advertisement is missed
+            processes.append(
+                Popen(
+                    ["hcidump", "-i", adapter, "--raw"],
+                    stdout=PIPE,
+                    stderr=DEVNULL,
+                    preexec_fn=os.setsid,
+                )
+            )
+            processes.append(
+                Popen(
+                    ["hcitool", "-i", adapter, "lescan", "--passive", "--duplicates"],
+                    stdout=DEVNULL,
+                    stderr=DEVNULL,
+                    preexec_fn=os.setsid,
+                )
+            )
+            reader = _LineReader(processes[0].stdout)
+            try:
+                for packet in _read_hci_packets(reader, timeout):
+                    for mac, rssi, data in _parse_advertising_report(packet):
+                        yield from adv_filter.records(
+                            mac, rssi, parse_advertising_data(data)
+                        )
+            finally:
+                reader.close()
+        except OSError as exception:
+            raise BluetoothBackendException() from exception
+        finally:
+            for process in reversed(processes):
+                _stop_process_group(process)
 
     @staticmethod
     def _parse_scan_output(scan_output: str) -> List[Tuple[str, str]]:
         # skip first line containing "LE Scan ..."
-        devices = dict()
-        device_regex = re.compile(
-            r"(?P<mac>([\dA-Fa-f]{2}:){5}[\dA-Fa-f]{2})\W+\((?P<name>[^\)]+)\)"
-        )
-        # gatttool constant if device name is unknown
-        name_unknown = "unknown"
+        scan = _DeviceScan(unknown_name=_NAME_UNKNOWN)
         for line in scan_output.split("\n")[1:]:
-            match = device_regex.search(line)
-            if match is None or match.group("mac") is None:
-                continue
-            mac = match.group("mac")
-            name = match.group("name")
-
-            if mac not in devices or devices[mac] == name_unknown:
-                devices[mac] = name
-
-        return list(devices.items())
+            device = _parse_scan_line(line)
+            if device is not None:
+                scan.add(*device)
+        return scan.devices()
@@ -0,0 +1,357 @@
+"""Processes and output parsing behind GatttoolBackend.
+
+gatttool, hcitool and hcidump only offer a text interface. This module
+reads their output without blocking and parses it, GatttoolBackend decides
+what to run.
+"""
+import logging
+import os
+import re
+import signal
+import time
+from queue import Queue, Empty, Full
+from subprocess import Popen, PIPE, STDOUT, TimeoutExpired
+from threading import Event, Thread
+from typing import Iterator, List, Optional, Tuple  # noqa: F401
+from btlewrap.base import BluetoothBackendException, BluetoothTimeoutError, _DeviceScan
+
+_LOGGER = logging.getLogger(__name__)
+
+# gatttool -I decorates its output with colour codes and prompt redraws
+_ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;]*[A-Za-z]|\r")
+_NOTIFICATION_REGEX = re.compile(
+    r"Notification handle = (?P<handle>0x[0-9a-fA-F]+) value: (?P<value>([0-9a-fA-F]{2} ?)*)"
+)
+_ERROR_REGEX = re.compile(r"(Error: .*|Command Failed: .*)")
+# hcitool prints "<mac> (unknown)" or "<mac> <name>"
+_SCAN_REGEX = re.compile(
+    r"(?P<mac>([\dA-Fa-f]{2}:){5}[\dA-Fa-f]{2})\s+"
+    r"(\((?P<name>[^\)]+)\)|(?P<plain_name>[^\s(].*?))\s*$"
+)
+
+
+def _parse_scan_line(line: str) -> Optional[Tuple[str, str]]:
+    """Get (mac, name) from a line of "hcitool lescan"."""
+    match = _SCAN_REGEX.search(line)
+    if match is None:
+        return None
+    return match.group("mac"), match.group("name") or match.group("plain_name")
+
+
+def _read_scan(
+    reader: "_LineReader", scan: _DeviceScan, deadline: float
+) -> Iterator[Tuple[str, str]]:
+    """Yield the new devices and names from the output of "hcitool lescan"."""
+    while not scan.complete():
+        try:
+            line = reader.readline(deadline - time.monotonic())
+        except Empty:
+            return
+        if line is None:
+            return
+        device = _parse_scan_line(line)
+        if device is not None and scan.add(*device):
+            yield device
+
+
+def _next_wait(deadline: float, idle_timeout: Optional[float]) -> float:
+    """Seconds to wait for the next line of output."""
+    wait = deadline - time.monotonic()
+    if idle_timeout is not None:
+        wait = min(wait, idle_timeout)
+    return wait
+
+
+class _LineReader:
+    """Read lines from a process pipe in a background thread.
+
+    Blocking reads on a pipe cannot be interrupted, so a daemon thread does
+    the reading and hands decoded lines over through a queue. None marks the
+    end of the stream. With a @buffer_size the thread stops reading while the
+    queue is full, so gatttool is slowed down instead of filling the memory.
+    """
+
+    def __init__(self, stream, buffer_size: int = 0):
+        self._stream = stream
+        self._lines = Queue(maxsize=buffer_size)  # type: Queue
+        self._closed = Event()
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            for raw_line in iter(self._stream.readline, b""):
+                line = _ANSI_ESCAPE.sub("", raw_line.decode("utf-8", "replace"))
+                self._put(line.strip(" \n\t"))
+        except (OSError, ValueError):
+            # the pipe was closed while reading
+            pass
+        self._put(None)
+
+    def _put(self, line: Optional[str]):
+        # give up once nobody reads the lines any more
+        while not self._closed.is_set():
+            try:
+                self._lines.put(line, timeout=0.1)
+                return
+            except Full:
+                pass
+
+    def close(self):
+        """Stop handing over lines."""
+        self._closed.set()
+
+    def readline(self, timeout: float) -> Optional[str]:
+        """Return the next line, None at the end of the stream.
+
+        Raises queue.Empty if no line arrived within @timeout seconds.
+        """
+        return self._lines.get(timeout=max(timeout, 0))
+
+
+class _HciPacketAssembler:  # pylint: disable=too-few-public-methods
+    """Assemble the HCI event packets printed by "hcidump --raw".
+
+    A packet starts with "> " and may continue on the following lines, it is
+    complete as soon as all bytes of its parameter length were read.
+    """
+
+    def __init__(self):
+        self._packet = None  # type: Optional[bytearray]
+
+    def feed(self, line: str) -> Optional[bytes]:
+        """Add a line of output, return the packet if it is complete."""
+        if line.startswith((">", "<")):
+            # commands sent to the adapter ("<") are of no interest
+            self._packet = bytearray() if line.startswith(">") else None
+            line = line[1:]
+        if self._packet is None:
+            return None
+        try:
+            self._packet.extend(bytes.fromhex(line))
+        except ValueError:
+            # header lines of hcidump
+            self._packet = None
+            return None
+        packet = self._packet
+        if len(packet) < 3 or len(packet) < 3 + packet[2]:
+            return None
+        self._packet = None
+        return bytes(packet)
+
+
+def _read_hci_packets(reader: _LineReader, timeout: Optional[float]) -> Iterator[bytes]:
+    """Yield the HCI event packets from the output of hcidump."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    assembler = _HciPacketAssembler()
+    while True:
+        wait = 1.0 if deadline is None else deadline - time.monotonic()
+        if wait <= 0:
+            return
+        try:
+            line = reader.readline(wait)
+        except Empty:
+            continue
+        if line is None:
+            raise BluetoothBackendException("hcidump stopped unexpectedly.")
+        packet = assembler.feed(line)
+        if packet is not None:
+            yield packet
+
+
+def _parse_advertising_report(packet: bytes) -> List[Tuple[str, int, bytes]]:
+    """Get (mac, rssi, advertising data) from an LE Advertising Report event."""
+    # HCI event packet, LE Meta event, subevent LE Advertising Report
+    if len(packet) < 5 or packet[0:2] != b"\x04\x3e" or packet[3] != 0x02:
+        return []
+    reports = []
+    position = 5
+    for _ in range(packet[4]):
+        # event type, address type, address (6), data length, data, rssi
+        data_start = position + 9
+        if data_start > len(packet):
+            break
+        address_start, address_end = position + 2, position + 8
+        address = packet[address_start:address_end]
+        rssi_position = data_start + packet[address_end]
+        if rssi_position >= len(packet):
+            break
+        mac = ":".join("{:02X}".format(byte) for byte in reversed(address))
+        rssi = packet[rssi_position] - 256 * (packet[rssi_position] > 127)
+        reports.append((mac, rssi, bytes(packet[data_start:rssi_position])))
+        position = rssi_position + 1
+    return reports
+
+
+class _GatttoolSession:
+    """One interactive gatttool process ("gatttool -I") holding a connection.
+
+    All reads, writes and notifications go through the same process, so the
+    device is only connected once instead of once per operation.
+    """
+
+    # pylint: disable=subprocess-popen-preexec-fn,consider-using-with
+
+    def __init__(self, mac: str, adapter: str, address_type: str, timeout: float):
+        self.mac = mac
+        self.adapter = adapter
+        self.address_type = address_type
+        self.timeout = timeout
+        self._process = None  # type: Optional[Popen]
+        self._reader = None  # type: Optional[_LineReader]
+        self.notifications = []  # type: List[Tuple[int, bytes]]
+
+    def is_alive(self) -> bool:
+        """Check if the gatttool process is still running."""
+        return self._process is not None and self._process.poll() is None
+
+    def start(self):
+        """Start gatttool and connect to the device."""
+        cmd = "gatttool --device={} --addr-type={} --adapter={} --interactive".format(
+            self.mac, self.address_type, self.adapter
+        )
+        _LOGGER.debug("Starting interactive gatttool: %s", cmd)
+        self._process = Popen(
+            cmd,
+            shell=True,
+            stdin=PIPE,
+            stdout=PIPE,
+            stderr=STDOUT,
+            preexec_fn=os.setsid,
+        )
+        self._reader = _LineReader(self._process.stdout)
+        try:
+            self.command("connect", re.compile("Connection successful"))
+        except BluetoothBackendException:
+            self.close()
+            raise
+
+    def send(self, command: str):
+        """Send a command to gatttool without waiting for the answer."""
+        if not self.is_alive():
+            raise BluetoothBackendException("gatttool session is not running.")
+        _LOGGER.debug("Sending to gatttool: %s", command)
+        self._process.stdin.write((command + "\n").encode("utf-8"))
+        self._process.stdin.flush()
+
+    def command(self, command: str, expected, timeout: Optional[float] = None):
+        """Send a command and wait for a line matching @expected.
+
+        Returns the regex match. Notifications received in the meantime are
+        queued in self.notifications.
+        """
+        self.send(command)
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        while True:
+            try:
+                line = self.readline(deadline)
+            except Empty as exception:
+                self.kill()
+                raise BluetoothTimeoutError(
+                    "Timeout while waiting for gatttool to answer '{}'".format(command)
+                ) from exception
+            if line is None:
+                raise BluetoothBackendException(
+                    "gatttool session ended while waiting for '{}'".format(command)
+                )
+            match = expected.search(line)
+            if match:
+                return match
+            error = _ERROR_REGEX.search(line)
+            if error:
+                raise BluetoothBackendException(
+                    "gatttool command '{}' failed: {}".format(command, error.group(0))
+                )
+
+    def collect(self, command: str, expected, timeout: Optional[float], idle: float):
+        """Send a command whose answer has several lines matching @expected.
+
+        Waits up to @timeout seconds for the first line. gatttool -I does not
+        mark the end of such answers, it is taken as complete when gatttool
+        prints nothing for @idle seconds. Returns all regex matches.
+        """
+        matches = [self.command(command, expected, timeout)]
+        while True:
+            try:
+                line = self.readline(time.monotonic() + idle)
+            except Empty:
+                return matches
+            if line is None:
+                return matches
+            match = expected.search(line)
+            if match:
+                matches.append(match)
+
+    def readline(self, deadline: float) -> Optional[str]:
+        """Read the next line that is not a notification.
+
+        Notifications are queued in self.notifications. Returns None if
+        gatttool terminated, raises queue.Empty when the deadline is reached.
+        """
+        while True:
+            line = self._reader.readline(deadline - time.monotonic())
+            if line is None:
+                return None
+            _LOGGER.debug("Got %s from gatttool", line)
+            notification = _NOTIFICATION_REGEX.search(line)
+            if notification is None:
+                return line
+            self.notifications.append(
+                (
+                    int(notification.group("handle"), 16),
+                    bytes([int(x, 16) for x in notification.group("value").split()]),
+                )
+            )
+
+    def close(self):
+        """Disconnect and stop gatttool."""
+        if self._process is None:
+            return
+        try:
+            if self.is_alive():
+                self.send("disconnect")
+                self.send("exit")
+                self._process.wait(timeout=self.timeout)
+        except (OSError, BluetoothBackendException, TimeoutExpired):
+            self.kill()
+        _LOGGER.debug("Stopped interactive gatttool")
+        self._process = None
+
+    def kill(self):
+        """Stop gatttool without waiting for a clean disconnect."""
+        if self._process is None:
+            return
+        try:
+            # send signal to the process group
+            os.killpg(self._process.pid, signal.SIGINT)
+            self._process.wait(timeout=self.timeout)
+        except ProcessLookupError:
+            # process is already gone
+            pass
+        except TimeoutExpired:
+            _LOGGER.debug("gatttool did not stop on SIGINT, killing it")
+            os.killpg(self._process.pid, signal.SIGKILL)
+            self._process.wait()
+        self._process = None
+
+
+def _parse_read_output(result: str) -> Optional[bytes]:
+    """Get the value from the output of "gatttool --char-read".
+
+    Returns None if the output does not contain a value.
+    """
+    if "read failed" in result:
+        raise BluetoothBackendException("Read error from gatttool: {}".format(result))
+    res = re.search("( [0-9a-fA-F][0-9a-fA-F])+", result)
+    if res is None:
+        return None
+    return bytes([int(x, 16) for x in res.group(0).split()])
+
+
+def _parse_write_output(result: str) -> bool:
+    """Check if the output of "gatttool --char-write-req" reports success."""
+    if "Write Request failed" in result:
+        raise BluetoothBackendException(
+            "Error writing handle to sensor: {}".format(result)
+        )
+    return "successfully" in result
@@ -0,0 +1,456 @@
+"""Backend talking ATT directly over an L2CAP socket of the Linux kernel.
+
+No helper process and no text parsing is involved, the ATT PDUs are
+encoded and decoded by btlewrap.att. Python's socket module cannot connect
+L2CAP sockets to a fixed channel of an LE device, so the socket address
+is passed to the kernel with ctypes.
+"""
+from collections import deque
+import ctypes
+import errno
+import fcntl
+import logging
+import re
+import select
+import socket
+import struct
+import time
+from typing import Dict, Iterator, List, Optional, Set, Tuple  # noqa: F401
+from btlewrap.att import (
+    CHARACTERISTIC_DECLARATION,
+    DEFAULT_MTU,
+    ERROR_ATTRIBUTE_NOT_FOUND,
+    ERROR_REQUEST_NOT_SUPPORTED,
+    MAX_ATTRIBUTE_LENGTH,
+    READ_MULTIPLE_REQUEST,
+    READ_MULTIPLE_VARIABLE_REQUEST,
+    AttClient,
+    AttError,
+    decode_characteristic,
+)
+from btlewrap.base import (
+    AbstractBackend,
+    BluetoothBackendException,
+    BluetoothTimeoutError,
+)
+from btlewrap.retry import RetryPolicy
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_RETRY_POLICY = RetryPolicy(max_attempts=3, base_delay=0.5)
+
+# see <bluetooth/bluetooth.h>, <bluetooth/l2cap.h> and <bluetooth/hci.h>
+AF_BLUETOOTH = 31
+BTPROTO_L2CAP = 0
+BTPROTO_HCI = 1
+ATT_CID = 4
+BDADDR_LE_PUBLIC = 0x01
+BDADDR_LE_RANDOM = 0x02
+# _IOR('H', 211, int)
+HCIGETDEVINFO = 0x800448D3
+# size of struct hci_dev_info and offset of its bdaddr
+_HCI_DEV_INFO_SIZE = 92
+_HCI_DEV_INFO_BDADDR = 10
+
+_ADDRESS_TYPES = {"public": BDADDR_LE_PUBLIC, "random": BDADDR_LE_RANDOM}
+_ADAPTER_REGEX = re.compile(r"^hci(\d+)$")
+_MAC_REGEX = re.compile(r"^([0-9A-Fa-f]{2}:){5}[0-9A-Fa-f]{2}$")
+
+
+class _SockaddrL2(ctypes.Structure):  # pylint: disable=too-few-public-methods
+    """struct sockaddr_l2"""
+
+    _fields_ = [
+        ("l2_family", ctypes.c_ushort),
+        ("l2_psm", ctypes.c_ushort),
+        ("l2_bdaddr", ctypes.c_uint8 * 6),
+        ("l2_cid", ctypes.c_ushort),
+        ("l2_bdaddr_type", ctypes.c_uint8),
+    ]
+
+
+def _le16(value: int) -> int:
+    """Convert a number to the little endian __le16 of the kernel."""
+    return struct.unpack("=H", struct.pack("<H", value))[0]
+
+
+def sockaddr_l2(mac: str, address_type: str, cid: int = ATT_CID) -> _SockaddrL2:
+    """Build the socket address of the ATT channel of a device."""
+    if not _MAC_REGEX.match(mac):
+        raise BluetoothBackendException("Invalid mac address {}".format(mac))
+    if address_type not in _ADDRESS_TYPES:
+        raise BluetoothBackendException(
+            "Invalid address type {}, expected public or random".format(address_type)
+        )
+    # bdaddr_t is little endian
+    bdaddr = reversed(bytes.fromhex(mac.replace(":", "")))
+    return _SockaddrL2(
+        l2_family=AF_BLUETOOTH,
+        l2_psm=0,
+        l2_bdaddr=(ctypes.c_uint8 * 6)(*bdaddr),
+        l2_cid=_le16(cid),
+        l2_bdaddr_type=_ADDRESS_TYPES[address_type],
+    )
+
+
+def _adapter_address(adapter: str) -> str:
+    """Get the mac of an adapter like "hci0" from the kernel."""
+    match = _ADAPTER_REGEX.match(adapter)
+    if match is None:
+        raise BluetoothBackendException(
+            'Invalid pattern "{}" for Bluetooth adapter. '
+            'Expected something like "hci0".'.format(adapter)
+        )
+    request = struct.pack("<H", int(match.group(1))).ljust(_HCI_DEV_INFO_SIZE, b"\0")
+    with socket.socket(AF_BLUETOOTH, socket.SOCK_RAW, BTPROTO_HCI) as hci_socket:
+        info = fcntl.ioctl(hci_socket.fileno(), HCIGETDEVINFO, request)
+    bdaddr = info[_HCI_DEV_INFO_BDADDR:][:6]
+    return ":".join("{:02X}".format(byte) for byte in reversed(bdaddr))
+
+
+def _check_call(result: int, what: str):
+    if result != 0:
+        error = ctypes.get_errno()
+        raise OSError(error, "{}: {}".format(what, errno.errorcode.get(error, error)))
+
+
+def open_att_socket(
+    mac: str, adapter: str, address_type: str, timeout: float
+) -> socket.socket:
+    """Connect an L2CAP socket to the ATT channel of a device."""
+    libc = ctypes.CDLL(None, use_errno=True)
+    sock = socket.socket(AF_BLUETOOTH, socket.SOCK_SEQPACKET, BTPROTO_L2CAP)
+    try:
+        local = sockaddr_l2(_adapter_address(adapter), "public")
+        _check_call(
+            libc.bind(sock.fileno(), ctypes.byref(local), ctypes.sizeof(local)), "bind"
+        )
+        remote = sockaddr_l2(mac, address_type)
+        sock.setblocking(False)
+        result = libc.connect(
+            sock.fileno(), ctypes.byref(remote), ctypes.sizeof(remote)
+        )
+        if result != 0 and ctypes.get_errno() != errno.EINPROGRESS:
+            _check_call(result, "connect")
+        _, writable, _ = select.select([], [sock], [], timeout)
+        if not writable:
+            raise BluetoothTimeoutError("Timeout while connecting to {}".format(mac))
+        error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if error:
+            raise OSError(
+                error, "connect: {}".format(errno.errorcode.get(error, error))
+            )
+        sock.setblocking(True)
+        return sock
+    except BaseException:
+        sock.close()
+        raise
+
+
+class L2capBackend(AbstractBackend):
+    """Backend using an L2CAP socket on the ATT channel.
+
+    This is the lightest backend: no process is started per operation and
+    there is no helper process, it needs a Linux kernel with Bluetooth
+    support and the capability to open Bluetooth sockets.
+    """
+
+    # pylint: disable=too-many-arguments
+
+    def __init__(
+        self,
+        adapter: str = "hci0",
+        address_type: str = "public",
+        *,
+        timeout: float = 10,
+        mtu: int = DEFAULT_MTU,
+        retry_policy: Optional[RetryPolicy] = None
+    ):
+        """Create a new instance.
+
+        @param: timeout - timeout in seconds for connecting and for each request
+        @param: mtu - MTU to negotiate after connecting, the default of 23
+            does not need a negotiation
+        @param: retry_policy - retries of failed connects, defaults to 3
+            attempts with 0.5 and 1 seconds delay
+        """
+        super().__init__(adapter, address_type)
+        self.timeout = timeout
+        self.mtu = mtu
+        self.retry_policy = retry_policy or DEFAULT_RETRY_POLICY
+        self.mac = None  # type: Optional[str]
+        self._client = None  # type: Optional[AttClient]
+        # requests the connected device answered with "Request Not Supported"
+        self._unsupported = set()  # type: Set[int]
+
+    def connect(self, mac: str):
+        """Connect to the device and negotiate the MTU."""
+        self.disconnect()
+        last_error = None  # type: Optional[BluetoothBackendException]
+        policy = self._effective_retry_policy(self.retry_policy, mac)
+        for attempt in policy.attempts(self.deadline):
+            if attempt.number > 1:
+                self._count_metric("retries_total", "connect", mac)
+            timeout = self.remaining_time(attempt.timeout(self.timeout))
+            try:
+                self._client = self._open(mac, timeout)
+            except BluetoothBackendException as exception:
+                _LOGGER.debug("Connecting to %s failed: %s", mac, exception)
+                last_error = exception
+                continue
+            self.mac = mac
+            return
+        self.check_deadline()
+        raise last_error
+
+    def _open(self, mac: str, timeout: Optional[float]) -> AttClient:
+        """Open the ATT channel to @mac and negotiate the MTU.
+
+        A failed MTU exchange fails the connection attempt as well.
+        """
+        try:
+            sock = open_att_socket(mac, self.adapter, self.address_type, timeout)
+        except OSError as exception:
+            raise BluetoothBackendException(
+                "Connecting to {} failed: {}".format(mac, exception)
+            ) from exception
+        client = AttClient(sock)
+        if self.mtu > DEFAULT_MTU:
+            try:
+                client.exchange_mtu(self.mtu, self.remaining_time(timeout))
+            except:  # noqa: E722
+                client.close()
+                raise
+        return client
+
+    def disconnect(self):
+        """Close the socket, the kernel disconnects the device."""
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+        self.mac = None
+        self._unsupported.clear()
+
+    def is_connected(self) -> bool:
+        """Check if the socket is open."""
+        return self._client is not None
+
+    def _connected_client(self) -> AttClient:
+        if self._client is None:
+            raise BluetoothBackendException("Not connected to any device.")
+        return self._client
+
+    def read_handle(self, handle: int) -> bytes:
+        """Read a handle with an ATT Read Request."""
+        return self._connected_client().read(handle, self.remaining_time(self.timeout))
+
+    def read_handles(self, handles: List[int]) -> Dict[int, bytes]:
+        """Read several handles, with Read Multiple requests if the device supports them."""
+        return self.read_multiple(handles)
+
+    def read_multiple(
+        self, handles: List[int], sizes: Optional[List[int]] = None
+    ) -> Dict[int, bytes]:
+        """Read several handles with ATT Read Multiple requests.
+
+        With the fixed @sizes of the values, each Read Multiple Request reads
+        as many handles as fit into one response. Without them the Read
+        Multiple Variable Length Request of Bluetooth 5.2 is used. Devices
+        that do not support the request are read handle by handle.
+        """
+        if sizes is None:
+            return self._read_multiple_variable(list(handles))
+        if len(sizes) != len(handles):
+            raise ValueError("Expected one size per handle")
+        result = {}  # type: Dict[int, bytes]
+        for chunk in _chunks(
+            list(zip(handles, sizes)), self._connected_client().mtu - 1
+        ):
+            chunk_handles = [handle for handle, _ in chunk]
+            values = None
+            if len(chunk) > 1:
+                values = self._read_multiple_fixed(chunk)
+            if values is None:
+                values = AbstractBackend.read_handles(self, chunk_handles)
+            result.update(values)
+        return {handle: result[handle] for handle in handles}
+
+    def _read_multiple_fixed(
+        self, chunk: List[Tuple[int, int]]
+    ) -> Optional[Dict[int, bytes]]:
+        """Read a chunk of (handle, size), None if it has to be read handle by handle."""
+        if READ_MULTIPLE_REQUEST in self._unsupported:
+            return None
+        try:
+            response = self._connected_client().read_multiple(
+                [handle for handle, _ in chunk], self.remaining_time(self.timeout)
+            )
+        except AttError as error:
+            if error.code != ERROR_REQUEST_NOT_SUPPORTED:
+                raise
+            self._unsupported.add(READ_MULTIPLE_REQUEST)
+            return None
+        if len(response) != sum(size for _, size in chunk):
+            _LOGGER.debug(
+                "Read Multiple returned %d bytes instead of %d, reading handle by handle",
+                len(response),
+                sum(size for _, size in chunk),
+            )
+            return None
+        values = {}
+        offset = 0
+        for handle, size in chunk:
+            end = offset + size
+            values[handle] = response[offset:end]
+            offset = end
+        return values
+
+    def _read_multiple_variable(self, handles: List[int]) -> Dict[int, bytes]:
+        result = {}  # type: Dict[int, bytes]
+        pending = handles
+        while (
+            len(pending) > 1 and READ_MULTIPLE_VARIABLE_REQUEST not in self._unsupported
+        ):
+            try:
+                values = self._connected_client().read_multiple_variable(
+                    pending, self.remaining_time(self.timeout)
+                )
+            except AttError as error:
+                if error.code != ERROR_REQUEST_NOT_SUPPORTED:
+                    raise
+                self._unsupported.add(READ_MULTIPLE_VARIABLE_REQUEST)
+                break
+            complete = 0
+            for handle, (length, value) in zip(pending, values):
+                if len(value) < length:
+                    # cut off at the end of the response
+                    result[handle] = self.read_long(handle)
+                    complete += 1
+                    break
+                result[handle] = value
+                complete += 1
+            if complete == 0:
+                break
+            pending = pending[complete:]
+        for handle in pending:
+            result[handle] = self.read_handle(handle)
+        return {handle: result[handle] for handle in handles}
+
+    def read_long(self, handle: int, max_length: int = MAX_ATTRIBUTE_LENGTH) -> bytes:
+        """Read a value of up to @max_length bytes with Read and Read Blob requests."""
+        buffer = bytearray(max_length)
+        size = self._connected_client().read_long(
+            handle, buffer, self.remaining_time(self.timeout)
+        )
+        del buffer[size:]
+        return bytes(buffer)
+
+    def discover_characteristics(self) -> Dict[str, int]:
+        """Discover the characteristics with ATT Read By Type requests."""
+        client = self._connected_client()
+        handles = {}  # type: Dict[str, int]
+        start = 0x0001
+        while start <= 0xFFFF:
+            try:
+                declarations = client.read_by_type(
+                    start,
+                    0xFFFF,
+                    CHARACTERISTIC_DECLARATION,
+                    self.remaining_time(self.timeout),
+                )
+            except AttError as error:
+                # no more characteristics after start
+                if error.code == ERROR_ATTRIBUTE_NOT_FOUND:
+                    break
+                raise
+            if not declarations:
+                break
+            for _, value in declarations:
+                _, value_handle, uuid = decode_characteristic(value)
+                # the first characteristic wins if several services use the uuid
+                handles.setdefault(uuid, value_handle)
+            start = declarations[-1][0] + 1
+        return handles
+
+    def write_handle(self, handle: int, value: bytes, response: bool = True):
+        """Write a handle with an ATT Write Request, or a Write Command if @response is False."""
+        client = self._connected_client()
+        if response:
+            client.write(handle, value, self.remaining_time(self.timeout))
+            return True
+        if len(value) > client.mtu - 3:
+            raise BluetoothBackendException(
+                "Write Command of {} bytes does not fit into the MTU of {}".format(
+                    len(value), client.mtu
+                )
+            )
+        client.write_command(handle, value, self.remaining_time(self.timeout))
+        return True
+
+    def wait_for_notification(self, handle: int, delegate, notification_timeout: float):
+        """Enable notifications on @handle and pass them to the delegate until the timeout."""
+        for notification_handle, value in self.iter_notifications(
+            handle, notification_timeout
+        ):
+            delegate.handleNotification(notification_handle, value)
+        return True
+
+    def iter_notifications(
+        self,
+        handle: int,
+        timeout: float,
+        *,
+        max_count: Optional[int] = None,
+        idle_timeout: Optional[float] = None,
+        buffer_size: int = 64
+    ) -> Iterator[Tuple[int, bytes]]:
+        """Enable notifications and yield them as the socket receives them.
+
+        See AbstractBackend.iter_notifications.
+        """
+        client = self._connected_client()
+        client.notifications = deque(client.notifications, maxlen=buffer_size)
+        self.write_handle(handle, self._DATA_MODE_LISTEN)
+        deadline = time.monotonic() + self.remaining_time(timeout)
+        count = 0
+        while max_count is None or count < max_count:
+            wait = deadline - time.monotonic()
+            if idle_timeout is not None:
+                wait = min(wait, idle_timeout)
+            notification = client.next_notification(wait)
+            if notification is None:
+                return
+            count += 1
+            yield notification
+
+    @staticmethod
+    def check_backend() -> bool:
+        """Check if the kernel supports Bluetooth L2CAP sockets."""
+        try:
+            sock = socket.socket(AF_BLUETOOTH, socket.SOCK_SEQPACKET, BTPROTO_L2CAP)
+        except (OSError, AttributeError) as exception:
+            _LOGGER.error("L2CAP sockets are not available: %s", exception)
+            return False
+        sock.close()
+        return True
+
+    @staticmethod
+    def supports_scanning() -> bool:
+        return False
+
+
+def _chunks(
+    sizes: List[Tuple[int, int]], limit: int
+) -> Iterator[List[Tuple[int, int]]]:
+    """Split (handle, size) pairs into chunks whose sizes add up to at most @limit."""
+    chunk = []  # type: List[Tuple[int, int]]
+    total = 0
+    for handle, size in sizes:
+        if chunk and total + size > limit:
+            yield chunk
+            chunk = []
+            total = 0
+        chunk.append((handle, size))
+        total += size
+    if chunk:
+        yield chunk
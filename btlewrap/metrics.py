@@ -0,0 +1,348 @@
+"""Metrics on connections, operations, retries and timeouts.
+
+Metrics are disabled by default. Pass a MetricsSink to
+BluetoothInterface(metrics=...) to enable them, e.g. an InMemoryMetrics that
+can be exported with prometheus_text().
+
+All metrics are labelled with backend, adapter, mac and operation:
+
+lock_wait_seconds   histogram, time waiting for the adapter lock
+connect_seconds     histogram, time to connect to the device
+operation_seconds   histogram, duration of reads, writes and notifications
+errors_total        counter, failed connects and operations
+retries_total       counter, retries of the backends
+timeouts_total      counter, operations that timed out, e.g. killed gatttool calls
+rejected_total      counter, connects rejected by an open circuit breaker
+"""
+from bisect import bisect_left
+from threading import Lock
+import time
+from typing import Dict, Iterator, List, Optional, Tuple  # noqa: F401
+
+# upper bounds of the histogram buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# operation label of the backend methods
+OPERATIONS = {
+    "connect": "connect",
+    "disconnect": "disconnect",
+    "read_handle": "read",
+    "read_handles": "read_handles",
+    "read_multiple": "read_multiple",
+    "read_long": "read_long",
+    "write_handle": "write",
+    "write_handles": "write_handles",
+    "write_stream": "write_stream",
+    "discover_characteristics": "discover",
+    "wait_for_notification": "notification",
+    "_wait_for_notifications": "notification",
+    "iter_notifications": "notification",
+}
+
+_LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def metric_labels(
+    backend: str, adapter: Optional[str], mac: Optional[str], operation: str
+) -> Dict[str, str]:
+    """Build the labels shared by all metrics."""
+    return {
+        "backend": backend,
+        "adapter": adapter or "",
+        "mac": mac.upper() if mac else "",
+        "operation": operation,
+    }
+
+
+class MetricsSink:
+    """Receives the metrics of btlewrap.
+
+    Implement this to forward the metrics to a monitoring system. Both
+    methods are called from the threads doing the bluetooth operations, so
+    they must be thread-safe and fast.
+    """
+
+    def observe(self, name: str, value: float, labels: Dict[str, str]):
+        """Add a measurement, e.g. a duration in seconds, to a histogram."""
+        raise NotImplementedError
+
+    def increment(self, name: str, labels: Dict[str, str], amount: float = 1):
+        """Increment a counter."""
+        raise NotImplementedError
+
+
+class Histogram:
+    """Counts of the measurements per bucket, with their sum and count."""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # the last count is for values above the largest bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def __repr__(self):
+        return "Histogram(count={}, sum={})".format(self.count, self.sum)
+
+    def observe(self, value: float):
+        """Add one measurement."""
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[float, int]]:
+        """Get (upper bound, number of measurements <= bound), ending with +inf."""
+        result = []
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def quantile(self, quantile: float) -> Optional[float]:
+        """Estimate a quantile as the upper bound of the bucket containing it."""
+        if self.count == 0:
+            return None
+        for bound, total in self.cumulative():
+            if total >= quantile * self.count:
+                return bound
+        return float("inf")
+
+    def copy(self) -> "Histogram":
+        """Get a snapshot of this histogram."""
+        histogram = Histogram(self.buckets)
+        histogram.counts = list(self.counts)
+        histogram.sum = self.sum
+        histogram.count = self.count
+        return histogram
+
+
+class InMemoryMetrics(MetricsSink):
+    """Thread-safe aggregator that keeps all metrics in memory."""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._histograms = {}  # type: Dict[Tuple[str, _LabelKey], Histogram]
+        self._counters = {}  # type: Dict[Tuple[str, _LabelKey], float]
+        self._lock = Lock()
+
+    def observe(self, name: str, value: float, labels: Dict[str, str]):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = Histogram(self.buckets)
+                self._histograms[key] = histogram
+            histogram.observe(value)
+
+    def increment(self, name: str, labels: Dict[str, str], amount: float = 1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def counter(self, name: str, **labels) -> float:
+        """Sum of the counter @name over all label sets matching @labels."""
+        with self._lock:
+            return sum(
+                value
+                for (counter_name, key), value in self._counters.items()
+                if counter_name == name and _matches(key, labels)
+            )
+
+    def histogram(self, name: str, **labels) -> Histogram:
+        """Histogram @name merged over all label sets matching @labels."""
+        merged = Histogram(self.buckets)
+        with self._lock:
+            for (histogram_name, key), histogram in self._histograms.items():
+                if histogram_name == name and _matches(key, labels):
+                    merged.counts = [
+                        a + b for a, b in zip(merged.counts, histogram.counts)
+                    ]
+                    merged.sum += histogram.sum
+                    merged.count += histogram.count
+        return merged
+
+    def histograms(self) -> List[Tuple[str, Dict[str, str], Histogram]]:
+        """Get a snapshot of all histograms as (name, labels, histogram)."""
+        with self._lock:
+            return [
+                (name, dict(key), histogram.copy())
+                for (name, key), histogram in sorted(self._histograms.items())
+            ]
+
+    def counters(self) -> List[Tuple[str, Dict[str, str], float]]:
+        """Get a snapshot of all counters as (name, labels, value)."""
+        with self._lock:
+            return [
+                (name, dict(key), value)
+                for (name, key), value in sorted(self._counters.items())
+            ]
+
+    def reset(self):
+        """Forget all metrics."""
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+
+def _matches(key: _LabelKey, labels: Dict[str, str]) -> bool:
+    items = dict(key)
+    return all(items.get(label) == value for label, value in labels.items())
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str], extra: str = "") -> str:
+    parts = [
+        '{}="{}"'.format(name, _escape(value)) for name, value in sorted(labels.items())
+    ]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_bound(bound: float) -> str:
+    return "+Inf" if bound == float("inf") else repr(float(bound))
+
+
+def _histogram_lines(prefix: str, metrics: InMemoryMetrics) -> Iterator[str]:
+    last_name = None
+    for name, labels, histogram in metrics.histograms():
+        if name != last_name:
+            yield "# TYPE {}{} histogram".format(prefix, name)
+            last_name = name
+        for bound, total in histogram.cumulative():
+            yield "{}{}_bucket{} {}".format(
+                prefix,
+                name,
+                _format_labels(labels, 'le="{}"'.format(_format_bound(bound))),
+                total,
+            )
+        yield "{}{}_sum{} {}".format(
+            prefix, name, _format_labels(labels), histogram.sum
+        )
+        yield "{}{}_count{} {}".format(
+            prefix, name, _format_labels(labels), histogram.count
+        )
+
+
+def _counter_lines(prefix: str, metrics: InMemoryMetrics) -> Iterator[str]:
+    last_name = None
+    for name, labels, value in metrics.counters():
+        if name != last_name:
+            yield "# TYPE {}{} counter".format(prefix, name)
+            last_name = name
+        yield "{}{}{} {}".format(prefix, name, _format_labels(labels), value)
+
+
+def prometheus_text(metrics: InMemoryMetrics, prefix: str = "btlewrap_") -> str:
+    """Export the metrics in the Prometheus text format."""
+    lines = list(_histogram_lines(prefix, metrics))
+    lines.extend(_counter_lines(prefix, metrics))
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+class MeteredBackend:
+    """Wraps a connected backend and measures its operations.
+
+    All other attributes are passed on to the backend.
+    """
+
+    def __init__(self, backend, mac: str, metrics: MetricsSink, backend_name: str):
+        self.backend = backend
+        self._mac = mac
+        self._metrics = metrics
+        self._backend_name = backend_name
+
+    def __getattr__(self, name: str):
+        return getattr(self.backend, name)
+
+    def _labels(self, operation: str) -> Dict[str, str]:
+        return metric_labels(
+            self._backend_name, self.backend.adapter, self._mac, operation
+        )
+
+    def _measure(self, operation: str, func, *args, **kwargs):
+        labels = self._labels(operation)
+        start = time.monotonic()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            self._metrics.increment("errors_total", labels)
+            raise
+        finally:
+            self._metrics.observe("operation_seconds", time.monotonic() - start, labels)
+
+    def read_handle(self, handle: int) -> bytes:
+        """Read a handle and measure the duration."""
+        return self._measure("read", self.backend.read_handle, handle)
+
+    def read_handles(self, handles: List[int]) -> Dict[int, bytes]:
+        """Read several handles and measure the duration."""
+        return self._measure("read_handles", self.backend.read_handles, handles)
+
+    def read_multiple(
+        self, handles: List[int], sizes: Optional[List[int]] = None
+    ) -> Dict[int, bytes]:
+        """Read several handles with read_multiple and measure the duration."""
+        return self._measure(
+            "read_multiple", self.backend.read_multiple, handles, sizes
+        )
+
+    def read_long(self, handle: int, *args, **kwargs) -> bytes:
+        """Read a long value and measure the duration."""
+        return self._measure(
+            "read_long", self.backend.read_long, handle, *args, **kwargs
+        )
+
+    def write_handle(self, handle: int, value: bytes, *args, **kwargs):
+        """Write a handle and measure the duration."""
+        return self._measure(
+            "write", self.backend.write_handle, handle, value, *args, **kwargs
+        )
+
+    def write_handles(self, values):
+        """Write several handles and measure the duration."""
+        return self._measure("write_handles", self.backend.write_handles, values)
+
+    def write_stream(self, handle: int, chunks, *args, **kwargs) -> int:
+        """Write a stream of chunks and measure the duration."""
+        return self._measure(
+            "write_stream", self.backend.write_stream, handle, chunks, *args, **kwargs
+        )
+
+    def discover_characteristics(self) -> Dict[str, int]:
+        """Discover the characteristics and measure the duration."""
+        return self._measure("discover", self.backend.discover_characteristics)
+
+    def wait_for_notification(
+        self, handle: int, delegate, notification_timeout: float, *args, **kwargs
+    ):
+        """Wait for notifications and measure the duration."""
+        return self._measure(
+            "notification",
+            self.backend.wait_for_notification,
+            handle,
+            delegate,
+            notification_timeout,
+            *args,
+            **kwargs
+        )
+
+    def iter_notifications(
+        self, handle: int, *args, **kwargs
+    ) -> Iterator[Tuple[int, bytes]]:
+        """Iterate over notifications and measure the duration until the end."""
+        labels = self._labels("notification")
+        start = time.monotonic()
+        try:
+            yield from self.backend.iter_notifications(handle, *args, **kwargs)
+        except Exception:
+            self._metrics.increment("errors_total", labels)
+            raise
+        finally:
+            self._metrics.observe("operation_seconds", time.monotonic() - start, labels)
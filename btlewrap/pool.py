@@ -0,0 +1,146 @@
+"""Pool of bluetooth adapters, so that several devices can be polled in parallel."""
+import os
+import re
+from collections import OrderedDict
+from threading import Condition
+from typing import Dict, List, Optional  # noqa: F401
+from btlewrap.base import BluetoothInterface, BluetoothBackendException
+
+_SYSFS_BLUETOOTH = "/sys/class/bluetooth"
+
+
+def local_adapters() -> List[str]:
+    """List the names of the local HCI adapters, e.g. ["hci0", "hci1"]."""
+    try:
+        names = os.listdir(_SYSFS_BLUETOOTH)
+    except OSError:
+        return []
+    adapters = [name for name in names if re.fullmatch(r"hci\d+", name)]
+    return sorted(adapters, key=lambda name: int(name[3:]))
+
+
+class BluetoothInterfacePool:
+    """Hands out connections on all local adapters.
+
+    There is one BluetoothInterface per adapter. connect() picks the next
+    free adapter, so devices are spread over all adapters. A mac can be bound
+    to one adapter with set_affinity(), e.g. if only this adapter is in range.
+    """
+
+    def __init__(
+        self,
+        backend: type,
+        adapters: Optional[List[str]] = None,
+        *,
+        affinity: Optional[Dict[str, str]] = None,
+        address_type: str = "public",
+        **kwargs
+    ):
+        if adapters is None:
+            adapters = local_adapters()
+        if not adapters:
+            raise BluetoothBackendException("No bluetooth adapters found.")
+        self._interfaces = OrderedDict()  # type: Dict[str, BluetoothInterface]
+        for adapter in adapters:
+            self._interfaces[adapter] = BluetoothInterface(
+                backend, adapter=adapter, address_type=address_type, **kwargs
+            )
+        self._affinity = {}  # type: Dict[str, str]
+        for mac, adapter in (affinity or {}).items():
+            self.set_affinity(mac, adapter)
+        self._busy = set()  # type: set
+        self._condition = Condition()
+        self._next = 0
+
+    @property
+    def adapters(self) -> List[str]:
+        """Names of the adapters in this pool."""
+        return list(self._interfaces)
+
+    def interface(self, adapter: str) -> BluetoothInterface:
+        """Get the BluetoothInterface of an adapter."""
+        return self._interfaces[adapter]
+
+    def set_affinity(self, mac: str, adapter: Optional[str]):
+        """Always use @adapter for @mac, use None to remove the binding."""
+        if adapter is None:
+            self._affinity.pop(mac.upper(), None)
+            return
+        if adapter not in self._interfaces:
+            raise BluetoothBackendException(
+                "Adapter {} is not part of this pool.".format(adapter)
+            )
+        self._affinity[mac.upper()] = adapter
+
+    def connect(self, mac: str) -> "_PooledConnection":
+        """Connect to the sensor on the next free adapter."""
+        return _PooledConnection(self, mac)
+
+    def is_connected(self) -> bool:
+        """Check if any adapter of the pool is in use."""
+        with self._condition:
+            return bool(self._busy)
+
+    def _acquire(self, mac: str) -> str:
+        """Wait for a free adapter that can be used for @mac and reserve it."""
+        with self._condition:
+            while True:
+                adapter = self._free_adapter(mac)
+                if adapter is not None:
+                    self._busy.add(adapter)
+                    return adapter
+                self._condition.wait()
+
+    def _free_adapter(self, mac: str) -> Optional[str]:
+        """Return the next free adapter for @mac, None if all are busy."""
+        bound = self._affinity.get(mac.upper())
+        if bound is not None:
+            return None if bound in self._busy else bound
+        adapters = self.adapters
+        for offset in range(len(adapters)):
+            index = (self._next + offset) % len(adapters)
+            if adapters[index] not in self._busy:
+                # round robin, so that all adapters get used
+                self._next = index + 1
+                return adapters[index]
+        return None
+
+    def _release(self, adapter: str):
+        """Give an adapter back to the pool."""
+        with self._condition:
+            self._busy.discard(adapter)
+            self._condition.notify_all()
+
+
+class _PooledConnection:  # pylint: disable=too-few-public-methods
+    """Context Manager for a connection on one of the adapters of a pool."""
+
+    def __init__(self, pool: BluetoothInterfacePool, mac: str):
+        self._pool = pool
+        self._mac = mac
+        self.adapter = None  # type: Optional[str]
+        self._connection = None
+
+    def __enter__(self):
+        self.adapter = self._pool._acquire(  # pylint: disable=protected-access
+            self._mac
+        )
+        try:
+            interface = self._pool.interface(self.adapter)
+            self._connection = interface.connect(self._mac)
+            return self._connection.__enter__()
+        except:  # noqa: E722
+            self._release()
+            raise
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            self._connection.__exit__(exc_type, exc_val, exc_tb)
+        finally:
+            self._release()
+
+    def _release(self):
+        if self.adapter is not None:
+            self._pool._release(self.adapter)  # pylint: disable=protected-access
+            self.adapter = None
+        self._connection = None
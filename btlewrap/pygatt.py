@@ -2,8 +2,22 @@
 
 This backend uses the pygatt API: https://github.com/peplin/pygatt
 """
-from typing import Callable, Optional
+from collections import deque
+from functools import partial
+from threading import Event
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 from btlewrap.base import AbstractBackend, BluetoothBackendException
+from btlewrap.metrics import OPERATIONS
+from btlewrap.retry import RetryPolicy
+
+DEFAULT_RETRY_POLICY = RetryPolicy(max_attempts=1)
+
+
+def _count_retry(backend, method: str, _error: BaseException):
+    """Count a retry of @method in the metrics of @backend."""
+    # pylint: disable=protected-access
+    backend._count_metric("retries_total", OPERATIONS.get(method, method), backend.mac)
 
 
 def wrap_exception(func: Callable) -> Callable:
@@ -20,11 +34,27 @@ def wrap_exception(func: Callable) -> Callable:
         return func
 
     def _func_wrapper(*args, **kwargs):
+        backend = args[0]
+        policy = getattr(backend, "retry_policy", None) or DEFAULT_RETRY_POLICY
+        if getattr(backend, "breaker", None) is not None:
+            # pylint: disable=protected-access
+            policy = backend._effective_retry_policy(policy, backend.mac)
+        on_retry = None
+        if getattr(backend, "metrics", None) is not None:
+            on_retry = partial(_count_retry, backend, func.__name__)
+        deadline = getattr(backend, "deadline", None)
         try:
-            return func(*args, **kwargs)
-        except BGAPIError as exception:
-            raise BluetoothBackendException() from exception
-        except NotConnectedError as exception:
+            return policy.call(
+                func,
+                *args,
+                retry_on=(BGAPIError, NotConnectedError),
+                on_retry=on_retry,
+                deadline=deadline,
+                **kwargs,
+            )
+        except (BGAPIError, NotConnectedError) as exception:
+            if deadline is not None:
+                backend.check_deadline()
             raise BluetoothBackendException() from exception
 
     return _func_wrapper
@@ -34,11 +64,19 @@ class PygattBackend(AbstractBackend):
     """Bluetooth backend for Blue Giga based bluetooth devices."""
 
     @wrap_exception
-    def __init__(self, adapter: Optional[str] = None, address_type: str = "public"):
+    def __init__(
+        self,
+        adapter: Optional[str] = None,
+        address_type: str = "public",
+        retry_policy: Optional[RetryPolicy] = None,
+    ):
         """Create a new instance.
         Note: the parameter "adapter" is ignored, pygatt detects the right USB port automagically.
+        Failed calls are not retried unless a retry_policy is given.
         """
         super(PygattBackend, self).__init__(adapter, address_type)
+        self.retry_policy = retry_policy or DEFAULT_RETRY_POLICY
+        self.mac = None  # type: Optional[str]
         self.check_backend()
 
         import pygatt
@@ -63,6 +101,7 @@ class PygattBackend(AbstractBackend):
         address_type = pygatt.BLEAddressType.public
         if self.address_type == "random":
             address_type = pygatt.BLEAddressType.random
+        self.mac = mac
         self._device = self._adapter.connect(mac, address_type=address_type)
 
     def is_connected(self) -> bool:
@@ -75,6 +114,7 @@ class PygattBackend(AbstractBackend):
         if self.is_connected():
             self._device.disconnect()
             self._device = None
+            self.mac = None
 
     @wrap_exception
     def read_handle(self, handle: int) -> bytes:
@@ -84,11 +124,96 @@ class PygattBackend(AbstractBackend):
         return self._device.char_read_handle(handle)
 
     @wrap_exception
-    def write_handle(self, handle: int, value: bytes):
+    def write_handle(self, handle: int, value: bytes, response: bool = True):
         """Write a handle to the device."""
         if not self.is_connected():
             raise BluetoothBackendException("Not connected to device!")
-        self._device.char_write_handle(handle, value, True)
+        self._device.char_write_handle(handle, value, response)
+        return True
+
+    @wrap_exception
+    def read_handles(self, handles: List[int]) -> Dict[int, bytes]:
+        """Read several handles from the device."""
+        if not self.is_connected():
+            raise BluetoothBackendException("Not connected to device!")
+        return {handle: self._device.char_read_handle(handle) for handle in handles}
+
+    def wait_for_notification(self, handle: int, delegate, notification_timeout: float):
+        """Enable notifications on @handle and pass them to the delegate until the timeout."""
+        for notification_handle, value in self.iter_notifications(
+            handle, notification_timeout
+        ):
+            delegate.handleNotification(notification_handle, value)
+        return True
+
+    def iter_notifications(
+        self,
+        handle: int,
+        timeout: float,
+        *,
+        max_count: Optional[int] = None,
+        idle_timeout: Optional[float] = None,
+        buffer_size: int = 64,
+    ) -> Iterator[Tuple[int, bytes]]:
+        """Subscribe with pygatt and yield the notifications passed to the callback.
+
+        Like for the other backends, @handle is the handle notifications are
+        enabled on. pygatt subscribes to the characteristic value handle in
+        front of it. See AbstractBackend.iter_notifications.
+        """
+        if not self.is_connected():
+            raise BluetoothBackendException("Not connected to device!")
+        received = deque(maxlen=buffer_size)  # type: deque
+        arrived = Event()
+
+        def _callback(notification_handle: int, value: bytearray):
+            received.append((notification_handle, bytes(value)))
+            arrived.set()
+
+        self._subscribe(handle - 1, _callback)
+        deadline = time.monotonic() + self.remaining_time(timeout)
+        count = 0
+        try:
+            while max_count is None or count < max_count:
+                arrived.clear()
+                if received:
+                    count += 1
+                    yield received.popleft()
+                    continue
+                wait = deadline - time.monotonic()
+                if idle_timeout is not None:
+                    wait = min(wait, idle_timeout)
+                if wait <= 0 or not arrived.wait(wait):
+                    return
+        finally:
+            if self.is_connected():
+                self._unsubscribe(handle - 1)
+
+    @wrap_exception
+    def _subscribe(self, value_handle: int, callback: Callable):
+        self._device.subscribe_handle(value_handle, callback)
+
+    @wrap_exception
+    def _unsubscribe(self, value_handle: int):
+        self._device.unsubscribe_handle(value_handle)
+
+    @wrap_exception
+    def discover_characteristics(self) -> Dict[str, int]:
+        """Discover the characteristics with pygatt."""
+        if not self.is_connected():
+            raise BluetoothBackendException("Not connected to device!")
+        return {
+            str(uuid): characteristic.handle
+            for uuid, characteristic in self._device.discover_characteristics().items()
+        }
+
+    @wrap_exception
+    def write_handles(self, values: List[Tuple[int, bytes]]):
+        """Write several handles to the device."""
+        if not self.is_connected():
+            raise BluetoothBackendException("Not connected to device!")
+        for handle, value in values:
+            self._device.char_write_handle(handle, value, True)
         return True
 
     @staticmethod
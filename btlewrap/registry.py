@@ -0,0 +1,209 @@
+"""Registry of the devices that were seen recently."""
+from collections import deque
+import json
+import os
+from threading import Lock
+import time
+from typing import Dict, Iterable, Iterator, List, Optional  # noqa: F401
+from btlewrap.advertisement import AdvertisementRecord
+
+_FILE_VERSION = 1
+
+
+class DeviceInfo:
+    """What is known about one device.
+
+    last_seen is a unix timestamp, None if the device was never seen. The
+    outcomes of the last connections are kept to calculate the failure rate,
+    last_attempt is the unix timestamp of the last connection.
+    """
+
+    __slots__ = (
+        "mac",
+        "last_seen",
+        "rssi",
+        "address_type",
+        "name",
+        "outcomes",
+        "last_attempt",
+    )
+
+    def __init__(self, mac: str, history: int):
+        self.mac = mac
+        self.last_seen = None  # type: Optional[float]
+        self.rssi = None  # type: Optional[int]
+        self.address_type = None  # type: Optional[str]
+        self.name = None  # type: Optional[str]
+        self.outcomes = deque(maxlen=history)  # type: deque
+        self.last_attempt = None  # type: Optional[float]
+
+    def __repr__(self):
+        return "DeviceInfo(mac={}, last_seen={}, rssi={}, failure_rate={})".format(
+            self.mac, self.last_seen, self.rssi, self.failure_rate
+        )
+
+    @property
+    def failure_rate(self) -> float:
+        """Share of the recent connections that failed, 0 if there were none."""
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def age(self, now: Optional[float] = None) -> Optional[float]:
+        """Seconds since the device was seen, None if it was never seen."""
+        if self.last_seen is None:
+            return None
+        return (time.time() if now is None else now) - self.last_seen
+
+
+class DeviceRegistry:
+    """Thread-safe registry of devices, keyed by mac.
+
+    It is fed with scan results, advertisements and the outcomes of
+    connections. BluetoothInterface(registry=..., max_absence=...) uses it
+    to fail fast instead of waiting for timeouts on devices that are out of
+    range. @history is the number of connection outcomes kept per device.
+    """
+
+    def __init__(self, history: int = 10):
+        self.history = history
+        self._devices = {}  # type: Dict[str, DeviceInfo]
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._devices)
+
+    def __contains__(self, mac: str) -> bool:
+        return mac.upper() in self._devices
+
+    def get(self, mac: str) -> Optional[DeviceInfo]:
+        """Get the info of a device, None if it is unknown."""
+        return self._devices.get(mac.upper())
+
+    def seen(
+        self,
+        mac: str,
+        *,
+        rssi: Optional[int] = None,
+        address_type: Optional[str] = None,
+        name: Optional[str] = None,
+        timestamp: Optional[float] = None
+    ):
+        """The device was seen, e.g. in a scan or an advertisement."""
+        with self._lock:
+            info = self._info(mac)
+            info.last_seen = time.time() if timestamp is None else timestamp
+            if rssi is not None:
+                info.rssi = rssi
+            if address_type is not None:
+                info.address_type = address_type
+            if name is not None:
+                info.name = name
+
+    def record_connection(
+        self, mac: str, success: bool, address_type: Optional[str] = None
+    ):
+        """Add the outcome of a connection, a successful one counts as seen."""
+        with self._lock:
+            info = self._info(mac)
+            info.outcomes.append(success)
+            info.last_attempt = time.time()
+            if success:
+                info.last_seen = info.last_attempt
+                if address_type is not None:
+                    info.address_type = address_type
+
+    def observe(self, results: Iterable) -> Iterator:
+        """Record and pass on the results of iter_scan() or listen_advertisements()."""
+        for result in results:
+            if isinstance(result, AdvertisementRecord):
+                self.seen(result.mac, rssi=result.rssi)
+            else:
+                self.seen(result[0], name=result[1])
+            yield result
+
+    def is_absent(self, mac: str, max_absence: float) -> bool:
+        """Check if a device was not seen within @max_absence seconds.
+
+        Devices that were never seen are not absent, there is just no
+        information on them.
+        """
+        info = self.get(mac)
+        if info is None:
+            return False
+        age = info.age()
+        return age is not None and age > max_absence
+
+    def should_skip(self, mac: str, max_absence: float) -> bool:
+        """Check if connecting to @mac should fail right away.
+
+        That is the case if the device is absent and there was a connection
+        to it within the last @max_absence seconds. So an absent device is
+        still probed once every @max_absence seconds and is not absent any
+        more after a successful connection.
+        """
+        if not self.is_absent(mac, max_absence):
+            return False
+        info = self.get(mac)
+        return (
+            info.last_attempt is not None
+            and time.time() - info.last_attempt <= max_absence
+        )
+
+    def rank(self, macs: Iterable[str]) -> List[str]:
+        """Sort @macs so that devices that were seen recently and rarely failed come first."""
+        now = time.time()
+
+        def _key(mac):
+            info = self.get(mac)
+            if info is None:
+                return (1, 0.0, 0.0)
+            age = info.age(now)
+            return (age is None, info.failure_rate, age or 0.0)
+
+        return sorted(macs, key=_key)
+
+    def save(self, path: str):
+        """Store the registry in a compact json file."""
+        with self._lock:
+            devices = {
+                info.mac: [
+                    info.last_seen,
+                    info.rssi,
+                    info.address_type,
+                    info.name,
+                    "".join("1" if outcome else "0" for outcome in info.outcomes),
+                ]
+                for info in self._devices.values()
+            }
+        temp_path = "{}.tmp".format(path)
+        with open(temp_path, "w", encoding="utf-8") as registry_file:
+            json.dump(
+                {"version": _FILE_VERSION, "devices": devices},
+                registry_file,
+                separators=(",", ":"),
+            )
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str, history: int = 10) -> "DeviceRegistry":
+        """Read a registry from a file written by save()."""
+        with open(path, encoding="utf-8") as registry_file:
+            data = json.load(registry_file)
+        if data.get("version") != _FILE_VERSION:
+            raise ValueError(
+                "Unsupported registry file version {}".format(data.get("version"))
+            )
+        registry = cls(history)
+        for mac, values in data["devices"].items():
+            info = registry._info(mac)  # pylint: disable=protected-access
+            info.last_seen, info.rssi, info.address_type, info.name = values[:4]
+            info.outcomes.extend(outcome == "1" for outcome in values[4])
+        return registry
+
+    def _info(self, mac: str) -> DeviceInfo:
+        info = self._devices.get(mac.upper())
+        if info is None:
+            info = DeviceInfo(mac.upper(), self.history)
+            self._devices[mac.upper()] = info
+        return info
@@ -0,0 +1,149 @@
+"""Retry policy shared by all backends."""
+import logging
+import random
+import time
+from typing import Callable, Iterator, Optional, Tuple, Type  # noqa: F401
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class RetryPolicy:
+    """Defines how often and how long a failed operation is retried.
+
+    The delay before retry n (starting with 1) is
+    base_delay * multiplier ** (n - 1), limited to max_delay and varied
+    randomly by +/- jitter (a fraction of the delay). If a deadline is set,
+    no retry is started that could not finish its delay within @deadline
+    seconds after the first attempt.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay: float = 0.1,
+        *,
+        max_delay: Optional[float] = None,
+        multiplier: float = 2,
+        jitter: float = 0,
+        deadline: Optional[float] = None
+    ):
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1")
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.deadline = deadline
+
+    def __repr__(self):
+        return (
+            "RetryPolicy(max_attempts={}, base_delay={}, max_delay={}, "
+            "multiplier={}, jitter={}, deadline={})".format(
+                self.max_attempts,
+                self.base_delay,
+                self.max_delay,
+                self.multiplier,
+                self.jitter,
+                self.deadline,
+            )
+        )
+
+    def delay(self, retry: int) -> float:
+        """Delay in seconds before retry number @retry (starting with 1)."""
+        delay = self.base_delay * self.multiplier ** (retry - 1)
+        if self.max_delay is not None:
+            delay = min(delay, self.max_delay)
+        if self.jitter:
+            delay *= 1 + random.uniform(-self.jitter, self.jitter)
+        return max(delay, 0)
+
+    def attempts(self, deadline: Optional[float] = None) -> Iterator["RetryAttempt"]:
+        """Yield one RetryAttempt per try and sleep between them.
+
+        Stop iterating as soon as an attempt was successful. @deadline is a
+        time.monotonic() timestamp that limits all attempts in addition to
+        the deadline of the policy.
+        """
+        attempt = RetryAttempt(self, deadline)
+        while True:
+            yield attempt
+            delay = attempt.next_delay()
+            if delay is None:
+                return
+            _LOGGER.debug("Waiting for %s seconds before retrying", delay)
+            time.sleep(delay)
+            attempt.number += 1
+
+    def call(
+        self,
+        func: Callable,
+        *args,
+        retry_on: Tuple[Type[BaseException], ...] = (Exception,),
+        on_retry: Optional[Callable[[BaseException], None]] = None,
+        deadline: Optional[float] = None,
+        **kwargs
+    ):
+        """Call @func and retry it if it raises one of the @retry_on exceptions.
+
+        @on_retry is called with the exception before every retry. No retry
+        is started after the time.monotonic() timestamp @deadline. The
+        exception of the last attempt is raised if all attempts fail.
+        """
+        last_error = None  # type: Optional[BaseException]
+        for attempt in self.attempts(deadline):
+            if on_retry is not None and last_error is not None:
+                on_retry(last_error)
+            try:
+                return func(*args, **kwargs)
+            except retry_on as exception:
+                _LOGGER.debug(
+                    "Call to %s failed, try %d of %d",
+                    func,
+                    attempt.number,
+                    self.max_attempts,
+                )
+                last_error = exception
+        raise last_error
+
+
+class RetryAttempt:
+    """State of one operation that is retried according to a RetryPolicy.
+
+    @deadline is an optional time.monotonic() timestamp, the earlier of it
+    and the deadline of the policy applies.
+    """
+
+    def __init__(self, policy: RetryPolicy, deadline: Optional[float] = None):
+        self.policy = policy
+        self.number = 1
+        self.start = time.monotonic()
+        self.deadline = deadline
+        if policy.deadline is not None:
+            policy_deadline = self.start + policy.deadline
+            if deadline is None or policy_deadline < deadline:
+                self.deadline = policy_deadline
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left until the deadline, None if there is no deadline."""
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0)
+
+    def timeout(self, timeout: float) -> float:
+        """Limit the timeout of this attempt to the deadline."""
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        return min(timeout, remaining)
+
+    def next_delay(self) -> Optional[float]:
+        """Delay before the next attempt, None if there is none."""
+        if self.number >= self.policy.max_attempts:
+            return None
+        delay = self.policy.delay(self.number)
+        remaining = self.remaining()
+        if remaining is not None and delay >= remaining:
+            _LOGGER.debug("Not retrying, the deadline would be exceeded")
+            return None
+        return delay
@@ -0,0 +1,290 @@
+"""Scheduler for polling many devices with their own intervals."""
+import heapq
+import itertools
+import logging
+import time
+from threading import Condition, Event, Thread
+from typing import Callable, Dict, List, Optional, Set, Tuple  # noqa: F401
+
+_LOGGER = logging.getLogger(__name__)
+
+# what to do if a poll is due again before the previous one was finished
+OVERRUN_SKIP = "skip"
+OVERRUN_COALESCE = "coalesce"
+
+
+class PollStats:  # pylint: disable=too-many-instance-attributes
+    """Statistics of the polls of one device.
+
+    lateness is the time between the due time of a poll and its start,
+    duration includes connecting to the device.
+    """
+
+    def __init__(self):
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.coalesced = 0
+        self.last_error = None  # type: Optional[BaseException]
+        self.last_duration = 0.0
+        self.total_duration = 0.0
+        self.max_duration = 0.0
+        self.last_lateness = 0.0
+        self.total_lateness = 0.0
+        self.max_lateness = 0.0
+
+    def __repr__(self):
+        return "PollStats(runs={}, failures={}, skipped={}, coalesced={})".format(
+            self.runs, self.failures, self.skipped, self.coalesced
+        )
+
+    @property
+    def mean_duration(self) -> float:
+        """Average duration of a poll in seconds."""
+        return self.total_duration / self.runs if self.runs else 0.0
+
+    @property
+    def mean_lateness(self) -> float:
+        """Average lateness of a poll in seconds."""
+        return self.total_lateness / self.runs if self.runs else 0.0
+
+    def record(self, lateness: float, duration: float, error: Optional[BaseException]):
+        """Add the result of one poll."""
+        self.runs += 1
+        if error is not None:
+            self.failures += 1
+            self.last_error = error
+        self.last_duration = duration
+        self.total_duration += duration
+        self.max_duration = max(self.max_duration, duration)
+        self.last_lateness = lateness
+        self.total_lateness += lateness
+        self.max_lateness = max(self.max_lateness, lateness)
+
+
+class _PollJob:  # pylint: disable=too-few-public-methods
+    """A registered device."""
+
+    def __init__(
+        self, mac: str, poll_fn: Callable, interval: float, priority: int, due: float
+    ):
+        self.mac = mac
+        self.poll_fn = poll_fn
+        self.interval = interval
+        self.priority = priority
+        self.due = due
+        self.removed = False
+        self.stats = PollStats()
+
+
+class _TokenBucket:
+    """Limits the rate of connections, allows bursts of @burst connections."""
+
+    def __init__(self, rate: float, burst: int):
+        self._rate = rate
+        self._burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._condition = Condition()
+
+    def acquire(self, stopped: Event) -> bool:
+        """Wait for a token, return False if @stopped was set while waiting."""
+        with self._condition:
+            while not stopped.is_set():
+                now = time.monotonic()
+                self._tokens = min(
+                    self._burst, self._tokens + (now - self._updated) * self._rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                self._condition.wait((1 - self._tokens) / self._rate)
+            return False
+
+    def wake(self):
+        """Let waiting threads check their @stopped event."""
+        with self._condition:
+            self._condition.notify_all()
+
+
+class PollScheduler:
+    """Polls registered devices in their intervals on a few worker threads.
+
+    The jobs are kept in a priority queue ordered by the next due time and
+    move to a queue ordered by priority once they are due, so if several
+    jobs are due, the one with the highest priority runs first. Each
+    worker connects with @interface, which can be a BluetoothInterface or a
+    BluetoothInterfacePool, and calls poll_fn(backend) of the job. A device
+    is never polled twice at the same time, a job added for a device while
+    it is polled is queued once that poll finished. If a poll overran its
+    next due time, the missed polls are skipped (OVERRUN_SKIP) or run once
+    right away (OVERRUN_COALESCE).
+
+    @max_connect_rate limits the number of connections per second over all
+    workers, so that a few hundred devices do not all connect at once.
+    """
+
+    def __init__(
+        self,
+        interface,
+        *,
+        workers: Optional[int] = None,
+        max_connect_rate: Optional[float] = None,
+        burst: int = 1,
+        overrun: str = OVERRUN_SKIP
+    ):
+        if overrun not in (OVERRUN_SKIP, OVERRUN_COALESCE):
+            raise ValueError("Unknown overrun mode {}".format(overrun))
+        if workers is None:
+            workers = len(getattr(interface, "adapters", [None]))
+        self._interface = interface
+        self._workers = workers
+        self._overrun = overrun
+        self._bucket = None  # type: Optional[_TokenBucket]
+        if max_connect_rate is not None:
+            self._bucket = _TokenBucket(max_connect_rate, burst)
+        self._jobs = {}  # type: Dict[str, _PollJob]
+        # macs whose job was taken from the queue and is not finished
+        self._running = set()  # type: Set[str]
+        # jobs by (due, -priority), moved to _ready by (-priority, due) once due
+        self._queue = []  # type: List[Tuple[float, int, int, _PollJob]]
+        self._ready = []  # type: List[Tuple[int, float, int, _PollJob]]
+        self._sequence = itertools.count()
+        self._condition = Condition()
+        self._stopped = Event()
+        self._threads = []  # type: List[Thread]
+
+    def add(
+        self,
+        mac: str,
+        poll_fn: Callable,
+        interval: float,
+        priority: int = 0,
+        *,
+        delay: float = 0
+    ):
+        """Poll @mac every @interval seconds, starting after @delay seconds."""
+        if interval <= 0:
+            raise ValueError("interval must be positive")
+        with self._condition:
+            self._remove(mac)
+            job = _PollJob(mac, poll_fn, interval, priority, time.monotonic() + delay)
+            self._jobs[mac.upper()] = job
+            if mac.upper() not in self._running:
+                self._push(job)
+
+    def remove(self, mac: str):
+        """Stop polling @mac, a running poll is finished."""
+        with self._condition:
+            self._remove(mac)
+
+    def stats(self) -> Dict[str, PollStats]:
+        """Get the statistics of all registered devices."""
+        with self._condition:
+            return {job.mac: job.stats for job in self._jobs.values()}
+
+    def start(self):
+        """Start the worker threads."""
+        if self._threads:
+            raise RuntimeError("Scheduler is already running.")
+        self._stopped.clear()
+        for number in range(self._workers):
+            thread = Thread(
+                target=self._work, name="btlewrap-poll-{}".format(number), daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stop the workers and wait for running polls to finish."""
+        self._stopped.set()
+        with self._condition:
+            self._condition.notify_all()
+        if self._bucket is not None:
+            self._bucket.wake()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _remove(self, mac: str):
+        job = self._jobs.pop(mac.upper(), None)
+        if job is not None:
+            job.removed = True
+
+    def _push(self, job: _PollJob):
+        heapq.heappush(self._queue, (job.due, -job.priority, next(self._sequence), job))
+        self._condition.notify()
+
+    def _next_job(self) -> Optional[_PollJob]:
+        """Wait until a job is due and take it from the queue."""
+        with self._condition:
+            while not self._stopped.is_set():
+                job = self._pop_due()
+                if job is not None:
+                    self._running.add(job.mac.upper())
+                    return job
+                if self._queue:
+                    self._condition.wait(self._queue[0][0] - time.monotonic())
+                else:
+                    self._condition.wait()
+            return None
+
+    def _pop_due(self) -> Optional[_PollJob]:
+        """Take the due job with the highest priority from the queues."""
+        now = time.monotonic()
+        while self._queue and self._queue[0][0] <= now:
+            due, priority, sequence, job = heapq.heappop(self._queue)
+            heapq.heappush(self._ready, (priority, due, sequence, job))
+        while self._ready:
+            job = heapq.heappop(self._ready)[3]
+            if not job.removed:
+                return job
+        return None
+
+    def _work(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            if self._bucket is not None and not self._bucket.acquire(self._stopped):
+                # keep the job for the next start()
+                self._finish(job, False)
+                return
+            self._run(job)
+            self._finish(job, True)
+
+    def _finish(self, job: _PollJob, ran: bool):
+        """Queue the job again, or the job that replaced it meanwhile."""
+        with self._condition:
+            self._running.discard(job.mac.upper())
+            current = self._jobs.get(job.mac.upper())
+            if current is job and ran:
+                self._reschedule(job)
+            elif current is not None:
+                self._push(current)
+
+    def _run(self, job: _PollJob):
+        start = time.monotonic()
+        error = None
+        try:
+            with self._interface.connect(job.mac) as backend:
+                job.poll_fn(backend)
+        except Exception as exception:  # pylint: disable=broad-except
+            _LOGGER.warning("Polling %s failed: %s", job.mac, exception)
+            error = exception
+        job.stats.record(start - job.due, time.monotonic() - start, error)
+
+    def _reschedule(self, job: _PollJob):
+        now = time.monotonic()
+        due = job.due + job.interval
+        if due < now:
+            missed = int((now - due) // job.interval) + 1
+            if self._overrun == OVERRUN_COALESCE:
+                job.stats.coalesced += missed
+                due = now
+            else:
+                job.stats.skipped += missed
+                due += missed * job.interval
+        job.due = due
+        self._push(job)
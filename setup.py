@@ -31,7 +31,7 @@ setup(
         "Programming Language :: Python :: 3.9",
         "Programming Language :: Python :: 3.10",
     ],
-    packages=find_packages(exclude=("test", "test.*")),
+    packages=find_packages(exclude=("test", "test.*", "benchmarks", "benchmarks.*")),
     keywords="bluetooth low-energy ble",
     zip_safe=False,
     extras_require={
@@ -14,6 +14,7 @@ class MockBackend(AbstractBackend):
     def __init__(self, adapter="hci0", address_type=None):
         super(MockBackend, self).__init__(adapter, address_type)
         self.written_handles = []
+        self.write_responses = []
         self.expected_write_handles = set()
         self.override_read_handles = dict()
         self.is_available = True
@@ -29,19 +30,21 @@ class MockBackend(AbstractBackend):
             return self.override_read_handles[handle]
         raise ValueError("handle not implemented in mockup")
 
-    def write_handle(self, handle, value):
+    def write_handle(self, handle, value, response=True):
         """Writing handles just stores the results in a list."""
         self.written_handles.append((handle, value))
+        self.write_responses.append(response)
         return handle in self.expected_write_handles
 
     def wait_for_notification(self, handle, delegate, notification_timeout):
         """same as write_handle. Delegate is not used, yet."""
         delegate.handleNotification(
+            handle,
             bytes(
                 [
                     int(x, 16)
                     for x in "54 3d 32 37 2e 33 20 48 3d 32 37 2e 30 00".split()
                 ]
-            )
+            ),
         )
         return self.write_handle(handle, self._DATA_MODE_LISTEN)
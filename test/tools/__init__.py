@@ -0,0 +1,17 @@
+"""Fake command line tools for testing the gatttool backend without hardware."""
+import os
+from typing import Dict  # noqa: F401
+
+BIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bin")
+
+
+def fake_bluez_env(**settings) -> Dict[str, str]:
+    """Environment with the fake tools first in PATH.
+
+    The keyword arguments configure the fake tools, e.g. latency=0.1 sets
+    FAKE_BLUEZ_LATENCY, see fake_bluez.py for all settings.
+    """
+    env = {"PATH": BIN_DIR + os.pathsep + os.environ.get("PATH", "")}
+    for name, value in settings.items():
+        env["FAKE_BLUEZ_" + name.upper()] = str(value)
+    return env
@@ -0,0 +1,269 @@
+"""Stand-in for the bluez command line tools gatttool and hcitool.
+
+The output mimics the real tools, so that GatttoolBackend can be tested
+end to end without a bluetooth adapter. Put test/tools/bin first in PATH,
+e.g. with test.tools.fake_bluez_env(). The behaviour is configured with
+environment variables:
+
+FAKE_BLUEZ_LATENCY          seconds to wait before each answer, default 0
+FAKE_BLUEZ_HANG             comma separated operations that never finish:
+                            connect, read, write
+FAKE_BLUEZ_FAIL             comma separated operations that fail with the
+                            error message of the real tool: connect, read,
+                            write, discover, lescan
+FAKE_BLUEZ_VALUES           values of the handles, e.g. "0x38=aabb,0x35=01",
+                            all handles return 00 11 aa ff if not set
+FAKE_BLUEZ_CHARACTERISTICS  value handles and uuids of the characteristics,
+                            e.g. "0x0003=2a00,0x0038=00001a02-0000-1000-8000-00805f9b34fb"
+FAKE_BLUEZ_NOTIFICATIONS    notifications sent after enabling them, default 3
+FAKE_BLUEZ_NOTIFY_INTERVAL  seconds between notifications, default 0.01
+FAKE_BLUEZ_DEVICES          devices found by lescan, e.g. "AA:BB:CC:DD:EE:FF=Flower care,11:22:33:44:55:66"
+FAKE_BLUEZ_SCAN_INTERVAL    seconds between the lines of lescan, default 0.01
+FAKE_BLUEZ_LOG              append every command line to this file
+"""
+import argparse
+import os
+import signal
+import sys
+import threading
+import time
+
+_NOTIFICATION = "54 3d 32 37 2e 33 20 48 3d 32 37 2e 30 00"
+_DEFAULT_DEVICES = (
+    "C4:7C:8D:6A:3E:7A=Flower care,C4:7C:8D:6A:3E:7B,4C:65:A8:D0:6B:12=MJ_HT_V1"
+)
+_DEFAULT_CHARACTERISTICS = (
+    "0x0003=2a00,"
+    "0x0033=00001a00-0000-1000-8000-00805f9b34fb,"
+    "0x0035=00001a01-0000-1000-8000-00805f9b34fb,"
+    "0x0038=00001a02-0000-1000-8000-00805f9b34fb"
+)
+_ERRORS = {
+    "connect": "connect error: Connection refused (111)",
+    "read": "Characteristic value/descriptor read failed: Attribute can't be read",
+    "write": "Characteristic Write Request failed: Attribute can't be written",
+    "discover": "Discover all characteristics failed: Connection timed out (110)",
+    "lescan": "Set scan parameters failed: Input/output error",
+}
+
+
+def _setting(name: str, default: str = "") -> str:
+    return os.environ.get("FAKE_BLUEZ_" + name, default)
+
+
+def _operations(name: str) -> set:
+    return {op.strip() for op in _setting(name).split(",") if op.strip()}
+
+
+def _hex(value: bytes) -> str:
+    return "".join("{:02x} ".format(byte) for byte in value)
+
+
+def _output(line: str, end: str = "\n"):
+    sys.stdout.write(line + end)
+    sys.stdout.flush()
+
+
+def _hang():
+    """Block until the process is stopped with a signal."""
+    while True:
+        time.sleep(3600)
+
+
+def _begin(operation: str) -> bool:
+    """Wait, hang or fail like the real tool, return False on failure."""
+    time.sleep(float(_setting("LATENCY", "0")))
+    if operation in _operations("HANG"):
+        _hang()
+    return operation not in _operations("FAIL")
+
+
+def _value(handle: str) -> bytes:
+    values = _setting("VALUES")
+    if not values:
+        return bytes([0x00, 0x11, 0xAA, 0xFF])
+    for item in values.split(","):
+        key, value = item.split("=")
+        if int(key, 16) == int(handle, 16):
+            return bytes.fromhex(value)
+    return b""
+
+
+def _characteristics(separator: str = ": "):
+    """Print the configured characteristics like "characteristics" of gatttool -I.
+
+    "gatttool --characteristics" uses " = " as @separator.
+    """
+    items = _setting("CHARACTERISTICS", _DEFAULT_CHARACTERISTICS).split(",")
+    for item in items:
+        handle, uuid = item.split("=")
+        if len(uuid) == 4:
+            uuid = "0000{}-0000-1000-8000-00805f9b34fb".format(uuid)
+        value_handle = int(handle, 16)
+        _output(
+            "handle{0}0x{1:04x}, char properties{0}0x0a, char value handle{0}0x{2:04x}, "
+            "uuid{0}{3}".format(separator, value_handle - 1, value_handle, uuid)
+        )
+
+
+def _notifications(handle: str):
+    """Print the configured notifications."""
+    interval = float(_setting("NOTIFY_INTERVAL", "0.01"))
+    for _ in range(int(_setting("NOTIFICATIONS", "3"))):
+        time.sleep(interval)
+        _output("Notification handle = {} value: {}".format(handle, _NOTIFICATION))
+
+
+def _gatttool_once(args) -> int:
+    """Run one operation like "gatttool --char-read"."""
+    if not _begin("connect"):
+        sys.stderr.write(_ERRORS["connect"] + "\n")
+        return 1
+    if args.char_read:
+        value = _value(args.handle)
+        if not _begin("read") or not value:
+            _output(_ERRORS["read"])
+            return 1
+        _output("Characteristic value/descriptor: " + _hex(value))
+        return 0
+    if args.char_write_req:
+        if not _begin("write"):
+            _output(_ERRORS["write"])
+            return 1
+        _output("Characteristic value was written successfully")
+        if args.listen:
+            _notifications("0x{:04x}".format(int(args.handle, 16)))
+            # the real gatttool listens until it is stopped
+            _hang()
+        return 0
+    if args.char_write:
+        # write commands are not confirmed, only a failed connect is reported
+        _begin("write")
+        return 0
+    if args.characteristics:
+        return _gatttool_characteristics()
+    sys.stderr.write("no operation given\n")
+    return 1
+
+
+def _gatttool_characteristics() -> int:
+    """Run "gatttool --characteristics"."""
+    if not _begin("discover"):
+        sys.stderr.write(_ERRORS["discover"] + "\n")
+        return 1
+    _characteristics(" = ")
+    return 0
+
+
+def _interactive_command(mac: str, words) -> bool:
+    """Answer one command of "gatttool -I", return False on exit."""
+    if words[0] == "exit":
+        return False
+    if words[0] == "connect":
+        _output("Attempting to connect to {}".format(mac))
+        if _begin("connect"):
+            _output("Connection successful")
+        else:
+            _output("Error: " + _ERRORS["connect"])
+    elif words[0] == "char-read-hnd":
+        value = _value(words[1])
+        if _begin("read") and value:
+            _output("Characteristic value/descriptor: " + _hex(value))
+        else:
+            _output("Error: " + _ERRORS["read"])
+    elif words[0] == "char-write-req":
+        _interactive_write(words)
+    elif words[0] == "characteristics":
+        if _begin("discover"):
+            _characteristics()
+        else:
+            _output("Error: " + _ERRORS["discover"])
+    elif words[0] == "char-write-cmd":
+        # not confirmed by gatttool
+        _begin("write")
+    return True
+
+
+def _interactive_write(words):
+    """Answer "char-write-req <handle> <value>"."""
+    if not _begin("write"):
+        _output("Error: " + _ERRORS["write"])
+        return
+    _output("Characteristic value was written successfully")
+    if words[2].lower() == "0100":
+        handle = "0x{:04x}".format(int(words[1], 16))
+        threading.Thread(target=_notifications, args=(handle,), daemon=True).start()
+
+
+def _gatttool_interactive(args) -> int:
+    """Run "gatttool -I", reading commands from stdin."""
+    prompt = "\x1b[0;94m[{}]\x1b[0m[LE]> ".format(args.device)
+    _output(prompt, end="")
+    for line in sys.stdin:
+        words = line.split()
+        if words and not _interactive_command(args.device, words):
+            return 0
+        _output("\r" + prompt, end="")
+    return 0
+
+
+def gatttool(argv) -> int:
+    """Emulate gatttool."""
+    parser = argparse.ArgumentParser(prog="gatttool")
+    parser.add_argument("--device", "-b")
+    parser.add_argument("--addr-type", "-t", default="public")
+    parser.add_argument("--adapter", "-i", default="hci0")
+    parser.add_argument("--char-read", action="store_true")
+    parser.add_argument("--char-write-req", action="store_true")
+    parser.add_argument("--char-write", action="store_true")
+    parser.add_argument("--characteristics", action="store_true")
+    parser.add_argument("--handle", "-a")
+    parser.add_argument("--value", "-n")
+    parser.add_argument("--listen", action="store_true")
+    parser.add_argument("--interactive", "-I", action="store_true")
+    args = parser.parse_args(argv)
+    if args.interactive:
+        return _gatttool_interactive(args)
+    return _gatttool_once(args)
+
+
+def hcitool(argv) -> int:
+    """Emulate "hcitool [-i hciX] lescan [--passive] [--duplicates]"."""
+    parser = argparse.ArgumentParser(prog="hcitool")
+    parser.add_argument("-i", dest="adapter", default="hci0")
+    parser.add_argument("command", choices=["lescan"])
+    parser.add_argument("--passive", action="store_true")
+    parser.add_argument("--duplicates", action="store_true")
+    args = parser.parse_args(argv)
+    if not _begin("lescan"):
+        sys.stderr.write(_ERRORS["lescan"] + "\n")
+        return 1
+    devices = [
+        item.split("=", 1) for item in _setting("DEVICES", _DEFAULT_DEVICES).split(",")
+    ]
+    interval = float(_setting("SCAN_INTERVAL", "0.01"))
+    _output("LE Scan ...")
+    while True:
+        for device in devices:
+            time.sleep(interval)
+            _output("{} (unknown)".format(device[0]))
+            if len(device) > 1:
+                _output("{} {}".format(device[0], device[1]))
+        if not args.duplicates:
+            # without duplicates, every device is only reported once
+            _hang()
+
+
+def main(tool: str, argv) -> int:
+    """Run the fake @tool."""
+    # the real tools stop quietly on SIGINT
+    signal.signal(
+        signal.SIGINT, lambda *_: os._exit(0)
+    )  # pylint: disable=protected-access
+    log = _setting("LOG")
+    if log:
+        with open(log, "a", encoding="utf-8") as log_file:
+            log_file.write(" ".join([tool] + list(argv)) + "\n")
+    if tool == "gatttool":
+        return gatttool(argv)
+    return hcitool(argv)
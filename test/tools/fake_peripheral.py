@@ -0,0 +1,164 @@
+"""Stand-in for a Bluetooth LE device answering ATT requests on a socketpair."""
+import socket
+import struct
+from threading import Thread
+from typing import Dict, Iterable, List, Optional, Union  # noqa: F401
+from uuid import UUID
+from btlewrap import att
+
+
+class FakePeripheral:
+    """ATT server on one end of a SOCK_SEQPACKET socketpair.
+
+    @values maps handles to their values, reading or writing other handles
+    fails with "Invalid Handle". Writing 01 00 to a handle sends the
+    @notifications, as indications if @indicate is True. Requests with an
+    opcode in @unsupported are answered with "Request Not Supported".
+    @characteristics maps value handles to the uuids of the characteristics,
+    16 bit uuids as int, their declarations are found by Read By Type. All
+    received PDUs are recorded in self.received.
+    """
+
+    def __init__(
+        self,
+        values: Dict[int, bytes],
+        *,
+        mtu: int = att.DEFAULT_MTU,
+        notifications: int = 0,
+        indicate: bool = False,
+        unsupported: Iterable[int] = (),
+        characteristics: Optional[Dict[int, Union[int, str]]] = None
+    ):
+        self.values = dict(values)
+        self.mtu = mtu
+        self.notifications = notifications
+        self.indicate = indicate
+        self.unsupported = frozenset(unsupported)
+        self.characteristics = characteristics or {}
+        self.received = []  # type: List[bytes]
+        self.client_socket, self._socket = socket.socketpair(
+            socket.AF_UNIX, socket.SOCK_SEQPACKET
+        )
+        self._thread = Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Stop the peripheral."""
+        self._socket.close()
+        self._thread.join(5)
+
+    def _serve(self):
+        try:
+            while True:
+                pdu = self._socket.recv(att.MAX_MTU)
+                if not pdu:
+                    return
+                self.received.append(pdu)
+                self._answer(pdu)
+        except OSError:
+            return
+
+    def _answer(self, pdu: bytes):
+        opcode = pdu[0]
+        if opcode in self.unsupported:
+            self._error(opcode, 0, att.ERROR_REQUEST_NOT_SUPPORTED)
+        elif opcode == att.EXCHANGE_MTU_REQUEST:
+            self.mtu = min(self.mtu, att.decode_mtu(pdu))
+            self._socket.send(att.encode_exchange_mtu(self.mtu, response=True))
+        elif opcode == att.READ_REQUEST:
+            self._read(pdu)
+        elif opcode == att.READ_BY_TYPE_REQUEST:
+            self._read_by_type(pdu)
+        elif opcode == att.READ_BLOB_REQUEST:
+            self._read_blob(pdu)
+        elif opcode in (att.READ_MULTIPLE_REQUEST, att.READ_MULTIPLE_VARIABLE_REQUEST):
+            self._read_multiple(pdu)
+        elif opcode in (att.WRITE_REQUEST, att.WRITE_COMMAND):
+            self._write(pdu)
+        elif opcode != att.HANDLE_VALUE_CONFIRMATION:
+            self._error(opcode, 0, att.ERROR_REQUEST_NOT_SUPPORTED)
+
+    def _read(self, pdu: bytes):
+        handle = struct.unpack_from("<H", pdu, 1)[0]
+        if handle not in self.values:
+            self._error(pdu[0], handle, 0x01)
+            return
+        size = self.mtu - 1
+        self._socket.send(bytes([att.READ_RESPONSE]) + self.values[handle][:size])
+
+    def _write(self, pdu: bytes):
+        opcode = pdu[0]
+        handle, value = att.decode_handle_value(pdu)
+        if handle not in self.values:
+            if opcode == att.WRITE_REQUEST:
+                self._error(opcode, handle, 0x01)
+            return
+        self.values[handle] = value
+        if opcode == att.WRITE_REQUEST:
+            self._socket.send(bytes([att.WRITE_RESPONSE]))
+        if value == b"\x01\x00":
+            self._notify(handle - 1)
+
+    def _read_by_type(self, pdu: bytes):
+        start, end, attribute_type = struct.unpack_from("<HHH", pdu, 1)
+        declarations = []
+        if attribute_type == att.CHARACTERISTIC_DECLARATION:
+            for value_handle in sorted(self.characteristics):
+                if start <= value_handle - 1 <= end:
+                    declarations.append(
+                        (value_handle - 1, self._declaration(value_handle))
+                    )
+        if not declarations:
+            self._error(pdu[0], start, att.ERROR_ATTRIBUTE_NOT_FOUND)
+            return
+        # all entries of a response have the same length
+        size = len(declarations[0][1]) + 2
+        response = bytearray([att.READ_BY_TYPE_RESPONSE, size])
+        for handle, value in declarations:
+            if len(value) + 2 != size or len(response) + size > self.mtu:
+                break
+            response += struct.pack("<H", handle) + value
+        self._socket.send(bytes(response))
+
+    def _declaration(self, value_handle: int) -> bytes:
+        uuid = self.characteristics[value_handle]
+        if isinstance(uuid, int):
+            encoded = struct.pack("<H", uuid)
+        else:
+            encoded = bytes(reversed(UUID(uuid).bytes))
+        return struct.pack("<BH", 0x0A, value_handle) + encoded
+
+    def _read_blob(self, pdu: bytes):
+        handle, offset = struct.unpack_from("<HH", pdu, 1)
+        if handle not in self.values:
+            self._error(pdu[0], handle, 0x01)
+            return
+        value = self.values[handle]
+        if offset > len(value):
+            self._error(pdu[0], handle, att.ERROR_INVALID_OFFSET)
+            return
+        end = offset + self.mtu - 1
+        self._socket.send(bytes([att.READ_BLOB_RESPONSE]) + value[offset:end])
+
+    def _read_multiple(self, pdu: bytes):
+        variable = pdu[0] == att.READ_MULTIPLE_VARIABLE_REQUEST
+        handles = struct.unpack_from("<{}H".format((len(pdu) - 1) // 2), pdu, 1)
+        response = bytearray([pdu[0] + 1])
+        for handle in handles:
+            if handle not in self.values:
+                self._error(pdu[0], handle, 0x01)
+                return
+            if variable:
+                response += struct.pack("<H", len(self.values[handle]))
+            response += self.values[handle]
+        size = self.mtu
+        self._socket.send(bytes(response[:size]))
+
+    def _notify(self, handle: int):
+        for number in range(self.notifications):
+            self._socket.send(
+                att.encode_handle_value(handle, bytes([number]), self.indicate)
+            )
+
+    def _error(self, opcode: int, handle: int, code: int):
+        self._socket.send(att.encode_error(opcode, handle, code))
@@ -0,0 +1,133 @@
+"""Tests for the default implementations in AbstractBackend."""
+import time
+import unittest
+from test.helper import MockBackend
+from btlewrap.base import BluetoothBackendException
+
+
+class SilentBackend(MockBackend):
+    """Backend that only sends notifications after a long time."""
+
+    def wait_for_notification(self, handle, delegate, notification_timeout):
+        """Send nothing."""
+        return True
+
+
+class SleepyBackend(MockBackend):
+    """Backend waiting for notifications that never arrive."""
+
+    def wait_for_notification(self, handle, delegate, notification_timeout):
+        """Send nothing until the timeout."""
+        time.sleep(notification_timeout)
+        return True
+
+
+class BrokenBackend(MockBackend):
+    """Backend failing to listen."""
+
+    def wait_for_notification(self, handle, delegate, notification_timeout):
+        """Fail."""
+        raise BluetoothBackendException("test")
+
+
+class ChattyBackend(MockBackend):
+    """Backend sending notifications until the delegate stops it."""
+
+    def __init__(self, adapter="hci0", address_type=None):
+        super().__init__(adapter, address_type)
+        self.listening = False
+
+    def wait_for_notification(self, handle, delegate, notification_timeout):
+        """Send a notification every 10 ms."""
+        self.listening = True
+        try:
+            deadline = time.monotonic() + notification_timeout
+            while time.monotonic() < deadline:
+                delegate.handleNotification(handle, b"\x01")
+                time.sleep(0.01)
+        finally:
+            self.listening = False
+        return True
+
+
+class TestAbstractBackend(unittest.TestCase):
+    """Tests for the default implementations in AbstractBackend."""
+
+    def test_read_handles(self):
+        """Batches are read handle by handle."""
+        backend = MockBackend()
+        backend.override_read_handles = {1: b"\x01", 2: b"\x02"}
+        self.assertEqual({1: b"\x01", 2: b"\x02"}, backend.read_handles([1, 2]))
+
+    def test_read_multiple_long(self):
+        """Without raw ATT requests, reads fall back to read_handle."""
+        backend = MockBackend()
+        backend.override_read_handles = {1: b"\x01", 2: b"\x02"}
+        self.assertEqual(
+            {1: b"\x01", 2: b"\x02"}, backend.read_multiple([1, 2], [1, 1])
+        )
+        self.assertEqual(b"\x02", backend.read_long(2))
+        with self.assertRaises(ValueError):
+            backend.read_multiple([1, 2], [1])
+
+    def test_write_handles(self):
+        """Batches are written in order."""
+        backend = MockBackend()
+        backend.write_handles([(2, b"\x02"), (1, b"\x01")])
+        self.assertEqual([(2, b"\x02"), (1, b"\x01")], backend.written_handles)
+
+    def test_write_stream(self):
+        """Streams are written without response, except for the checkpoints."""
+        backend = MockBackend()
+        chunks = (bytes([number]) * 2 for number in range(5))
+        self.assertEqual(10, backend.write_stream(0x33, chunks, checkpoint_interval=2))
+        self.assertEqual(
+            [bytes([number]) * 2 for number in range(5)],
+            [value for _, value in backend.written_handles],
+        )
+        self.assertEqual([False, True, False, True, True], backend.write_responses)
+        self.assertEqual(0, backend.write_stream(0x33, []))
+        with self.assertRaises(ValueError):
+            backend.write_stream(0x33, [b"\x01"], checkpoint_interval=0)
+
+    def test_iter_notifications(self):
+        """Notifications are yielded as (handle, value) tuples."""
+        backend = MockBackend()
+        notifications = list(backend.iter_notifications(0x0E, 5))
+        self.assertEqual(1, len(notifications))
+        self.assertEqual(0x0E, notifications[0][0])
+        self.assertEqual(b"T=27.3 H=27.0\x00", notifications[0][1])
+
+    def test_iter_notifications_idle(self):
+        """Iteration ends after the idle timeout."""
+        backend = SilentBackend()
+        self.assertEqual(
+            [], list(backend.iter_notifications(0x0E, 5, idle_timeout=0.01))
+        )
+
+    def test_iter_notifications_stops_worker(self):
+        """The backend is not used any more once the iteration ended."""
+        backend = ChattyBackend()
+        start = time.monotonic()
+        self.assertEqual(2, len(list(backend.iter_notifications(0x0E, 5, max_count=2))))
+        self.assertFalse(backend.listening)
+        notifications = backend.iter_notifications(0x0E, 5)
+        next(notifications)
+        notifications.close()
+        self.assertFalse(backend.listening)
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_iter_notifications_close_silent(self):
+        """Closing does not wait for the timeout of a silent device."""
+        backend = SleepyBackend()
+        start = time.monotonic()
+        self.assertEqual(
+            [], list(backend.iter_notifications(0x0E, 3, idle_timeout=0.01))
+        )
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_iter_notifications_error(self):
+        """Errors of the backend are raised to the caller."""
+        backend = BrokenBackend()
+        with self.assertRaises(BluetoothBackendException):
+            list(backend.iter_notifications(0x0E, 5))
@@ -0,0 +1,160 @@
+"""Tests for the AdapterLock shared by several processes."""
+import multiprocessing
+import os
+import tempfile
+import time
+import unittest
+from threading import Thread
+from test import TEST_MAC
+from test.helper import MockBackend
+from btlewrap.adapterlock import AdapterLock
+from btlewrap.base import BluetoothInterface, BluetoothTimeoutError
+
+
+def _die_holding(directory, acquired):
+    """Acquire the adapter and exit without releasing it."""
+    AdapterLock(directory).acquire("hci0")
+    acquired.set()
+    os._exit(0)  # pylint: disable=protected-access
+
+
+class TestAdapterLock(unittest.TestCase):
+    """Tests for the AdapterLock class."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def test_acquire_release(self):
+        """The holder is the first process in the queue."""
+        lock = AdapterLock(self.directory)
+        self.assertIsNone(lock.holder("hci0"))
+        ticket = lock.acquire("hci0")
+        self.assertEqual(os.getpid(), lock.holder("hci0"))
+        self.assertIsNone(lock.holder("hci1"))
+        lock.release(ticket)
+        self.assertIsNone(lock.holder("hci0"))
+        self.assertEqual(
+            ["hci0.lock", "hci0.queue", "hci1.lock"], sorted(os.listdir(self.directory))
+        )
+
+    def test_timeout(self):
+        """Waiting stops after the timeout, the waiter leaves the queue."""
+        lock = AdapterLock(self.directory, timeout=0.1)
+        ticket = lock.acquire("hci0")
+        start = time.monotonic()
+        with self.assertRaises(BluetoothTimeoutError):
+            lock.acquire("hci0")
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(1, len(lock.waiting("hci0")))
+        with self.assertRaises(BluetoothTimeoutError):
+            lock.acquire("hci0", deadline=time.monotonic())
+        lock.release(ticket)
+        with lock.hold("hci0", timeout=0.1):
+            self.assertEqual(os.getpid(), lock.holder("hci0"))
+
+    def test_fifo(self):
+        """Waiters get the adapter in the order they queued."""
+        lock = AdapterLock(self.directory, poll_interval=0.01)
+        ticket = lock.acquire("hci0")
+        order = []
+
+        def wait(name):
+            with lock.hold("hci0", timeout=5):
+                order.append(name)
+                time.sleep(0.05)
+
+        threads = []
+        for name in ("first", "second", "third"):
+            threads.append(Thread(target=wait, args=(name,)))
+            threads[-1].start()
+            while len(lock.waiting("hci0")) < len(threads) + 1:
+                time.sleep(0.01)
+        lock.release(ticket)
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(["first", "second", "third"], order)
+
+    def test_stale_entries(self):
+        """Processes that died are removed from the queue."""
+        with open(os.path.join(self.directory, "hci0.queue"), "w") as queue_file:
+            queue_file.write("1-gone 1\n2-unlocked 2\ninvalid\n")
+        with open(os.path.join(self.directory, "hci0.2-unlocked.ticket"), "w"):
+            pass
+        lock = AdapterLock(self.directory, timeout=0.5)
+        with lock.hold("hci0"):
+            self.assertEqual([os.getpid()], lock.waiting("hci0"))
+        with open(os.path.join(self.directory, "hci0.queue")) as queue_file:
+            self.assertEqual("", queue_file.read())
+        self.assertEqual(
+            ["hci0.lock", "hci0.queue"], sorted(os.listdir(self.directory))
+        )
+
+    def test_dead_process(self):
+        """The adapter is free again when its holder died."""
+        acquired = multiprocessing.Event()
+        process = multiprocessing.Process(
+            target=_die_holding, args=(self.directory, acquired)
+        )
+        process.start()
+        self.assertTrue(acquired.wait(10))
+        process.join(10)
+        lock = AdapterLock(self.directory, timeout=1)
+        with lock.hold("hci0"):
+            self.assertEqual(os.getpid(), lock.holder("hci0"))
+
+
+class TestInterfaceWithAdapterLock(unittest.TestCase):
+    """Tests for BluetoothInterface with an AdapterLock."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.lock = AdapterLock(directory.name)
+
+    def test_connect(self):
+        """The adapter is held while connected."""
+        interface = BluetoothInterface(MockBackend, adapter_lock=self.lock)
+        with interface.connect(TEST_MAC):
+            self.assertEqual(os.getpid(), self.lock.holder("hci0"))
+        self.assertIsNone(self.lock.holder("hci0"))
+
+    def test_timeout(self):
+        """The connect timeout limits the wait for other processes."""
+        interface = BluetoothInterface(MockBackend, adapter_lock=self.lock)
+        ticket = self.lock.acquire("hci0")
+        with self.assertRaises(BluetoothTimeoutError):
+            with interface.connect(TEST_MAC, timeout=0.1):
+                pass
+        self.assertFalse(interface.is_connected())
+        self.lock.release(ticket)
+        with interface.connect(TEST_MAC, timeout=0.1):
+            self.assertTrue(interface.is_connected())
+
+    def test_linger(self):
+        """A lingering connection holds the adapter until it is closed."""
+        interface = BluetoothInterface(MockBackend, adapter_lock=self.lock, linger=10)
+        with interface.connect(TEST_MAC):
+            pass
+        self.assertEqual(os.getpid(), self.lock.holder("hci0"))
+        with interface.connect(TEST_MAC):
+            self.assertEqual(os.getpid(), self.lock.holder("hci0"))
+        self.assertEqual(1, interface.connection_stats()["reuses"])
+        other = BluetoothInterface(MockBackend, adapter_lock=self.lock)
+        with other.connect(TEST_MAC, timeout=1):
+            self.assertEqual(1, interface.connection_stats()["disconnects"])
+        self.assertIsNone(self.lock.holder("hci0"))
+        with interface.connect(TEST_MAC):
+            pass
+        interface.close()
+        self.assertIsNone(self.lock.holder("hci0"))
+
+    def test_linger_expires(self):
+        """The adapter is given back when the lingering connection times out."""
+        interface = BluetoothInterface(MockBackend, adapter_lock=self.lock, linger=0.1)
+        with interface.connect(TEST_MAC):
+            pass
+        self.assertEqual(os.getpid(), self.lock.holder("hci0"))
+        time.sleep(0.3)
+        self.assertIsNone(self.lock.holder("hci0"))
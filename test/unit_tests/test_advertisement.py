@@ -0,0 +1,79 @@
+"""Tests for the parsing and filtering of advertisements."""
+import unittest
+from btlewrap.advertisement import (
+    AdvertisementFilter,
+    AdvertisementRecord,
+    advertised_uuids,
+    normalize_uuid,
+    parse_advertising_data,
+)
+
+MIFLORA_UUID = "0000fe95-0000-1000-8000-00805f9b34fb"
+
+
+class TestAdvertisement(unittest.TestCase):
+    """Tests for the parsing and filtering of advertisements."""
+
+    def test_parse_advertising_data(self):
+        """The data is split into AD structures, padding is ignored."""
+        data = bytes.fromhex("020106" "0716" "95FE01020304" "00000000")
+        self.assertEqual(
+            [(0x01, b"\x06"), (0x16, bytes.fromhex("95FE01020304"))],
+            parse_advertising_data(data),
+        )
+
+    def test_parse_truncated_data(self):
+        """A truncated AD structure is dropped."""
+        self.assertEqual([(0x01, b"\x06")], parse_advertising_data(b"\x02\x01\x06\x05"))
+
+    def test_normalize_uuid(self):
+        """Short UUIDs are expanded to 128 bit."""
+        self.assertEqual(MIFLORA_UUID, normalize_uuid(0xFE95))
+        self.assertEqual(MIFLORA_UUID, normalize_uuid("FE95"))
+        self.assertEqual(MIFLORA_UUID, normalize_uuid(MIFLORA_UUID.upper()))
+        for invalid in ("2a0", "fe9x", "0000fe9"):
+            with self.assertRaises(ValueError):
+                normalize_uuid(invalid)
+
+    def test_advertised_uuids(self):
+        """UUIDs are found in UUID lists and service data."""
+        self.assertEqual(
+            [MIFLORA_UUID, normalize_uuid(0x180F)],
+            advertised_uuids(0x03, bytes.fromhex("95FE0F18")),
+        )
+        self.assertEqual(
+            [MIFLORA_UUID], advertised_uuids(0x16, bytes.fromhex("95FE01"))
+        )
+        self.assertEqual([], advertised_uuids(0xFF, bytes.fromhex("95FE01")))
+
+    def test_service_data(self):
+        """UUID and data of service data records."""
+        record = AdvertisementRecord("AA", -60, 0x16, bytes.fromhex("95FE0102"))
+        self.assertEqual(MIFLORA_UUID, record.service_uuid())
+        self.assertEqual(b"\x01\x02", record.service_data())
+        record = AdvertisementRecord("AA", -60, 0xFF, bytes.fromhex("95FE0102"))
+        self.assertIsNone(record.service_uuid())
+        self.assertIsNone(record.service_data())
+
+    def test_filter(self):
+        """Advertisements are filtered by mac and service UUID."""
+        structures = [(0x01, b"\x06"), (0x16, bytes.fromhex("95FE01"))]
+        self.assertEqual(2, len(AdvertisementFilter().records("aa", -1, structures)))
+        self.assertEqual(
+            2, len(AdvertisementFilter(macs=["AA"]).records("aa", -1, structures))
+        )
+        self.assertEqual(
+            [], AdvertisementFilter(macs=["BB"]).records("aa", -1, structures)
+        )
+        self.assertEqual(
+            2,
+            len(
+                AdvertisementFilter(service_uuids=["fe95"]).records(
+                    "aa", -1, structures
+                )
+            ),
+        )
+        self.assertEqual(
+            [],
+            AdvertisementFilter(service_uuids=[0x181A]).records("aa", -1, structures),
+        )
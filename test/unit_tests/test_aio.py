@@ -0,0 +1,380 @@
+"""Tests for the asyncio interface."""
+import asyncio
+import threading
+import time
+import unittest
+from unittest import mock
+from test import TEST_MAC
+from test.helper import MockBackend
+from btlewrap import BluetoothBackendException, GatttoolBackend
+from btlewrap.base import BluetoothInterface, BluetoothTimeoutError
+from btlewrap.aio import AsyncBluetoothInterface, AsyncGatttoolBackend
+
+
+def _run(coroutine):
+    """Run a coroutine in a new event loop."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class FakeStream:
+    """Stand-in for the stdout of an asyncio subprocess."""
+
+    def __init__(self, output, delay):
+        self.lines = [line + b"\n" for line in bytes(output, "utf-8").splitlines()]
+        self.delay = delay
+
+    async def readline(self):
+        """Return the next line, the end of the stream comes after the delay."""
+        if self.lines:
+            return self.lines.pop(0)
+        delay, self.delay = self.delay, 0
+        await asyncio.sleep(delay)
+        return b""
+
+
+class FakeProcess:
+    """Stand-in for an asyncio subprocess."""
+
+    pid = 0
+
+    def __init__(self, output, delay=0, returncode=0):
+        self.output = output
+        self.delay = delay
+        self.stdout = FakeStream(output, delay)
+        self.exit_code = returncode
+        self.returncode = None
+
+    async def communicate(self):
+        """Return the output after the delay."""
+        delay, self.delay = self.delay, 0
+        await asyncio.sleep(delay)
+        self.returncode = self.exit_code
+        return bytes(self.output, "utf-8"), b""
+
+    async def wait(self):
+        """Process has stopped."""
+        self.returncode = self.exit_code
+        return self.returncode
+
+
+def _configure_exec_mock(exec_mock, output, delay=0, returncode=0):
+    """Let create_subprocess_exec return a FakeProcess."""
+
+    async def _create(*args, **kwargs):  # pylint: disable=unused-argument
+        return FakeProcess(output, delay, returncode)
+
+    exec_mock.side_effect = _create
+
+
+class TestAsyncBluetoothInterface(unittest.TestCase):
+    """Tests for the AsyncBluetoothInterface class."""
+
+    def test_executor_backend(self):
+        """Synchronous backends are run in an executor."""
+        interface = AsyncBluetoothInterface(MockBackend)
+
+        async def _test():
+            self.assertFalse(interface.is_connected())
+            async with interface.connect(TEST_MAC) as backend:
+                self.assertTrue(interface.is_connected())
+                backend._backend.override_read_handles[0x38] = b"\x01"
+                return await backend.read_handle(0x38)
+
+        self.assertEqual(b"\x01", _run(_test()))
+        self.assertFalse(interface.is_connected())
+
+    def test_exception_in_with(self):
+        """Test clean exit after exception."""
+        interface = AsyncBluetoothInterface(MockBackend)
+
+        async def _test():
+            async with interface.connect(TEST_MAC):
+                raise ValueError("some test exception")
+
+        with self.assertRaises(ValueError):
+            _run(_test())
+        self.assertFalse(interface.is_connected())
+
+    def test_connections_are_serialized(self):
+        """Only one coroutine at a time uses the adapter."""
+        interface = AsyncBluetoothInterface(MockBackend)
+        active = []
+
+        async def _poll(mac):
+            async with interface.connect(mac):
+                active.append(mac)
+                self.assertEqual(1, len(active))
+                await asyncio.sleep(0.01)
+                active.remove(mac)
+
+        async def _test():
+            await asyncio.gather(*[_poll(str(i)) for i in range(5)])
+
+        _run(_test())
+
+    def test_shared_with_sync_interface(self):
+        """Async and sync interfaces of the same adapter wait for each other."""
+        interface = AsyncBluetoothInterface(MockBackend)
+        sync_interface = BluetoothInterface(MockBackend)
+        connected = threading.Event()
+        events = []
+
+        def _hold():
+            with sync_interface.connect(TEST_MAC):
+                connected.set()
+                time.sleep(0.2)
+                events.append("sync")
+
+        async def _tick():
+            # the event loop keeps running while the adapter is busy
+            while not events:
+                await asyncio.sleep(0.01)
+                events.append("tick")
+
+        async def _test():
+            thread = threading.Thread(target=_hold)
+            thread.start()
+            connected.wait(5)
+            ticker = asyncio.ensure_future(_tick())
+            async with interface.connect(TEST_MAC, timeout=5):
+                events.append("async")
+                # a sync connection has to wait for the async one
+                with self.assertRaises(BluetoothTimeoutError):
+                    with sync_interface.connect(TEST_MAC, timeout=0.05):
+                        pass
+            await ticker
+            thread.join(5)
+
+        _run(_test())
+        self.assertEqual("tick", events[0])
+        self.assertEqual(["sync", "async"], [e for e in events if e != "tick"])
+        with sync_interface.connect(TEST_MAC, timeout=0.1):
+            self.assertTrue(interface.is_connected())
+
+    def test_lock_timeout(self):
+        """The connect timeout limits the wait for the adapter."""
+        interface = AsyncBluetoothInterface(MockBackend)
+        sync_interface = BluetoothInterface(MockBackend)
+
+        async def _test():
+            async with interface.connect(TEST_MAC, timeout=0.1):
+                pass
+
+        with sync_interface.connect(TEST_MAC):
+            start = time.monotonic()
+            with self.assertRaises(BluetoothTimeoutError):
+                _run(_test())
+            self.assertLess(time.monotonic() - start, 1)
+        _run(_test())
+        self.assertFalse(interface.is_connected())
+
+    def test_cancel_waiting_for_adapter(self):
+        """A cancelled wait does not keep the adapter."""
+        interface = AsyncBluetoothInterface(MockBackend)
+        sync_interface = BluetoothInterface(MockBackend)
+
+        async def _connect():
+            async with interface.connect(TEST_MAC):
+                pass
+
+        async def _test():
+            task = asyncio.ensure_future(_connect())
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        with sync_interface.connect(TEST_MAC):
+            _run(_test())
+        with sync_interface.connect(TEST_MAC, timeout=1):
+            pass
+
+    def test_gatttool_is_native(self):
+        """gatttool is run with asyncio subprocesses."""
+        interface = AsyncBluetoothInterface(GatttoolBackend)
+        # pylint: disable=protected-access
+        self.assertIsInstance(interface._backend, AsyncGatttoolBackend)
+
+
+class TestAsyncGatttoolBackend(unittest.TestCase):
+    """Tests for the AsyncGatttoolBackend class."""
+
+    # pylint: disable=unused-argument
+
+    handle_notification_called = False
+
+    @mock.patch("asyncio.create_subprocess_exec")
+    def test_read_handle_ok(self, exec_mock):
+        """Test reading handle successfully."""
+        _configure_exec_mock(exec_mock, "Characteristic value/descriptor: 00 11 AA FF")
+        backend = AsyncGatttoolBackend()
+
+        async def _test():
+            await backend.connect(TEST_MAC)
+            return await backend.read_handle(0xFF)
+
+        self.assertEqual(bytes([0x00, 0x11, 0xAA, 0xFF]), _run(_test()))
+        self.assertIn("--char-read", exec_mock.call_args[0])
+        self.assertTrue(exec_mock.call_args[1]["start_new_session"])
+
+    @mock.patch("asyncio.create_subprocess_exec")
+    @mock.patch("asyncio.sleep")
+    def test_read_handle_empty_output(self, sleep_mock, exec_mock):
+        """Test reading handle where no result is returned."""
+        _configure_exec_mock(exec_mock, "")
+
+        async def _no_sleep(delay):
+            pass
+
+        sleep_mock.side_effect = _no_sleep
+        backend = AsyncGatttoolBackend()
+
+        async def _test():
+            await backend.connect(TEST_MAC)
+            await backend.read_handle(0xFF)
+
+        with self.assertRaises(BluetoothBackendException):
+            _run(_test())
+        self.assertEqual(4, exec_mock.call_count)
+
+    def test_gatttool_configuration(self):
+        """The configuration is that of GatttoolBackend."""
+        backend = AsyncGatttoolBackend(retries=1, timeout=5)
+        self.assertEqual(2, backend.retry_policy.max_attempts)
+        self.assertEqual(5, backend.timeout)
+        self.assertEqual("hci0", backend.adapter)
+        with backend.time_limit(10):
+            self.assertIsNotNone(backend.deadline)
+        self.assertIsNone(backend.deadline)
+        # synchronous operations of GatttoolBackend would block the event loop
+        for name in ("read_handles", "write_stream", "iter_notifications"):
+            self.assertFalse(hasattr(backend, name))
+
+    @mock.patch("os.killpg")
+    @mock.patch("asyncio.create_subprocess_exec")
+    def test_connect_timeout(self, exec_mock, killpg_mock):
+        """The connect timeout limits the operations and their retries."""
+        _configure_exec_mock(exec_mock, "", delay=10)
+        interface = AsyncBluetoothInterface(GatttoolBackend)
+
+        async def _test():
+            async with interface.connect(TEST_MAC, timeout=0.1) as backend:
+                await backend.read_handle(0xFF)
+
+        start = time.monotonic()
+        with self.assertRaises(BluetoothTimeoutError):
+            _run(_test())
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(1, exec_mock.call_count)
+        # pylint: disable=protected-access
+        self.assertIsNone(interface._backend.deadline)
+
+    def test_read_not_connected(self):
+        """Test reading data when not connected."""
+        with self.assertRaises(BluetoothBackendException):
+            _run(AsyncGatttoolBackend().read_handle(0xFF))
+
+    @mock.patch("asyncio.create_subprocess_exec")
+    def test_write_handle_ok(self, exec_mock):
+        """Test writing to a handle successfully."""
+        _configure_exec_mock(exec_mock, "Characteristic value was written successfully")
+        backend = AsyncGatttoolBackend()
+
+        async def _test():
+            await backend.connect(TEST_MAC)
+            return await backend.write_handle(0xFF, b"\x00\x10\xFF")
+
+        self.assertTrue(_run(_test()))
+        self.assertIn("0010FF", exec_mock.call_args[0])
+
+    @mock.patch("asyncio.sleep")
+    @mock.patch("asyncio.create_subprocess_exec")
+    def test_write_command(self, exec_mock, _):
+        """Write commands succeed if gatttool exits with 0."""
+        _configure_exec_mock(exec_mock, "")
+        backend = AsyncGatttoolBackend(retries=1)
+
+        async def _test():
+            await backend.connect(TEST_MAC)
+            return await backend.write_handle(0xFF, b"\x01", response=False)
+
+        self.assertTrue(_run(_test()))
+        self.assertIn("--char-write", exec_mock.call_args[0])
+        _configure_exec_mock(exec_mock, "", returncode=1)
+        with self.assertRaises(BluetoothBackendException):
+            _run(_test())
+
+    @mock.patch("os.killpg")
+    @mock.patch("asyncio.create_subprocess_exec")
+    def test_wait_for_notification_timeout(self, exec_mock, killpg_mock):
+        """Listening ends with a timeout and stops gatttool."""
+        _configure_exec_mock(
+            exec_mock,
+            (
+                "Characteristic value was written successfully\n"
+                "Notification handle = 0x000e value: 54 3d 32 37 2e 33 20 48 3d 32 37 2e 30 00"
+            ),
+            delay=10,
+        )
+        backend = AsyncGatttoolBackend()
+
+        async def _test():
+            await backend.connect(TEST_MAC)
+            return await backend.wait_for_notification(0x0E, self, 0.01)
+
+        self.assertTrue(_run(_test()))
+        self.assertTrue(self.handle_notification_called)
+        killpg_mock.assert_called_once()
+
+    @mock.patch("os.killpg")
+    @mock.patch("asyncio.create_subprocess_exec")
+    def test_notifications_stream(self, exec_mock, killpg_mock):
+        """Notifications are delivered as they arrive, listening can stop early."""
+        line = "Notification handle = 0x000e value: 54 3d 32 37 2e 33 20 48 3d 32 37 2e 30 00"
+        _configure_exec_mock(
+            exec_mock,
+            "\n".join(["Characteristic value was written successfully"] + [line] * 3),
+            delay=10,
+        )
+        backend = AsyncGatttoolBackend()
+        delegate = mock.Mock()
+
+        async def _test(**kwargs):
+            await backend.connect(TEST_MAC)
+            return await backend.wait_for_notification(0x0E, delegate, 5, **kwargs)
+
+        start = time.monotonic()
+        self.assertTrue(_run(_test(max_count=2)))
+        self.assertEqual(2, delegate.handleNotification.call_count)
+        delegate.reset_mock()
+        self.assertTrue(_run(_test(predicate=lambda handle, value: True)))
+        self.assertEqual(1, delegate.handleNotification.call_count)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(2, killpg_mock.call_count)
+
+    @mock.patch("os.killpg")
+    @mock.patch("asyncio.create_subprocess_exec")
+    def test_cancel_kills_gatttool(self, exec_mock, killpg_mock):
+        """Cancelling a read stops gatttool."""
+        _configure_exec_mock(exec_mock, "", delay=10)
+        backend = AsyncGatttoolBackend()
+
+        async def _test():
+            await backend.connect(TEST_MAC)
+            task = asyncio.ensure_future(backend.read_handle(0xFF))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            await task
+
+        with self.assertRaises(asyncio.CancelledError):
+            _run(_test())
+        killpg_mock.assert_called_once()
+
+    def handleNotification(self, handle, raw_data):  # pylint: disable=invalid-name
+        """gets called by the backend when using wait_for_notification"""
+        self.assertEqual(14, len(raw_data))
+        self.handle_notification_called = True
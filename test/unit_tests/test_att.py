@@ -0,0 +1,182 @@
+"""Tests for the ATT codec and client."""
+import socket
+import unittest
+from test.tools.fake_peripheral import FakePeripheral
+from btlewrap import att
+from btlewrap.base import BluetoothBackendException, BluetoothTimeoutError
+
+
+class TestAttCodec(unittest.TestCase):
+    """Tests for the encoding and decoding of ATT PDUs."""
+
+    def test_encode(self):
+        """PDUs are little endian."""
+        self.assertEqual(b"\x02\xf7\x00", att.encode_exchange_mtu(247))
+        self.assertEqual(b"\x0a\x38\x00", att.encode_read_request(0x38))
+        self.assertEqual(b"\x12\x33\x00\xa0\x1f", att.encode_write(0x33, b"\xa0\x1f"))
+        self.assertEqual(b"\x52\x33\x00\x01", att.encode_write(0x33, b"\x01", True))
+        self.assertEqual(b"\x1b\x0e\x00\x05", att.encode_handle_value(0x0E, b"\x05"))
+        self.assertEqual(b"\x01\x0a\x38\x00\x02", att.encode_error(0x0A, 0x38, 2))
+        self.assertEqual(b"\x0c\x38\x00\x16\x00", att.encode_read_blob(0x38, 22))
+        self.assertEqual(
+            b"\x0e\x38\x00\x35\x00", att.encode_read_multiple([0x38, 0x35])
+        )
+        self.assertEqual(
+            b"\x20\x38\x00\x35\x00", att.encode_read_multiple([0x38, 0x35], True)
+        )
+        with self.assertRaises(ValueError):
+            att.encode_read_multiple([0x38])
+
+    def test_decode(self):
+        """PDUs are decoded into their values."""
+        self.assertEqual((0x0E, b"\x05"), att.decode_handle_value(b"\x1d\x0e\x00\x05"))
+        self.assertEqual(247, att.decode_mtu(b"\x03\xf7\x00"))
+        error = att.decode_error(b"\x01\x0a\x38\x00\x02")
+        self.assertEqual(
+            (0x0A, 0x38, 2), (error.request_opcode, error.handle, error.code)
+        )
+        self.assertIn("Read Not Permitted", str(error))
+        with self.assertRaises(BluetoothBackendException):
+            att.decode_handle_value(b"\x1b\x0e")
+        self.assertEqual(
+            [(0x02, b"\x0a\x03\x00\x00\x2a"), (0x04, b"\x02\x05\x00\x01\x2a")],
+            att.decode_read_by_type(
+                b"\x09\x07\x02\x00\x0a\x03\x00\x00\x2a\x04\x00\x02\x05\x00\x01\x2a"
+            ),
+        )
+        self.assertEqual(
+            (0x0A, 0x03, "00002a00-0000-1000-8000-00805f9b34fb"),
+            att.decode_characteristic(b"\x0a\x03\x00\x00\x2a"),
+        )
+        self.assertEqual(
+            "00001a02-0000-1000-8000-00805f9b34fb",
+            att.decode_characteristic(
+                bytes.fromhex("0a3800fb349b5f8000008000100000021a0000")
+            )[2],
+        )
+        self.assertEqual(
+            [(1, b"\x05"), (3, b"\x01")],
+            att.decode_length_values(b"\x21\x01\x00\x05\x03\x00\x01"),
+        )
+
+
+class TestAttClient(unittest.TestCase):
+    """Tests for the AttClient with a fake peripheral."""
+
+    def _client(self, values, **kwargs):
+        peripheral = FakePeripheral(values, **kwargs)
+        client = att.AttClient(peripheral.client_socket)
+        self.addCleanup(peripheral.close)
+        self.addCleanup(client.close)
+        return peripheral, client
+
+    def test_read_write(self):
+        """Reading and writing values."""
+        peripheral, client = self._client({0x38: b"\x01\x02", 0x33: b""})
+        self.assertEqual(b"\x01\x02", client.read(0x38, 1))
+        client.write(0x33, b"\xa0\x1f", 1)
+        self.assertEqual(b"\xa0\x1f", client.read(0x33, 1))
+        client.write_command(0x33, b"\x05")
+        self.assertEqual(b"\x05", client.read(0x33, 1))
+        self.assertEqual(b"\x52\x33\x00\x05", peripheral.received[-2])
+
+    def test_error_response(self):
+        """Error responses are raised as AttError."""
+        _, client = self._client({})
+        with self.assertRaises(att.AttError) as context:
+            client.read(0x38, 1)
+        self.assertEqual(0x01, context.exception.code)
+
+    def test_exchange_mtu(self):
+        """The smaller MTU of both sides is used."""
+        _, client = self._client({0x38: bytes(range(100))}, mtu=64)
+        self.assertEqual(64, client.exchange_mtu(247, 1))
+        self.assertEqual(bytes(range(63)), client.read(0x38, 1))
+
+    def test_read_long(self):
+        """Long values are read with Read Blob into the buffer."""
+        value = bytes(range(70))
+        peripheral, client = self._client({0x38: value, 0x35: bytes(44)})
+        buffer = bytearray(100)
+        self.assertEqual(70, client.read_long(0x38, buffer, 1))
+        self.assertEqual(value, buffer[:70])
+        self.assertEqual(
+            [
+                b"\x0a\x38\x00",
+                b"\x0c\x38\x00\x16\x00",
+                b"\x0c\x38\x00\x2c\x00",
+                b"\x0c\x38\x00\x42\x00",
+            ],
+            peripheral.received,
+        )
+        # ends exactly at the end of a response, the device reports the end
+        self.assertEqual(44, client.read_long(0x35, memoryview(buffer), 1))
+        with self.assertRaises(BluetoothBackendException):
+            client.read_long(0x38, bytearray(50), 1)
+
+    def test_read_multiple(self):
+        """Several values are read with one request."""
+        _, client = self._client({0x38: b"\x01\x02", 0x35: b"\x03"})
+        self.assertEqual(b"\x01\x02\x03", client.read_multiple([0x38, 0x35], 1))
+        self.assertEqual(
+            [(2, b"\x01\x02"), (1, b"\x03")],
+            client.read_multiple_variable([0x38, 0x35], 1),
+        )
+
+    def test_notifications(self):
+        """Notifications are queued, indications are confirmed."""
+        peripheral, client = self._client(
+            {0x0E: b"", 0x0F: b""}, notifications=3, indicate=True
+        )
+        client.write(0x0F, b"\x01\x00", 1)
+        self.assertEqual(
+            [(0x0E, b"\x00"), (0x0E, b"\x01"), (0x0E, b"\x02")],
+            [client.next_notification(1) for _ in range(3)],
+        )
+        self.assertIsNone(client.next_notification(0.05))
+        confirmations = [pdu for pdu in peripheral.received if pdu == b"\x1e"]
+        self.assertEqual(3, len(confirmations))
+
+    def test_notifications_dropped(self):
+        """The oldest notifications are dropped and counted if the buffer is full."""
+        peripheral = FakePeripheral({0x0E: b"", 0x0F: b""}, notifications=3)
+        client = att.AttClient(peripheral.client_socket, buffer_size=2)
+        self.addCleanup(peripheral.close)
+        self.addCleanup(client.close)
+        client.write(0x0F, b"\x01\x00", 1)
+        # the notifications arrive while waiting for the response
+        client.read(0x0E, 1)
+        self.assertEqual(1, client.dropped)
+        self.assertEqual([(0x0E, b"\x01"), (0x0E, b"\x02")], list(client.notifications))
+
+    def test_timeout(self):
+        """Requests without a response time out."""
+        client_socket, device_socket = socket.socketpair(
+            socket.AF_UNIX, socket.SOCK_SEQPACKET
+        )
+        self.addCleanup(device_socket.close)
+        client = att.AttClient(client_socket)
+        self.addCleanup(client.close)
+        with self.assertRaises(BluetoothTimeoutError):
+            client.read(0x38, 0.05)
+
+    def test_server_requests(self):
+        """Requests of the device are answered."""
+        client_socket, device_socket = socket.socketpair(
+            socket.AF_UNIX, socket.SOCK_SEQPACKET
+        )
+        self.addCleanup(device_socket.close)
+        client = att.AttClient(client_socket)
+        self.addCleanup(client.close)
+        device_socket.send(att.encode_exchange_mtu(100))
+        device_socket.send(att.encode_read_request(1))
+        self.assertIsNone(client.next_notification(0.05))
+        self.assertEqual(b"\x03\x17\x00", device_socket.recv(att.MAX_MTU))
+        self.assertEqual(b"\x01\x0a\x01\x00\x06", device_socket.recv(att.MAX_MTU))
+
+    def test_closed(self):
+        """A closed connection raises a BluetoothBackendException."""
+        peripheral, client = self._client({})
+        peripheral.close()
+        with self.assertRaises(BluetoothBackendException):
+            client.read(0x38, 1)
@@ -1,31 +1,63 @@
 """Tests for miflora.available_backends."""
+import subprocess
+import sys
 import unittest
 from unittest import mock
-from btlewrap import available_backends, BluepyBackend, GatttoolBackend, PygattBackend
+from btlewrap import (
+    available_backends,
+    BluepyBackend,
+    GatttoolBackend,
+    L2capBackend,
+    PygattBackend,
+)
 
 
 class TestAvailableBackends(unittest.TestCase):
     """Tests for miflora.available_backends."""
 
-    @mock.patch("btlewrap.gatttool.run", return_value=None)
-    def test_all(self, _):
+    @mock.patch("shutil.which", return_value="/usr/bin/gatttool")
+    @mock.patch.object(L2capBackend, "check_backend", return_value=True)
+    def test_all(self, *_):
         """Tests with all backends available.
 
-        bluepy is installed via tox, gatttool is mocked.
+        bluepy is installed via tox, gatttool and L2CAP sockets are mocked.
         """
-        backends = available_backends()
-        self.assertEqual(3, len(backends))
+        backends = available_backends(refresh=True)
+        self.assertEqual(4, len(backends))
+        self.assertIn(L2capBackend, backends)
         self.assertIn(BluepyBackend, backends)
         self.assertIn(GatttoolBackend, backends)
         self.assertIn(PygattBackend, backends)
 
-    @mock.patch("btlewrap.gatttool.run", **{"side_effect": IOError()})
-    def test_one_missing(self, _):
+    @mock.patch("shutil.which", return_value=None)
+    @mock.patch.object(L2capBackend, "check_backend", return_value=False)
+    def test_one_missing(self, *_):
         """Tests with all backends available.
 
         bluepy is installed via tox, gatttool is mocked.
         """
-        backends = available_backends()
+        backends = available_backends(refresh=True)
         self.assertEqual(2, len(backends))
         self.assertIn(BluepyBackend, backends)
         self.assertIn(PygattBackend, backends)
+
+    def test_cached(self):
+        """The backends are only checked once unless a refresh is requested."""
+        available_backends(refresh=True)
+        with mock.patch.object(GatttoolBackend, "check_backend") as check_mock:
+            available_backends()
+            check_mock.assert_not_called()
+            available_backends(refresh=True)
+            check_mock.assert_called_once_with()
+
+    @unittest.skipIf(sys.version_info < (3, 7), "backends are imported eagerly")
+    def test_lazy_import(self):
+        """The backend modules are only imported when they are used."""
+        code = (
+            "import sys, btlewrap\n"
+            "assert 'btlewrap.gatttool' not in sys.modules\n"
+            "assert btlewrap.GatttoolBackend.__name__ == 'GatttoolBackend'\n"
+            "assert 'btlewrap.gatttool' in sys.modules\n"
+            "assert 'btlewrap.pygatt' not in sys.modules\n"
+        )
+        subprocess.run([sys.executable, "-c", code], check=True)
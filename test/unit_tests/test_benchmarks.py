@@ -0,0 +1,41 @@
+"""Make sure that the benchmarks keep working."""
+import json
+import os
+import tempfile
+import unittest
+from benchmarks import run
+from benchmarks.simulated import SimulatedBackend
+from btlewrap.base import BluetoothBackendException
+
+
+class TestBenchmarks(unittest.TestCase):
+    """Run all benchmarks with very few iterations."""
+
+    def test_run_all(self):
+        """All benchmarks produce results."""
+        results = run.run(list(run.BENCHMARKS), scale=0.001)
+        self.assertEqual(set(run.BENCHMARKS), set(results["benchmarks"]))
+        self.assertGreater(results["benchmarks"]["scan_parsing"]["lines_per_s"], 0)
+        # the retries run the fake gatttool again
+        self.assertGreater(results["benchmarks"]["retry_path"]["per_retry_us"], 0)
+
+    def test_output_file(self):
+        """The results are written as json."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "results.json")
+            run.main(["--quick", "--only", "retry_path", "--output", path])
+            with open(path, encoding="utf-8") as result_file:
+                results = json.load(result_file)
+        self.assertEqual(["retry_path"], list(results["benchmarks"]))
+
+    def test_simulated_failures(self):
+        """The simulated backend fails with the configured rate."""
+        backend = SimulatedBackend(failure_rate=0.5, seed=1)
+        failures = 0
+        for _ in range(200):
+            try:
+                backend.read_handle(0x38)
+            except BluetoothBackendException:
+                failures += 1
+        self.assertEqual(failures, backend.failures)
+        self.assertTrue(60 < failures < 140)
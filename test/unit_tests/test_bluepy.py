@@ -1,10 +1,11 @@
 """Unit tests for the bluepy backend."""
 
+from collections import deque
 import unittest
 from unittest import mock
 from test import TEST_MAC
 from bluepy.btle import BTLEException
-from btlewrap.bluepy import BluepyBackend
+from btlewrap.bluepy import BluepyBackend, _CollectingDelegate
 from btlewrap import BluetoothBackendException
 
 
@@ -58,3 +59,74 @@ class TestBluepy(unittest.TestCase):
         """Check if scanning is set correctly."""
         backend = BluepyBackend()
         self.assertTrue(backend.supports_scanning())
+
+    @mock.patch("bluepy.btle.Peripheral")
+    def test_iter_notifications(self, mock_peripheral):
+        """Notifications are collected while waiting for them."""
+        backend = BluepyBackend()
+        backend.connect(TEST_MAC)
+        peripheral = mock_peripheral.return_value
+        values = [b"\x01", b"\x02"]
+
+        def _wait(_):
+            if not values:
+                return False
+            delegate = peripheral.withDelegate.call_args[0][0]
+            delegate.handleNotification(0x0E, values.pop(0))
+            return True
+
+        peripheral.waitForNotifications.side_effect = _wait
+        self.assertEqual(
+            [(0x0E, b"\x01"), (0x0E, b"\x02")],
+            list(backend.iter_notifications(0x0E, 10)),
+        )
+        peripheral.writeCharacteristic.assert_called_with(0x0E, b"\x01\x00", True)
+
+    def test_notifications_dropped(self):
+        """The oldest notifications are dropped and counted if the buffer is full."""
+        received = deque(maxlen=2)
+        delegate = _CollectingDelegate(received)
+        for value in (b"\x01", b"\x02", b"\x03"):
+            delegate.handleNotification(0x0E, value)
+        self.assertEqual(1, delegate.dropped)
+        self.assertEqual([(0x0E, b"\x02"), (0x0E, b"\x03")], list(received))
+
+    @mock.patch("bluepy.btle.Scanner")
+    def test_listen_advertisements(self, mock_scanner):
+        """Advertisements are passed on as they are received."""
+        scanner = mock_scanner.return_value.withDelegate.return_value
+        device = mock.Mock(addr="c4:7c:8d:6a:3e:7a", rssi=-59)
+        device.rawData = bytes.fromhex("0201060716" "95FE01020304")
+
+        def _process(_):
+            delegate = mock_scanner.return_value.withDelegate.call_args[0][0]
+            delegate.handleDiscovery(device, True, True)
+
+        scanner.process.side_effect = _process
+        listener = BluepyBackend.listen_advertisements(5, "hci1", macs=[device.addr])
+        records = [next(listener), next(listener)]
+        listener.close()
+        mock_scanner.assert_called_with(iface=1)
+        scanner.start.assert_called_with(passive=True)
+        scanner.stop.assert_called_with()
+        self.assertEqual(0x16, records[1].adv_type)
+        self.assertEqual(b"\x01\x02\x03\x04", records[1].service_data())
+
+    @mock.patch("bluepy.btle.Scanner")
+    def test_scan_stops_at_targets(self, mock_scanner):
+        """The scan stops as soon as all targets were found."""
+        scanner = mock_scanner.return_value.withDelegate.return_value
+        devices = [mock.Mock(addr="aa:bb:cc:dd:ee:0{}".format(i)) for i in range(3)]
+        for device in devices:
+            device.getValueText.return_value = "sensor"
+
+        def _process(_):
+            delegate = mock_scanner.return_value.withDelegate.call_args[0][0]
+            delegate.handleDiscovery(devices.pop(0), True, True)
+
+        scanner.process.side_effect = _process
+        found = BluepyBackend.scan_for_devices(10, targets=["AA:BB:CC:DD:EE:01"])
+        self.assertEqual(
+            [("aa:bb:cc:dd:ee:00", "sensor"), ("aa:bb:cc:dd:ee:01", "sensor")], found
+        )
+        self.assertEqual(2, scanner.process.call_count)
@@ -1,7 +1,10 @@
 """Tests for the BluetoothInterface class."""
+import time
 import unittest
+from unittest import mock
+from threading import Event, Thread
 from test.helper import MockBackend
-from btlewrap.base import BluetoothInterface
+from btlewrap.base import BluetoothInterface, BluetoothTimeoutError
 
 
 class TestBluetoothInterface(unittest.TestCase):
@@ -25,3 +28,132 @@ class TestBluetoothInterface(unittest.TestCase):
             with bluetooth_if.connect("abc"):
                 raise ValueError("some test exception")
         self.assertFalse(bluetooth_if.is_connected())
+
+    def test_adapters_are_independent(self):
+        """Connections on different adapters do not block each other."""
+        bluetooth_if0 = BluetoothInterface(MockBackend, adapter="hci0")
+        bluetooth_if1 = BluetoothInterface(MockBackend, adapter="hci1")
+        connected = Event()
+        release = Event()
+
+        def _connect_hci1():
+            with bluetooth_if1.connect("def"):
+                connected.set()
+                release.wait(5)
+
+        thread = Thread(target=_connect_hci1)
+        thread.start()
+        self.assertTrue(connected.wait(5))
+        self.assertTrue(bluetooth_if1.is_connected())
+        self.assertFalse(bluetooth_if0.is_connected())
+
+        with bluetooth_if0.connect("abc"):
+            self.assertTrue(bluetooth_if0.is_connected())
+
+        self.assertFalse(bluetooth_if0.is_connected())
+        self.assertTrue(bluetooth_if1.is_connected())
+        release.set()
+        thread.join()
+        self.assertFalse(bluetooth_if1.is_connected())
+
+    def test_linger_reuses_connection(self):
+        """A lingering connection is reused for the same mac."""
+        bluetooth_if = BluetoothInterface(MockBackend, adapter="hci5", linger=60)
+        backend = bluetooth_if._backend  # pylint: disable=protected-access
+        with mock.patch.object(backend, "connect") as connect, mock.patch.object(
+            backend, "disconnect"
+        ) as disconnect:
+            with bluetooth_if.connect("AA:BB"):
+                pass
+            with bluetooth_if.connect("aa:bb"):
+                pass
+            self.assertEqual(1, connect.call_count)
+            disconnect.assert_not_called()
+            self.assertFalse(bluetooth_if.is_connected())
+
+            with bluetooth_if.connect("CC:DD"):
+                disconnect.assert_called_once_with()
+            bluetooth_if.close()
+            self.assertEqual(2, disconnect.call_count)
+        self.assertEqual(
+            {"connects": 2, "reuses": 1, "disconnects": 2},
+            bluetooth_if.connection_stats(),
+        )
+
+    def test_linger_expires(self):
+        """The connection is closed after the idle timeout."""
+        bluetooth_if = BluetoothInterface(MockBackend, adapter="hci5", linger=0.05)
+        backend = bluetooth_if._backend  # pylint: disable=protected-access
+        with mock.patch.object(backend, "disconnect") as disconnect:
+            with bluetooth_if.connect("AA:BB"):
+                pass
+            disconnect.assert_not_called()
+            time.sleep(0.3)
+            disconnect.assert_called_once_with()
+        self.assertEqual(1, bluetooth_if.connection_stats()["disconnects"])
+
+    def test_linger_closed_by_other_interface(self):
+        """Another interface on the adapter closes the lingering connection."""
+        lingering_if = BluetoothInterface(MockBackend, adapter="hci5", linger=60)
+        other_if = BluetoothInterface(MockBackend, adapter="hci5")
+        backend = lingering_if._backend  # pylint: disable=protected-access
+        with mock.patch.object(backend, "disconnect") as disconnect:
+            with lingering_if.connect("AA:BB"):
+                pass
+            with other_if.connect("CC:DD"):
+                disconnect.assert_called_once_with()
+
+    def test_linger_not_after_exception(self):
+        """The connection is closed if the with block failed."""
+        bluetooth_if = BluetoothInterface(MockBackend, adapter="hci5", linger=60)
+        backend = bluetooth_if._backend  # pylint: disable=protected-access
+        with mock.patch.object(backend, "disconnect") as disconnect:
+            with self.assertRaises(ValueError):
+                with bluetooth_if.connect("AA:BB"):
+                    raise ValueError("some test exception")
+            disconnect.assert_called_once_with()
+
+    def test_timeout_waiting_for_lock(self):
+        """Waiting for a busy adapter is limited by the timeout."""
+        bluetooth_if = BluetoothInterface(MockBackend, adapter="hci6")
+        connected = Event()
+        release = Event()
+
+        def _block_adapter():
+            with bluetooth_if.connect("def"):
+                connected.set()
+                release.wait(5)
+
+        thread = Thread(target=_block_adapter)
+        thread.start()
+        self.assertTrue(connected.wait(5))
+        start = time.monotonic()
+        with self.assertRaises(BluetoothTimeoutError):
+            with bluetooth_if.connect("abc", timeout=0.2):
+                pass
+        self.assertLess(time.monotonic() - start, 2)
+        release.set()
+        thread.join()
+
+    def test_timeout_sets_deadline(self):
+        """The backend gets the deadline of the connection for its operations."""
+        bluetooth_if = BluetoothInterface(MockBackend)
+        backend = bluetooth_if._backend  # pylint: disable=protected-access
+        with bluetooth_if.connect("abc", timeout=10):
+            self.assertAlmostEqual(10, backend.remaining_time(), delta=1)
+            self.assertEqual(5, backend.remaining_time(5))
+        self.assertIsNone(backend.deadline)
+        with bluetooth_if.connect("abc"):
+            self.assertIsNone(backend.remaining_time())
+
+    def test_time_limit(self):
+        """Nested time limits cannot extend the deadline."""
+        backend = MockBackend()
+        with backend.time_limit(10):
+            with backend.time_limit(100):
+                self.assertLessEqual(backend.remaining_time(), 10)
+            with backend.time_limit(0):
+                with self.assertRaises(BluetoothTimeoutError):
+                    backend.check_deadline()
+            backend.check_deadline()
+        self.assertIsNone(backend.deadline)
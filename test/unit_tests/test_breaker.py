@@ -0,0 +1,142 @@
+"""Tests for the CircuitBreaker."""
+import unittest
+from unittest import mock
+from test.helper import MockBackend
+from btlewrap import BluetoothTimeoutError, CircuitOpenError
+from btlewrap.base import BluetoothInterface, BluetoothBackendException
+from btlewrap.breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from btlewrap.gatttool import GatttoolBackend
+from btlewrap.metrics import InMemoryMetrics
+from btlewrap.retry import RetryPolicy
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    """Tests for the CircuitBreaker."""
+
+    @mock.patch("time.monotonic")
+    def test_transitions(self, monotonic_mock):
+        """The circuit opens after the threshold and is probed after the cooldown."""
+        monotonic_mock.return_value = 100
+        listener = mock.Mock()
+        breaker = CircuitBreaker(2, 60, listener=listener)
+        breaker.record("aa", False)
+        self.assertIsNone(breaker.check("aa"))
+        breaker.record("aa", False)
+        self.assertEqual(OPEN, breaker.state("AA"))
+        monotonic_mock.return_value = 130
+        self.assertEqual(30, breaker.check("aa"))
+        monotonic_mock.return_value = 161
+        self.assertIsNone(breaker.check("aa"))
+        self.assertTrue(breaker.is_probing("aa"))
+        # only one probe at a time
+        self.assertEqual(0, breaker.check("aa"))
+        breaker.record("aa", False)
+        self.assertEqual(OPEN, breaker.state("aa"))
+        monotonic_mock.return_value = 300
+        self.assertIsNone(breaker.check("aa"))
+        breaker.record("aa", True)
+        self.assertEqual(CLOSED, breaker.state("aa"))
+        self.assertEqual(
+            [
+                mock.call("aa", CLOSED, OPEN),
+                mock.call("aa", OPEN, HALF_OPEN),
+                mock.call("aa", HALF_OPEN, OPEN),
+                mock.call("aa", OPEN, HALF_OPEN),
+                mock.call("aa", HALF_OPEN, CLOSED),
+            ],
+            listener.call_args_list,
+        )
+
+    def test_success_resets_failures(self):
+        """Only consecutive failures open the circuit."""
+        breaker = CircuitBreaker(2)
+        for success in [False, True, False, True]:
+            breaker.record("aa", success)
+        self.assertEqual(CLOSED, breaker.state("aa"))
+        self.assertEqual({}, breaker.states())
+
+    def test_reset(self):
+        """Reset closes the circuits."""
+        breaker = CircuitBreaker(1)
+        breaker.record("aa", False)
+        breaker.record("bb", False)
+        self.assertEqual({"AA": OPEN, "BB": OPEN}, breaker.states())
+        breaker.reset("aa")
+        self.assertEqual({"BB": OPEN}, breaker.states())
+        breaker.reset()
+        self.assertEqual({}, breaker.states())
+
+    def test_invalid_threshold(self):
+        """At least one failure is required to open the circuit."""
+        with self.assertRaises(ValueError):
+            CircuitBreaker(0)
+
+
+class TestInterfaceBreaker(unittest.TestCase):
+    """Tests for the circuit breaker in BluetoothInterface."""
+
+    def test_connect_short_circuited(self):
+        """Devices with an open circuit fail right away."""
+        metrics = InMemoryMetrics()
+        breaker = CircuitBreaker(2)
+        interface = BluetoothInterface(MockBackend, breaker=breaker, metrics=metrics)
+        with mock.patch.object(
+            MockBackend, "connect", side_effect=BluetoothBackendException()
+        ) as connect_mock:
+            for _ in range(2):
+                with self.assertRaises(BluetoothBackendException):
+                    with interface.connect("aa:bb"):
+                        pass
+            with self.assertRaises(CircuitOpenError) as context:
+                with interface.connect("aa:bb"):
+                    pass
+        self.assertEqual(2, connect_mock.call_count)
+        self.assertEqual("aa:bb", context.exception.mac)
+        self.assertFalse(interface.is_connected())
+        self.assertEqual(1, metrics.counter("rejected_total"))
+        # other devices are not affected
+        with interface.connect("cc:dd"):
+            pass
+
+    def test_operation_failures(self):
+        """Failed operations count as failures, successful ones close the circuit."""
+        breaker = CircuitBreaker(2)
+        interface = BluetoothInterface(MockBackend, breaker=breaker)
+        with self.assertRaises(BluetoothBackendException):
+            with interface.connect("aa:bb"):
+                raise BluetoothBackendException()
+        self.assertEqual(CLOSED, breaker.state("aa:bb"))
+        with interface.connect("aa:bb"):
+            pass
+        with self.assertRaises(BluetoothBackendException):
+            with interface.connect("aa:bb"):
+                raise BluetoothBackendException()
+        self.assertEqual(CLOSED, breaker.state("aa:bb"))
+
+    def test_probe_waiting_for_adapter(self):
+        """A probe that does not get the adapter does not block the circuit."""
+        breaker = CircuitBreaker(1, 0)
+        interface = BluetoothInterface(MockBackend, breaker=breaker)
+        other = BluetoothInterface(MockBackend)
+        breaker.record("aa:bb", False)
+        with other.connect("cc:dd"):
+            with self.assertRaises(BluetoothTimeoutError):
+                with interface.connect("aa:bb", timeout=0.1):
+                    pass
+        self.assertEqual(OPEN, breaker.state("aa:bb"))
+        with interface.connect("aa:bb"):
+            self.assertEqual(HALF_OPEN, breaker.state("aa:bb"))
+        self.assertEqual(CLOSED, breaker.state("aa:bb"))
+
+    def test_probe_without_retries(self):
+        """Backends make a single attempt while the device is probed."""
+        breaker = CircuitBreaker(1, 0)
+        policy = RetryPolicy(max_attempts=5)
+        backend = GatttoolBackend(retry_policy=policy)
+        backend.breaker = breaker
+        # pylint: disable=protected-access
+        self.assertIs(policy, backend._effective_retry_policy(policy, "aa"))
+        breaker.record("aa", False)
+        self.assertIsNone(breaker.check("aa"))
+        self.assertEqual(1, backend._effective_retry_policy(policy, "aa").max_attempts)
+        self.assertIs(policy, backend._effective_retry_policy(policy, "bb"))
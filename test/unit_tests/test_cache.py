@@ -0,0 +1,134 @@
+"""Tests for the ReadCache class."""
+import unittest
+from unittest import mock
+from test.helper import MockBackend
+from btlewrap.base import BluetoothInterface
+from btlewrap.cache import FOREVER, CachingBackend, ReadCache
+
+
+class TestReadCache(unittest.TestCase):
+    """Tests for the ReadCache class."""
+
+    def test_only_configured_handles(self):
+        """Handles without ttl are not cached."""
+        cache = ReadCache(ttls={0x03: 10})
+        cache.put("aa", 0x03, b"\x01")
+        cache.put("aa", 0x04, b"\x02")
+        self.assertEqual(b"\x01", cache.get("AA", 0x03))
+        self.assertIsNone(cache.get("aa", 0x04))
+        self.assertEqual({"hits": 1, "misses": 1, "size": 1}, cache.stats())
+
+    @mock.patch("time.monotonic")
+    def test_ttl(self, monotonic_mock):
+        """Values expire after their ttl."""
+        monotonic_mock.return_value = 100
+        cache = ReadCache(default_ttl=10, ttls={0x03: FOREVER})
+        cache.put("aa", 0x03, b"\x01")
+        cache.put("aa", 0x04, b"\x02")
+        monotonic_mock.return_value = 105
+        self.assertEqual(b"\x02", cache.get("aa", 0x04))
+        monotonic_mock.return_value = 111
+        self.assertIsNone(cache.get("aa", 0x04))
+        self.assertEqual(b"\x01", cache.get("aa", 0x03))
+        self.assertEqual(1, len(cache))
+
+    def test_lru_eviction(self):
+        """The least recently used value is evicted first."""
+        cache = ReadCache(2, default_ttl=FOREVER)
+        cache.put("aa", 1, b"\x01")
+        cache.put("aa", 2, b"\x02")
+        cache.get("aa", 1)
+        cache.put("aa", 3, b"\x03")
+        self.assertIsNone(cache.get("aa", 2))
+        self.assertEqual(b"\x01", cache.get("aa", 1))
+        self.assertEqual(b"\x03", cache.get("aa", 3))
+
+    def test_invalidate(self):
+        """Values can be removed by mac and handle."""
+        cache = ReadCache(default_ttl=FOREVER)
+        for mac in ["aa", "bb"]:
+            for handle in [1, 2]:
+                cache.put(mac, handle, b"\x00")
+        cache.invalidate("aa", 1)
+        self.assertEqual(3, len(cache))
+        cache.invalidate(handle=2)
+        self.assertEqual(1, len(cache))
+        cache.invalidate()
+        self.assertEqual(0, len(cache))
+
+
+class TestCachingBackend(unittest.TestCase):
+    """Tests for the cache in BluetoothInterface."""
+
+    def test_interface_uses_cache(self):
+        """Cached handles are only read once."""
+        interface = BluetoothInterface(
+            MockBackend, read_cache=ReadCache(ttls={0x38: FOREVER})
+        )
+        backend = interface._backend  # pylint: disable=protected-access
+        backend.override_read_handles = {0x38: b"\x01", 0x35: b"\x02"}
+        with mock.patch.object(
+            backend, "read_handle", wraps=backend.read_handle
+        ) as read_mock:
+            for _ in range(3):
+                with interface.connect("aa") as connection:
+                    self.assertEqual(b"\x01", connection.read_handle(0x38))
+                    self.assertEqual(b"\x02", connection.read_handle(0x35))
+            self.assertEqual(4, read_mock.call_count)
+        self.assertEqual(2, interface.read_cache.hits)
+
+    def test_read_handles(self):
+        """Only missing handles are read in a batch."""
+        cache = ReadCache(ttls={1: FOREVER, 2: FOREVER})
+        cache.put("aa", 1, b"\x0a")
+        interface = BluetoothInterface(MockBackend, read_cache=cache)
+        # pylint: disable=protected-access
+        interface._backend.override_read_handles = {1: b"\x01", 2: b"\x02", 3: b"\x03"}
+        with interface.connect("aa") as backend:
+            self.assertEqual(
+                {1: b"\x0a", 2: b"\x02", 3: b"\x03"}, backend.read_handles([1, 2, 3])
+            )
+        self.assertEqual(b"\x02", cache.get("aa", 2))
+        self.assertIsNone(cache.get("aa", 3))
+
+    def test_read_multiple(self):
+        """Only missing handles are read with read_multiple, with their sizes."""
+        cache = ReadCache(ttls={1: FOREVER, 2: FOREVER})
+        cache.put("aa", 1, b"\x0a")
+        backend = mock.Mock()
+        backend.read_multiple.return_value = {2: b"\x02\x02", 3: b"\x03"}
+        caching = CachingBackend(backend, "aa", cache)
+        self.assertEqual(
+            {1: b"\x0a", 2: b"\x02\x02", 3: b"\x03"},
+            caching.read_multiple([1, 2, 3], [1, 2, 1]),
+        )
+        backend.read_multiple.assert_called_once_with([2, 3], [2, 1])
+        self.assertEqual(b"\x02\x02", cache.get("aa", 2))
+
+    def test_read_long(self):
+        """Long reads do not share cache entries with plain reads."""
+        cache = ReadCache(default_ttl=FOREVER)
+        backend = mock.Mock()
+        backend.read_handle.return_value = b"\x01" * 22
+        backend.read_long.side_effect = lambda handle, max_length=512: (
+            b"\x01" * min(100, max_length)
+        )
+        caching = CachingBackend(backend, "aa", cache)
+        self.assertEqual(22, len(caching.read_handle(0x10)))
+        self.assertEqual(100, len(caching.read_long(0x10)))
+        self.assertEqual(50, len(caching.read_long(0x10, max_length=50)))
+        self.assertEqual(22, len(caching.read_handle(0x10)))
+        self.assertEqual(100, len(caching.read_long(0x10)))
+        self.assertEqual(1, backend.read_handle.call_count)
+        self.assertEqual(2, backend.read_long.call_count)
+        caching.write_handle(0x10, b"\x02")
+        self.assertEqual(0, len(cache))
+
+    def test_write_invalidates(self):
+        """Writing a handle removes its cached value."""
+        cache = ReadCache(default_ttl=FOREVER)
+        cache.put("aa", 1, b"\x0a")
+        interface = BluetoothInterface(MockBackend, read_cache=cache)
+        with interface.connect("aa") as backend:
+            backend.write_handle(1, b"\x01")
+        self.assertEqual(0, len(cache))
@@ -0,0 +1,146 @@
+"""Tests for the DiscoveryCache and the ResolvingBackend."""
+import json
+import os
+import tempfile
+import unittest
+from test import TEST_MAC
+from test.helper import MockBackend
+from btlewrap.base import BluetoothBackendException, BluetoothInterface
+from btlewrap.discovery import DiscoveryCache, PartialDiscovery
+
+DATA_UUID = "00001a01-0000-1000-8000-00805f9b34fb"
+
+
+class DiscoveringBackend(MockBackend):
+    """MockBackend whose characteristics can be discovered."""
+
+    def __init__(self, adapter="hci0", address_type=None):
+        super().__init__(adapter, address_type)
+        self.characteristics = {"2a00": 0x03, DATA_UUID: 0x35}
+        self.discoveries = 0
+        self.partial = False
+        self.override_read_handles = {0x03: b"flower", 0x35: b"\x01\x02"}
+
+    def read_handle(self, handle):
+        """Fail like a device for handles that do not exist."""
+        if handle not in self.override_read_handles:
+            raise BluetoothBackendException("Invalid handle {}".format(handle))
+        return self.override_read_handles[handle]
+
+    def discover_characteristics(self):
+        """Count the discoveries."""
+        self.discoveries += 1
+        if self.partial:
+            return PartialDiscovery(self.characteristics)
+        return dict(self.characteristics)
+
+
+class TestDiscoveryCache(unittest.TestCase):
+    """Tests for the DiscoveryCache class."""
+
+    def test_save_load(self):
+        """The mappings are stored in a compact file."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "discovery.json")
+            cache = DiscoveryCache(path)
+            key = DiscoveryCache.key("aa:bb:cc:dd:ee:ff", firmware="3.2.1")
+            cache.put(key, {0x2A00: 0x03, DATA_UUID: 0x35})
+            cache.put(DiscoveryCache.key(TEST_MAC, "miflora"), {"2a00": 0x03})
+            with open(path, encoding="utf-8") as cache_file:
+                data = json.load(cache_file)
+            self.assertEqual(
+                ["AA:BB:CC:DD:EE:FF", "3.2.1", {"2a00": 3, "1a01": 53}],
+                data["devices"][0],
+            )
+            loaded = DiscoveryCache(path)
+            self.assertEqual(2, len(loaded))
+            self.assertEqual(0x35, loaded.get(key)[DATA_UUID])
+            loaded.invalidate(key)
+            self.assertEqual(1, len(DiscoveryCache(path)))
+
+    def test_broken_file(self):
+        """A file that cannot be read is ignored."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "discovery.json")
+            with open(path, "w", encoding="utf-8") as cache_file:
+                cache_file.write('{"version": 1, "devices": [["aa"]]}')
+            self.assertEqual(0, len(DiscoveryCache(path)))
+
+
+class TestResolvingBackend(unittest.TestCase):
+    """Tests for read_uuid and write_uuid through a BluetoothInterface."""
+
+    def test_discover_once(self):
+        """Each device is discovered once, also by a new process."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "discovery.json")
+            interface = BluetoothInterface(
+                DiscoveringBackend, discovery_cache=DiscoveryCache(path)
+            )
+            backend = interface._backend  # pylint: disable=protected-access
+            for _ in range(3):
+                with interface.connect(TEST_MAC) as connection:
+                    self.assertEqual(b"\x01\x02", connection.read_uuid(DATA_UUID))
+                    self.assertTrue(connection.write_uuid(0x2A00, b"\x05") is not None)
+            self.assertEqual(1, backend.discoveries)
+            self.assertEqual([(0x03, b"\x05")] * 3, backend.written_handles)
+            # a new cache reads the file, there is no discovery
+            interface = BluetoothInterface(
+                DiscoveringBackend, discovery_cache=DiscoveryCache(path)
+            )
+            with interface.connect(TEST_MAC) as connection:
+                self.assertEqual(b"flower", connection.read_uuid("2a00"))
+            self.assertEqual(0, interface._backend.discoveries)
+
+    def test_model_firmware(self):
+        """Devices of the same model and firmware share their mapping."""
+        cache = DiscoveryCache()
+        interface = BluetoothInterface(DiscoveringBackend, discovery_cache=cache)
+        backend = interface._backend  # pylint: disable=protected-access
+        for mac in ("aa", "bb"):
+            with interface.connect(
+                mac, model="miflora", firmware="3.2.1"
+            ) as connection:
+                connection.read_uuid(DATA_UUID)
+        with interface.connect("aa", model="miflora", firmware="3.3.0") as connection:
+            connection.read_uuid(DATA_UUID)
+        self.assertEqual(2, backend.discoveries)
+
+    def test_invalidate_on_failure(self):
+        """A failed operation forgets the mapping, unknown uuids are discovered again."""
+        cache = DiscoveryCache()
+        interface = BluetoothInterface(DiscoveringBackend, discovery_cache=cache)
+        backend = interface._backend  # pylint: disable=protected-access
+        with interface.connect(TEST_MAC) as connection:
+            connection.read_uuid(DATA_UUID)
+        # a new firmware moved the characteristic
+        backend.characteristics[DATA_UUID] = 0x38
+        backend.override_read_handles = {0x38: b"\x03"}
+        with self.assertRaises(BluetoothBackendException):
+            with interface.connect(TEST_MAC) as connection:
+                connection.read_uuid(DATA_UUID)
+        self.assertIsNone(cache.get(cache.key(TEST_MAC)))
+        with interface.connect(TEST_MAC) as connection:
+            self.assertEqual(b"\x03", connection.read_uuid(DATA_UUID))
+        self.assertEqual(2, backend.discoveries)
+        # a missing uuid is discovered again, once per connection
+        with interface.connect(TEST_MAC) as connection:
+            for _ in range(2):
+                with self.assertRaises(BluetoothBackendException):
+                    connection.read_uuid(0x2A19)
+        self.assertEqual(3, backend.discoveries)
+
+    def test_partial_discovery(self):
+        """A partial discovery is used for the connection, but not stored."""
+        cache = DiscoveryCache()
+        interface = BluetoothInterface(DiscoveringBackend, discovery_cache=cache)
+        backend = interface._backend  # pylint: disable=protected-access
+        backend.partial = True
+        with interface.connect(TEST_MAC) as connection:
+            self.assertEqual(b"flower", connection.read_uuid(0x2A00))
+            self.assertEqual(b"\x01\x02", connection.read_uuid(DATA_UUID))
+        self.assertEqual(1, backend.discoveries)
+        self.assertIsNone(cache.get(cache.key(TEST_MAC)))
+        with interface.connect(TEST_MAC) as connection:
+            connection.read_uuid(DATA_UUID)
+        self.assertEqual(2, backend.discoveries)
@@ -1,10 +1,15 @@
 """Test gatttool backend."""
 
+import io
+import os
+import signal
+import threading
+import time
 import unittest
 from unittest import mock
 from test import TEST_MAC
 from subprocess import TimeoutExpired
-from btlewrap import GatttoolBackend, BluetoothBackendException
+from btlewrap import GatttoolBackend, BluetoothBackendException, RetryPolicy
 
 
 class TestGatttool(unittest.TestCase):
@@ -62,6 +67,24 @@ class TestGatttool(unittest.TestCase):
         with self.assertRaises(BluetoothBackendException):
             backend.read_handle(0xFF)
 
+    @mock.patch("btlewrap.gatttool.Popen")
+    @mock.patch("time.sleep", return_value=None)
+    def test_read_handle_retry_policy(self, sleep_mock, popen_mock):
+        """A retry policy replaces the default retries."""
+        _configure_popenmock(popen_mock, "")
+        backend = GatttoolBackend(retry_policy=RetryPolicy(2, 1))
+        backend.connect(TEST_MAC)
+        with self.assertRaises(BluetoothBackendException):
+            backend.read_handle(0xFF)
+        self.assertEqual(2, popen_mock.call_count)
+        sleep_mock.assert_called_once_with(1)
+
+    def test_default_retry_policy(self):
+        """The default policy uses the retries parameter."""
+        policy = GatttoolBackend(retries=5).retry_policy
+        self.assertEqual(6, policy.max_attempts)
+        self.assertEqual([10, 20, 40], [policy.delay(n) for n in range(1, 4)])
+
     def test_read_not_connected(self):
         """Test reading data when not connected."""
         backend = GatttoolBackend()
@@ -204,17 +227,89 @@ class TestGatttool(unittest.TestCase):
         backend = GatttoolBackend()
         backend.connect(TEST_MAC)
         self.handle_notification_called = False
-        self.assertTrue(backend.wait_for_notification(0xFF, self, 10))
+        self.assertTrue(backend.wait_for_notification(0xFF, self, 0.1))
         self.assertTrue(self.handle_notification_called)
+        os_mock.assert_called_once()
+
+    @mock.patch("os.killpg")
+    @mock.patch("btlewrap.gatttool.Popen")
+    def test_notification_max_count(self, popen_mock, os_mock):
+        """Listening stops as soon as enough notifications arrived."""
+        _configure_popenmock_timeout(
+            popen_mock,
+            (
+                "Characteristic value was written successfully\n"
+                "Notification handle = 0x000e value: 54 3d 32 37 2e 33 20 48 3d 32 37 2e 30 00\n"
+                "Notification handle = 0x000e value: 54 3d 32 37 2e 32 20 48 3d 32 37 2e 32 00\n"
+            ),
+        )
+        backend = GatttoolBackend()
+        backend.connect(TEST_MAC)
+        received = []
+        delegate = mock.Mock()
+        delegate.handleNotification.side_effect = lambda h, v: received.append(v)
+        start = time.monotonic()
+        self.assertTrue(backend.wait_for_notification(0xFF, delegate, 60, max_count=1))
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(1, len(received))
+        os_mock.assert_called_once()
 
-    @mock.patch("btlewrap.gatttool.run", return_value=None)
-    def test_check_backend_ok(self, call_mock):
+    @mock.patch("os.killpg")
+    @mock.patch("btlewrap.gatttool.Popen")
+    def test_notification_predicate(self, popen_mock, os_mock):
+        """Listening stops as soon as the predicate is satisfied."""
+        _configure_popenmock_timeout(
+            popen_mock,
+            (
+                "Characteristic value was written successfully\n"
+                "Notification handle = 0x000e value: 01\n"
+                "Notification handle = 0x000e value: 02\n"
+                "Notification handle = 0x000e value: 03\n"
+            ),
+        )
+        backend = GatttoolBackend()
+        backend.connect(TEST_MAC)
+        received = []
+        delegate = mock.Mock()
+        delegate.handleNotification.side_effect = lambda h, v: received.append(v)
+        self.assertTrue(
+            backend.wait_for_notification(
+                0xFF, delegate, 60, predicate=lambda handle, value: value == b"\x02"
+            )
+        )
+        self.assertEqual([b"\x01", b"\x02"], received)
+
+    @mock.patch("os.killpg")
+    @mock.patch("btlewrap.gatttool.Popen")
+    def test_iter_notifications(self, popen_mock, os_mock):
+        """Notifications are yielded until the idle timeout."""
+        _configure_popenmock_timeout(
+            popen_mock,
+            (
+                "Characteristic value was written successfully\n"
+                "Notification handle = 0x000e value: 01\n"
+                "Notification handle = 0x000e value: 02\n"
+            ),
+        )
+        backend = GatttoolBackend()
+        backend.connect(TEST_MAC)
+        self.assertEqual(
+            [(0x0E, b"\x01"), (0x0E, b"\x02")],
+            list(backend.iter_notifications(0x0E, 60, idle_timeout=0.1)),
+        )
+        os_mock.assert_called_once()
+
+    @mock.patch("btlewrap.gatttool.Popen")
+    @mock.patch("shutil.which", return_value="/usr/bin/gatttool")
+    def test_check_backend_ok(self, which_mock, popen_mock):
         """Test check_backend successfully."""
         self.assertTrue(GatttoolBackend().check_backend())
+        which_mock.assert_called_once_with("gatttool")
+        popen_mock.assert_not_called()
 
-    @mock.patch("btlewrap.gatttool.run", **{"side_effect": IOError()})
-    def test_check_backend_fail(self, call_mock):
-        """Test check_backend with IOError being risen."""
+    @mock.patch("shutil.which", return_value=None)
+    def test_check_backend_fail(self, which_mock):
+        """Test check_backend with gatttool missing."""
         self.assertFalse(GatttoolBackend().check_backend())
 
     def test_notification_payload_ok(self):
@@ -236,6 +331,328 @@ class TestGatttool(unittest.TestCase):
         backend = GatttoolBackend()
         self.assertTrue(backend.supports_scanning())
 
+    @mock.patch("btlewrap.gatttool.os")
+    @mock.patch("btlewrap.gatttool.Popen")
+    def test_listen_advertisements(self, popen_mock, os_mock):
+        """Advertising reports are parsed from the output of hcidump."""
+        hcidump = mock.Mock(pid=12)
+        hcidump.stdout = io.BytesIO(HCIDUMP_OUTPUT)
+        hcidump.poll.return_value = None
+        hcitool = mock.Mock(pid=13)
+        hcitool.poll.return_value = None
+        popen_mock.side_effect = [hcidump, hcitool]
+
+        listener = GatttoolBackend.listen_advertisements(
+            5, "hci1", service_uuids=[0xFE95]
+        )
+        records = [next(listener), next(listener)]
+        listener.close()
+
+        self.assertEqual(
+            ["hcitool", "-i", "hci1", "lescan", "--passive", "--duplicates"],
+            popen_mock.call_args_list[1][0][0],
+        )
+        self.assertEqual("C4:7C:8D:6A:3E:7A", records[0].mac)
+        self.assertEqual(-59, records[0].rssi)
+        self.assertEqual((0x01, b"\x06"), records[0][2:])
+        self.assertEqual((0x16, bytes.fromhex("95FE01020304")), records[1][2:])
+        self.assertEqual(bytes([1, 2, 3, 4]), records[1].service_data())
+        os_mock.killpg.assert_any_call(12, mock.ANY)
+        os_mock.killpg.assert_any_call(13, mock.ANY)
+
+    @mock.patch("btlewrap.gatttool.os")
+    @mock.patch("btlewrap.gatttool.Popen")
+    def test_listen_advertisements_hcidump_fails(self, popen_mock, os_mock):
+        """An exception is raised if hcidump stops."""
+        hcidump = mock.Mock(pid=12)
+        hcidump.stdout = io.BytesIO(b"")
+        popen_mock.return_value = hcidump
+        with self.assertRaises(BluetoothBackendException):
+            list(GatttoolBackend.listen_advertisements(5, macs=["C4:7C:8D:6A:3E:7A"]))
+
+    @mock.patch("btlewrap.gatttool.os")
+    @mock.patch("btlewrap.gatttool.Popen")
+    def test_iter_scan(self, popen_mock, os_mock):
+        """Devices are yielded once, names are updated."""
+        popen_mock.return_value = _scan_process(
+            "LE Scan ...",
+            "78:24:AC:37:21:3D (unknown)",
+            "78:24:AC:37:21:3D (unknown)",
+            "63:82:9D:D1:B3:A2 (MyDevice)",
+            "78:24:AC:37:21:3D (SomeDevice)",
+            "63:82:9D:D1:B3:A2 (unknown)",
+        )
+        self.assertEqual(
+            [
+                ("78:24:AC:37:21:3D", "unknown"),
+                ("63:82:9D:D1:B3:A2", "MyDevice"),
+                ("78:24:AC:37:21:3D", "SomeDevice"),
+            ],
+            list(GatttoolBackend.iter_scan(5, "hci1")),
+        )
+        popen_mock.assert_called_once_with(
+            ["hcitool", "-i", "hci1", "lescan"],
+            stdout=mock.ANY,
+            stderr=None,
+            preexec_fn=mock.ANY,
+        )
+
+    @mock.patch("btlewrap.gatttool.os")
+    @mock.patch("btlewrap.gatttool.Popen")
+    def test_scan_stops_at_targets(self, popen_mock, os_mock):
+        """The scan stops as soon as all targets were found."""
+        process = _scan_process(
+            "LE Scan ...",
+            "78:24:AC:37:21:3D (unknown)",
+            "63:82:9D:D1:B3:A2 (MyDevice)",
+        )
+        process.stdout = HangingStdout(process.stdout.getvalue().decode())
+        process.poll.return_value = None
+        popen_mock.return_value = process
+        start = time.monotonic()
+        self.assertEqual(
+            [("78:24:AC:37:21:3D", "unknown"), ("63:82:9D:D1:B3:A2", "MyDevice")],
+            GatttoolBackend.scan_for_devices(5, targets=["63:82:9d:d1:b3:a2"]),
+        )
+        self.assertLess(time.monotonic() - start, 4)
+        os_mock.killpg.assert_called_once_with(process.pid, mock.ANY)
+
+    @mock.patch("btlewrap.gatttool.os")
+    @mock.patch("btlewrap.gatttool.Popen")
+    def test_scan_max_devices(self, popen_mock, os_mock):
+        """The scan stops after max_devices devices."""
+        popen_mock.return_value = _scan_process(
+            "78:24:AC:37:21:3D (unknown)",
+            "63:82:9D:D1:B3:A2 (MyDevice)",
+            "65:B8:8C:38:D5:77 (OtherDevice)",
+        )
+        self.assertEqual(2, len(list(GatttoolBackend.iter_scan(5, max_devices=2))))
+
+    @mock.patch("btlewrap.gatttool.os")
+    @mock.patch("btlewrap.gatttool.Popen")
+    def test_scan_kills_hanging_hcitool(self, popen_mock, os_mock):
+        """hcitool is killed if it does not stop on SIGINT."""
+        process = _scan_process("78:24:AC:37:21:3D (unknown)")
+        process.poll.return_value = None
+        process.wait.side_effect = [TimeoutExpired("hcitool", 5), 0]
+        popen_mock.return_value = process
+        self.assertEqual(1, len(list(GatttoolBackend.iter_scan(5, max_devices=1))))
+        self.assertEqual(
+            [mock.call(14, signal.SIGINT), mock.call(14, signal.SIGKILL)],
+            os_mock.killpg.call_args_list,
+        )
+        self.assertEqual(mock.call(timeout=mock.ANY), process.wait.call_args_list[0])
+
+
+def _scan_process(*lines):
+    """Mock of hcitool printing @lines."""
+    process = mock.Mock(pid=14)
+    process.stdout = io.BytesIO("\n".join(lines).encode() + b"\n")
+    process.poll.return_value = 0
+    return process
+
+
+# "hcidump --raw" with a command, its response and an advertisement
+HCIDUMP_OUTPUT = b"""HCI sniffer - Bluetooth packet analyzer ver 5.50
+device: hci1 snap_len: 1500 filter: 0xffffffff
+< 01 0B 20 07 00 10 00 10 00 00 00
+> 04 0E 04 01 0B 20 00
+> 04 3E 17 02 01 00 00 7A 3E 6A 8D 7C C4 0B 02 01 06 07 16 95 FE
+  01 02 03 04 C5
+"""
+
+
+class TestGatttoolInteractive(unittest.TestCase):
+    """Test the interactive session mode by mocking "gatttool -I"."""
+
+    # pylint: disable = unused-argument
+
+    def setUp(self):
+        self.notifications = []
+
+    @mock.patch("btlewrap.gatttool_io.Popen")
+    def test_one_process_per_connection(self, popen_mock):
+        """All operations share one gatttool process."""
+        process = FakeInteractiveGatttool(
+            {
+                "char-read-hnd 0x38": "Characteristic value/descriptor: 00 11 AA FF",
+                "char-read-hnd 0x35": "Characteristic value/descriptor: 01 02",
+                "char-write-req 0x33 A01F": "Characteristic value was written successfully",
+            }
+        )
+        popen_mock.return_value = process
+        backend = GatttoolBackend(interactive=True)
+        backend.connect(TEST_MAC)
+        self.assertEqual(bytes([0x00, 0x11, 0xAA, 0xFF]), backend.read_handle(0x38))
+        self.assertTrue(backend.write_handle(0x33, bytes([0xA0, 0x1F])))
+        self.assertEqual(bytes([0x01, 0x02]), backend.read_handle(0x35))
+        backend.disconnect()
+        self.assertEqual(1, popen_mock.call_count)
+        self.assertIn("--interactive", popen_mock.call_args[0][0])
+        self.assertEqual(
+            [
+                "connect",
+                "char-read-hnd 0x38",
+                "char-write-req 0x33 A01F",
+                "char-read-hnd 0x35",
+                "disconnect",
+                "exit",
+            ],
+            process.commands,
+        )
+
+    @mock.patch("btlewrap.gatttool_io.Popen")
+    def test_write_stream(self, popen_mock):
+        """Streams are write commands in one session with acknowledged checkpoints."""
+        process = FakeInteractiveGatttool(
+            {
+                "char-write-req 0x33 02": "Characteristic value was written successfully",
+                "char-write-req 0x33 03": "Characteristic value was written successfully",
+            }
+        )
+        popen_mock.return_value = process
+        backend = GatttoolBackend()
+        backend.connect(TEST_MAC)
+        chunks = [b"\x01", b"\x02", b"\x03"]
+        self.assertEqual(3, backend.write_stream(0x33, chunks, checkpoint_interval=2))
+        self.assertEqual(1, popen_mock.call_count)
+        self.assertEqual(
+            [
+                "connect",
+                "char-write-cmd 0x33 01",
+                "char-write-req 0x33 02",
+                "char-write-req 0x33 03",
+                "disconnect",
+                "exit",
+            ],
+            process.commands,
+        )
+
+    @mock.patch("btlewrap.gatttool_io.Popen")
+    def test_read_handles_batch(self, popen_mock):
+        """Batches use one session, even outside of interactive mode."""
+        process = FakeInteractiveGatttool(
+            {
+                "char-read-hnd 0x38": "Characteristic value/descriptor: 00 11",
+                "char-read-hnd 0x35": "Characteristic value/descriptor: 01 02",
+                "char-write-req 0x33 A01F": "Characteristic value was written successfully",
+            }
+        )
+        popen_mock.return_value = process
+        backend = GatttoolBackend()
+        backend.connect(TEST_MAC)
+        self.assertTrue(backend.write_handles([(0x33, bytes([0xA0, 0x1F]))]))
+        self.assertEqual(1, popen_mock.call_count)
+        popen_mock.return_value = process = FakeInteractiveGatttool(process.answers)
+        self.assertEqual(
+            {0x38: bytes([0x00, 0x11]), 0x35: bytes([0x01, 0x02])},
+            backend.read_handles([0x38, 0x35]),
+        )
+        self.assertEqual(2, popen_mock.call_count)
+        self.assertEqual(
+            [
+                "connect",
+                "char-read-hnd 0x38",
+                "char-read-hnd 0x35",
+                "disconnect",
+                "exit",
+            ],
+            process.commands,
+        )
+        self.assertTrue(backend.is_connected())
+
+    @mock.patch("btlewrap.gatttool_io.Popen")
+    def test_read_error(self, popen_mock):
+        """Errors reported by gatttool are raised."""
+        popen_mock.return_value = FakeInteractiveGatttool(
+            {
+                "char-read-hnd 0xFF": "Error: Characteristic value/descriptor read failed: Invalid handle",
+            }
+        )
+        backend = GatttoolBackend(interactive=True)
+        backend.connect(TEST_MAC)
+        with self.assertRaises(BluetoothBackendException):
+            backend.read_handle(0xFF)
+
+    @mock.patch("btlewrap.gatttool_io.Popen")
+    @mock.patch("time.sleep", return_value=None)
+    def test_connect_failed(self, time_mock, popen_mock):
+        """Connecting is retried and fails after all retries."""
+        popen_mock.side_effect = lambda *args, **kwargs: FakeInteractiveGatttool(
+            {"connect": "Error: connect error: Connection refused (111)"}
+        )
+        backend = GatttoolBackend(interactive=True, retries=2)
+        with self.assertRaises(BluetoothBackendException):
+            backend.connect(TEST_MAC)
+        self.assertEqual(3, popen_mock.call_count)
+        self.assertFalse(backend.is_connected())
+
+    @mock.patch("btlewrap.gatttool_io.Popen")
+    def test_wait_for_notification(self, popen_mock):
+        """Notifications are passed to the delegate."""
+        popen_mock.return_value = FakeInteractiveGatttool(
+            {
+                "char-write-req 0x0E 0100": (
+                    "Characteristic value was written successfully\n"
+                    "Notification handle = 0x000e value: 54 3d 32 37\n"
+                    "Notification handle = 0x000e value: 54 3d 32 38"
+                ),
+                "char-read-hnd 0x38": "Characteristic value/descriptor: 00 11",
+            }
+        )
+        backend = GatttoolBackend(interactive=True)
+        backend.connect(TEST_MAC)
+        self.assertTrue(backend.wait_for_notification(0x0E, self, 0.1))
+        self.assertEqual(
+            [(0x0E, b"T=27"), (0x0E, b"T=28")],
+            self.notifications,
+        )
+        # the session is still usable afterwards
+        self.assertEqual(bytes([0x00, 0x11]), backend.read_handle(0x38))
+
+    def handleNotification(self, handle, raw_data):  # pylint: disable=invalid-name
+        """gets called by the backend when using wait_for_notification"""
+        self.notifications.append((handle, raw_data))
+
+
+class FakeInteractiveGatttool:
+    """Stand-in for a "gatttool -I" process answering from a dict of commands."""
+
+    pid = 0
+
+    def __init__(self, answers):
+        self.answers = {"connect": "Attempting to connect\nConnection successful"}
+        self.answers.update(answers)
+        self.commands = []
+        self.returncode = None
+        read_fd, self._write_fd = os.pipe()
+        self.stdout = os.fdopen(read_fd, "rb")
+        self.stdin = self
+
+    def write(self, data):
+        """Receive a command from the backend and answer it."""
+        command = data.decode("utf-8").strip()
+        self.commands.append(command)
+        if command == "exit":
+            os.close(self._write_fd)
+            self.returncode = 0
+            return
+        answer = self.answers.get(command, "")
+        if answer:
+            prompt = "\x1b[0m[{}][LE]> ".format(TEST_MAC)
+            os.write(self._write_fd, (prompt + answer + "\n").encode("utf-8"))
+
+    def flush(self):
+        """Nothing to flush."""
+
+    def poll(self):
+        """Return the exit code."""
+        return self.returncode
+
+    def wait(self, timeout=None):
+        """Return the exit code."""
+        return self.returncode
+
 
 def _configure_popenmock(popen_mock, output_string):
     """Helper function to create a mock for Popen."""
@@ -244,6 +661,7 @@ def _configure_popenmock(popen_mock, output_string):
         bytes(output_string, encoding="UTF-8"),
         bytes("random text", encoding="UTF-8"),
     ]
+    match_result.stdout = io.BytesIO(bytes(output_string, encoding="UTF-8"))
     popen_mock.return_value.__enter__.return_value = match_result
 
 
@@ -251,6 +669,9 @@ def _configure_popenmock_timeout(popen_mock, output_string):
     """Helper function to create a mock for Popen."""
     match_result = mock.Mock()
     match_result.communicate = POpenHelper(output_string).communicate_timeout
+    match_result.stdout = HangingStdout(output_string)
+    match_result.poll.return_value = None
+    match_result.pid = 0
     popen_mock.return_value.__enter__.return_value = match_result
 
 
@@ -275,3 +696,18 @@ class POpenHelper:
         if timeout:
             raise TimeoutExpired(process, timeout)
         return [bytes(self.partial_response, "utf-8")]
+
+
+class HangingStdout:  # pylint: disable=too-few-public-methods
+    """stdout of a gatttool process that hangs after printing its output."""
+
+    def __init__(self, output_string):
+        self._lines = io.BytesIO(bytes(output_string, "utf-8"))
+        self._hang = threading.Event()
+
+    def readline(self):
+        """Return the next line, block forever at the end of the output."""
+        line = self._lines.readline()
+        if not line:
+            self._hang.wait()
+        return line
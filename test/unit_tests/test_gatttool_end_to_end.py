@@ -0,0 +1,236 @@
+"""Run GatttoolBackend against the fake gatttool and hcitool in test/tools."""
+import os
+import tempfile
+import time
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from threading import Thread
+from unittest import mock
+from test import TEST_MAC
+from test.tools import fake_bluez_env
+from btlewrap import (
+    BluetoothBackendException,
+    BluetoothTimeoutError,
+    GatttoolBackend,
+    RetryPolicy,
+)
+from btlewrap.base import BluetoothInterface
+from btlewrap.discovery import PartialDiscovery
+from btlewrap.metrics import InMemoryMetrics
+from btlewrap.pool import BluetoothInterfacePool
+
+_NO_RETRY = RetryPolicy(max_attempts=1)
+
+
+def _read_in_process(adapter):
+    """Read a handle in a separate process."""
+    backend = GatttoolBackend(adapter, retry_policy=_NO_RETRY)
+    backend.connect(TEST_MAC)
+    return backend.read_handle(0x38)
+
+
+@unittest.skipUnless(os.name == "posix", "the fake tools need a posix shell")
+class TestGatttoolEndToEnd(unittest.TestCase):
+    """Run GatttoolBackend against the fake gatttool and hcitool."""
+
+    def _configure(self, **settings):
+        patcher = mock.patch.dict(os.environ, fake_bluez_env(**settings))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _backend(self, **kwargs):
+        backend = GatttoolBackend(retry_policy=_NO_RETRY, **kwargs)
+        backend.connect(TEST_MAC)
+        return backend
+
+    def test_check_backend(self):
+        """The fake gatttool is found in PATH."""
+        self._configure()
+        self.assertTrue(GatttoolBackend.check_backend())
+
+    def test_read_write(self):
+        """Reading and writing handles."""
+        self._configure(values="0x38=0102ff")
+        backend = self._backend()
+        self.assertEqual(b"\x01\x02\xff", backend.read_handle(0x38))
+        self.assertTrue(backend.write_handle(0x33, b"\xa0\x1f"))
+
+    def test_write_command(self):
+        """Write commands succeed unless gatttool cannot connect."""
+        with tempfile.TemporaryDirectory() as directory:
+            log = os.path.join(directory, "calls.log")
+            self._configure(log=log)
+            self.assertTrue(self._backend().write_handle(0x33, b"\xa0", response=False))
+            with open(log, encoding="utf-8") as log_file:
+                self.assertIn("--char-write -a 0x33 -n A0", log_file.read())
+        self._configure(fail="connect")
+        with self.assertRaises(BluetoothBackendException):
+            self._backend().write_handle(0x33, b"\xa0", response=False)
+
+    def test_read_error(self):
+        """Errors of gatttool are raised."""
+        self._configure(fail="read")
+        with self.assertRaises(BluetoothBackendException):
+            self._backend().read_handle(0x38)
+
+    def test_retries(self):
+        """Failed connections are retried."""
+        with tempfile.TemporaryDirectory() as directory:
+            log = os.path.join(directory, "calls.log")
+            self._configure(fail="connect", log=log)
+            backend = GatttoolBackend(
+                retry_policy=RetryPolicy(max_attempts=3, base_delay=0)
+            )
+            backend.connect(TEST_MAC)
+            with self.assertRaises(BluetoothBackendException):
+                backend.read_handle(0x38)
+            with open(log, encoding="utf-8") as log_file:
+                self.assertEqual(3, len(log_file.readlines()))
+
+    def test_metrics(self):
+        """Retries and killed gatttool calls are counted."""
+        self._configure(hang="read")
+        metrics = InMemoryMetrics()
+        backend = GatttoolBackend(
+            timeout=0.2, retry_policy=RetryPolicy(max_attempts=2, base_delay=0)
+        )
+        backend.metrics = metrics
+        backend.connect(TEST_MAC)
+        with self.assertRaises(BluetoothBackendException):
+            backend.read_handle(0x38)
+        self.assertEqual(1, metrics.counter("retries_total", operation="read"))
+        self.assertEqual(2, metrics.counter("timeouts_total", mac=TEST_MAC.upper()))
+
+    def test_hanging_gatttool_is_stopped(self):
+        """A hanging gatttool is stopped after the timeout."""
+        self._configure(hang="read")
+        backend = self._backend(timeout=0.5)
+        start = time.monotonic()
+        with self.assertRaises(BluetoothBackendException):
+            backend.read_handle(0x38)
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_deadline(self):
+        """The deadline of the connection stops retries and kills gatttool."""
+        self._configure(hang="read")
+        interface = BluetoothInterface(
+            GatttoolBackend,
+            adapter="hci7",
+            retry_policy=RetryPolicy(max_attempts=5, base_delay=0.1),
+        )
+        start = time.monotonic()
+        with self.assertRaises(BluetoothTimeoutError):
+            with interface.connect(TEST_MAC, timeout=0.5) as backend:
+                backend.read_handle(0x38)
+        self.assertLess(time.monotonic() - start, 3)
+
+    def test_deadline_interactive(self):
+        """The deadline also applies to interactive sessions."""
+        self._configure(hang="read")
+        backend = self._backend(interactive=True)
+        with backend.time_limit(0.5):
+            with self.assertRaises(BluetoothTimeoutError):
+                backend.read_handle(0x38)
+        backend.disconnect()
+
+    def test_notifications(self):
+        """Notifications are streamed until the limit is reached."""
+        self._configure(notifications=5)
+        backend = self._backend()
+        values = [
+            value for _, value in backend.iter_notifications(0x0E, 5, max_count=5)
+        ]
+        self.assertEqual(5, len(values))
+        self.assertEqual(b"T=27.3 H=27.0\x00", values[0])
+
+    def test_notifications_slow_connect(self):
+        """The idle timeout starts when the notifications were enabled."""
+        self._configure(notifications=2, latency=0.5)
+        backend = self._backend()
+        values = list(backend.iter_notifications(0x0E, 5, idle_timeout=0.3))
+        self.assertEqual(2, len(values))
+
+    def test_interactive(self):
+        """One interactive gatttool for all operations of a connection."""
+        self._configure(notifications=2)
+        backend = self._backend(interactive=True, timeout=5)
+        try:
+            self.assertEqual(b"\x00\x11\xaa\xff", backend.read_handle(0x38))
+            self.assertTrue(backend.write_handle(0x33, b"\xa0\x1f"))
+            values = list(backend.iter_notifications(0x0E, 5, max_count=2))
+            self.assertEqual(2, len(values))
+        finally:
+            backend.disconnect()
+
+    def test_discover_characteristics(self):
+        """The characteristics are complete when gatttool exits."""
+        self._configure()
+        backend = self._backend(timeout=5)
+        handles = backend.discover_characteristics()
+        self.assertNotIsInstance(handles, PartialDiscovery)
+        self.assertEqual(0x03, handles["00002a00-0000-1000-8000-00805f9b34fb"])
+        self.assertEqual(0x35, handles["00001a01-0000-1000-8000-00805f9b34fb"])
+        self.assertEqual(4, len(handles))
+        self._configure(fail="discover")
+        with self.assertRaises(BluetoothBackendException):
+            backend.discover_characteristics()
+
+    def test_discover_characteristics_interactive(self):
+        """gatttool -I does not mark the end of the characteristics."""
+        self._configure()
+        backend = self._backend(timeout=5, interactive=True, discovery_idle=0.5)
+        try:
+            handles = backend.discover_characteristics()
+        finally:
+            backend.disconnect()
+        self.assertIsInstance(handles, PartialDiscovery)
+        self.assertEqual(4, len(handles))
+
+    def test_scan(self):
+        """Scanning stops as soon as the target was found."""
+        self._configure(devices="AA:BB:CC:DD:EE:01,AA:BB:CC:DD:EE:02=Flower care")
+        start = time.monotonic()
+        devices = GatttoolBackend.scan_for_devices(
+            10, "hci0", targets=["AA:BB:CC:DD:EE:02"]
+        )
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertIn("AA:BB:CC:DD:EE:02", [mac for mac, _ in devices])
+
+    def test_scan_names(self):
+        """Names of devices are taken from the output of lescan."""
+        self._configure(devices="AA:BB:CC:DD:EE:01,AA:BB:CC:DD:EE:02=Flower care")
+        self.assertEqual(
+            [
+                ("AA:BB:CC:DD:EE:01", "unknown"),
+                ("AA:BB:CC:DD:EE:02", "unknown"),
+                ("AA:BB:CC:DD:EE:02", "Flower care"),
+            ],
+            list(GatttoolBackend.iter_scan(1)),
+        )
+
+    def test_threads(self):
+        """Several threads read through a pool of adapters."""
+        self._configure(latency=0.05)
+        pool = BluetoothInterfacePool(
+            GatttoolBackend, ["hci0", "hci1", "hci2"], retry_policy=_NO_RETRY
+        )
+        results = []
+
+        def _read():
+            for _ in range(2):
+                with pool.connect(TEST_MAC) as backend:
+                    results.append(backend.read_handle(0x38))
+
+        threads = [Thread(target=_read) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([b"\x00\x11\xaa\xff"] * 12, results)
+
+    def test_processes(self):
+        """Several processes run gatttool at the same time."""
+        self._configure()
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            results = list(executor.map(_read_in_process, ["hci0", "hci1"]))
+        self.assertEqual([b"\x00\x11\xaa\xff"] * 2, results)
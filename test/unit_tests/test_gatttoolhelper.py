@@ -72,3 +72,14 @@ class TestGatttoolHelper(unittest.TestCase):
         for length in range(0, len(test_data)):
             result = GatttoolBackend._parse_scan_output(test_data[0:length])
             self.assertEqual(len(result) > 0, length > 66)
+
+    def test_parse_scan_output_plain_names(self):
+        """hcitool prints known names without parentheses."""
+        test_data = """LE Scan ...
+            78:24:AC:37:21:3D (unknown)
+            78:24:AC:37:21:3D Flower care
+            """
+        self.assertEqual(
+            [("78:24:AC:37:21:3D", "Flower care")],
+            GatttoolBackend._parse_scan_output(test_data),
+        )
@@ -0,0 +1,212 @@
+"""Tests for the L2CAP backend."""
+import ctypes
+import unittest
+from unittest import mock
+from test.tools.fake_peripheral import FakePeripheral
+from btlewrap import att
+from btlewrap.base import BluetoothBackendException, BluetoothTimeoutError
+from btlewrap.l2cap import L2capBackend, sockaddr_l2
+from btlewrap.retry import RetryPolicy
+
+TEST_MAC = "C4:7C:8D:6A:3E:7A"
+
+
+class TestL2capBackend(unittest.TestCase):
+    """Tests for the L2capBackend with a fake peripheral."""
+
+    def _backend(self, peripheral, **kwargs):
+        patcher = mock.patch(
+            "btlewrap.l2cap.open_att_socket", return_value=peripheral.client_socket
+        )
+        self.open_mock = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(peripheral.close)
+        backend = L2capBackend(**kwargs)
+        backend.connect(TEST_MAC)
+        self.addCleanup(backend.disconnect)
+        return backend
+
+    def test_sockaddr(self):
+        """The socket address uses the ATT channel and little endian addresses."""
+        address = sockaddr_l2(TEST_MAC, "random")
+        self.assertEqual(14, ctypes.sizeof(address))
+        self.assertEqual(bytes.fromhex("1f0000007a3e6a8d7cc404000200"), bytes(address))
+        with self.assertRaises(BluetoothBackendException):
+            sockaddr_l2("C4:7C:8D:6A:3E", "public")
+        with self.assertRaises(BluetoothBackendException):
+            sockaddr_l2(TEST_MAC, "static")
+
+    def test_read_write(self):
+        """Reads and writes are ATT requests."""
+        peripheral = FakePeripheral({0x38: b"\x01\x02", 0x33: b""})
+        backend = self._backend(peripheral, adapter="hci1", address_type="random")
+        self.open_mock.assert_called_once_with(TEST_MAC, "hci1", "random", 10)
+        self.assertTrue(backend.is_connected())
+        self.assertEqual(b"\x01\x02", backend.read_handle(0x38))
+        self.assertTrue(backend.write_handle(0x33, b"\xa0"))
+        self.assertEqual(b"\xa0", peripheral.values[0x33])
+        backend.disconnect()
+        self.assertFalse(backend.is_connected())
+        with self.assertRaises(BluetoothBackendException):
+            backend.read_handle(0x38)
+
+    def test_write_stream(self):
+        """Streams are sent as Write Commands with a Write Request as checkpoint."""
+        peripheral = FakePeripheral({0x33: b""})
+        backend = self._backend(peripheral)
+        chunks = [bytes([number]) * 20 for number in range(3)]
+        self.assertEqual(60, backend.write_stream(0x33, chunks, checkpoint_interval=4))
+        self.assertEqual(
+            [att.WRITE_COMMAND, att.WRITE_COMMAND, att.WRITE_REQUEST],
+            [pdu[0] for pdu in peripheral.received],
+        )
+        self.assertEqual(chunks[-1], peripheral.values[0x33])
+        with self.assertRaises(BluetoothBackendException):
+            backend.write_handle(0x33, bytes(21), response=False)
+
+    def test_mtu(self):
+        """A larger MTU is negotiated after connecting."""
+        peripheral = FakePeripheral({0x38: bytes(100)}, mtu=185)
+        backend = self._backend(peripheral, mtu=247)
+        self.assertEqual(b"\x02\xf7\x00", peripheral.received[0])
+        self.assertEqual(100, len(backend.read_handle(0x38)))
+
+    def test_read_multiple(self):
+        """Values of fixed size are read with Read Multiple requests that fit the MTU."""
+        values = {handle: bytes([handle]) * 8 for handle in range(1, 5)}
+        peripheral = FakePeripheral(values)
+        backend = self._backend(peripheral)
+        self.assertEqual(values, backend.read_multiple([1, 2, 3, 4], [8] * 4))
+        self.assertEqual(
+            [b"\x0e\x01\x00\x02\x00", b"\x0e\x03\x00\x04\x00"], peripheral.received
+        )
+        # a size that does not match the device is read one by one
+        self.assertEqual(
+            {1: values[1], 2: values[2]}, backend.read_multiple([1, 2], [8, 4])
+        )
+        self.assertEqual(b"\x0a\x02\x00", peripheral.received[-1])
+
+    def test_read_multiple_variable(self):
+        """Values of any length are read with Read Multiple Variable Length requests."""
+        values = {1: b"\x01", 2: bytes(range(30)), 3: b"\x03"}
+        peripheral = FakePeripheral(values)
+        backend = self._backend(peripheral)
+        self.assertEqual(values, backend.read_handles([1, 2, 3]))
+        # the long value is cut off and read with Read Blob
+        self.assertEqual(
+            [
+                att.READ_MULTIPLE_VARIABLE_REQUEST,
+                att.READ_REQUEST,
+                att.READ_BLOB_REQUEST,
+            ],
+            [pdu[0] for pdu in peripheral.received[:3]],
+        )
+        self.assertEqual(att.READ_REQUEST, peripheral.received[3][0])
+
+    def test_read_multiple_unsupported(self):
+        """Devices without Read Multiple are read handle by handle."""
+        values = {1: b"\x01", 2: b"\x02"}
+        peripheral = FakePeripheral(
+            values,
+            unsupported=[att.READ_MULTIPLE_REQUEST, att.READ_MULTIPLE_VARIABLE_REQUEST],
+        )
+        backend = self._backend(peripheral)
+        self.assertEqual(values, backend.read_multiple([1, 2]))
+        self.assertEqual(values, backend.read_multiple([1, 2]))
+        self.assertEqual(values, backend.read_multiple([1, 2], [1, 1]))
+        self.assertEqual(values, backend.read_multiple([1, 2], [1, 1]))
+        # each request is only tried once
+        self.assertEqual(
+            [0x20, 0x0A, 0x0A, 0x0A, 0x0A, 0x0E, 0x0A, 0x0A, 0x0A, 0x0A],
+            [pdu[0] for pdu in peripheral.received],
+        )
+
+    def test_discover_characteristics(self):
+        """Characteristic declarations are read with several Read By Type requests."""
+        uuid = "00001a02-0000-1000-8000-00805f9b34fb"
+        characteristics = {0x03: 0x2A00, 0x05: 0x2A01, 0x07: 0x2A04}
+        characteristics.update({0x33: 0x1A00, 0x35: 0x1A01, 0x38: uuid})
+        peripheral = FakePeripheral({}, characteristics=characteristics)
+        backend = self._backend(peripheral)
+        self.assertEqual(
+            {
+                "00002a00-0000-1000-8000-00805f9b34fb": 0x03,
+                "00002a01-0000-1000-8000-00805f9b34fb": 0x05,
+                "00002a04-0000-1000-8000-00805f9b34fb": 0x07,
+                "00001a00-0000-1000-8000-00805f9b34fb": 0x33,
+                "00001a01-0000-1000-8000-00805f9b34fb": 0x35,
+                uuid: 0x38,
+            },
+            backend.discover_characteristics(),
+        )
+        # three 16 bit declarations fit into one response, then the 128 bit one
+        self.assertEqual(
+            [b"\x01\x00", b"\x07\x00", b"\x35\x00", b"\x38\x00"],
+            [pdu[1:3] for pdu in peripheral.received],
+        )
+
+    def test_read_long(self):
+        """Long values are read with Read Blob requests."""
+        peripheral = FakePeripheral({0x38: bytes(range(100))})
+        backend = self._backend(peripheral)
+        self.assertEqual(bytes(range(22)), backend.read_handle(0x38))
+        self.assertEqual(bytes(range(100)), backend.read_long(0x38))
+
+    def test_notifications(self):
+        """Notifications are passed to the delegate."""
+        peripheral = FakePeripheral({0x0E: b"", 0x0F: b""}, notifications=3)
+        backend = self._backend(peripheral)
+        delegate = mock.Mock()
+        self.assertTrue(backend.wait_for_notification(0x0F, delegate, 0.2))
+        self.assertEqual(
+            [mock.call(0x0E, bytes([number])) for number in range(3)],
+            delegate.handleNotification.call_args_list,
+        )
+
+    def test_iter_notifications(self):
+        """Iteration stops after max_count notifications."""
+        peripheral = FakePeripheral({0x0E: b"", 0x0F: b""}, notifications=5)
+        backend = self._backend(peripheral)
+        notifications = list(backend.iter_notifications(0x0F, 5, max_count=2))
+        self.assertEqual([(0x0E, b"\x00"), (0x0E, b"\x01")], notifications)
+
+    @mock.patch("time.sleep")
+    def test_connect_retries(self, _):
+        """Failed connects are retried."""
+        backend = L2capBackend(retry_policy=RetryPolicy(max_attempts=2))
+        with mock.patch(
+            "btlewrap.l2cap.open_att_socket",
+            side_effect=[
+                ConnectionRefusedError(111, "refused"),
+                BluetoothTimeoutError(),
+            ],
+        ) as open_mock:
+            with self.assertRaises(BluetoothBackendException):
+                backend.connect(TEST_MAC)
+        self.assertEqual(2, open_mock.call_count)
+        self.assertFalse(backend.is_connected())
+
+    @mock.patch("time.sleep")
+    def test_mtu_exchange_retried(self, _):
+        """A failed MTU exchange is retried like a failed connect."""
+        failing = FakePeripheral({}, unsupported=[att.EXCHANGE_MTU_REQUEST])
+        peripheral = FakePeripheral({0x38: bytes(100)}, mtu=185)
+        self.addCleanup(failing.close)
+        self.addCleanup(peripheral.close)
+        backend = L2capBackend(mtu=247, retry_policy=RetryPolicy(max_attempts=2))
+        self.addCleanup(backend.disconnect)
+        with mock.patch(
+            "btlewrap.l2cap.open_att_socket",
+            side_effect=[failing.client_socket, peripheral.client_socket],
+        ) as open_mock:
+            backend.connect(TEST_MAC)
+        self.assertEqual(2, open_mock.call_count)
+        self.assertEqual(-1, failing.client_socket.fileno())
+        self.assertEqual(100, len(backend.read_handle(0x38)))
+
+    def test_check_backend(self):
+        """The backend is available if L2CAP sockets can be opened."""
+        with mock.patch("socket.socket") as socket_mock:
+            self.assertTrue(L2capBackend.check_backend())
+            socket_mock.side_effect = OSError(97, "Address family not supported")
+            self.assertFalse(L2capBackend.check_backend())
@@ -0,0 +1,146 @@
+"""Tests for the metrics."""
+import unittest
+from unittest import mock
+from test.helper import MockBackend
+from btlewrap.base import BluetoothInterface, BluetoothBackendException
+from btlewrap.cache import FOREVER, ReadCache
+from btlewrap.metrics import (
+    Histogram,
+    InMemoryMetrics,
+    MeteredBackend,
+    metric_labels,
+    prometheus_text,
+)
+
+_LABELS = metric_labels("MockBackend", "hci0", "aa:bb", "read")
+
+
+class TestInMemoryMetrics(unittest.TestCase):
+    """Tests for the InMemoryMetrics aggregator."""
+
+    def test_histogram(self):
+        """Measurements are counted in the first bucket they fit into."""
+        histogram = Histogram((0.1, 1))
+        for value in [0.05, 0.1, 0.5, 5]:
+            histogram.observe(value)
+        self.assertEqual([(0.1, 2), (1, 3), (float("inf"), 4)], histogram.cumulative())
+        self.assertEqual(5.65, histogram.sum)
+        self.assertEqual(0.1, histogram.quantile(0.5))
+        self.assertEqual(float("inf"), histogram.quantile(1))
+        self.assertIsNone(Histogram().quantile(0.5))
+
+    def test_label_matching(self):
+        """Counters and histograms are merged over the matching label sets."""
+        metrics = InMemoryMetrics()
+        other = dict(_LABELS, mac="CC:DD")
+        metrics.increment("retries_total", _LABELS)
+        metrics.increment("retries_total", other, 2)
+        metrics.observe("operation_seconds", 0.5, _LABELS)
+        metrics.observe("operation_seconds", 1.5, other)
+        self.assertEqual(3, metrics.counter("retries_total"))
+        self.assertEqual(2, metrics.counter("retries_total", mac="CC:DD"))
+        self.assertEqual(0, metrics.counter("timeouts_total"))
+        self.assertEqual(2, metrics.histogram("operation_seconds").count)
+        self.assertEqual(0.5, metrics.histogram("operation_seconds", mac="AA:BB").sum)
+        metrics.reset()
+        self.assertEqual([], metrics.counters())
+
+    def test_prometheus_text(self):
+        """Metrics are exported in the Prometheus text format."""
+        metrics = InMemoryMetrics(buckets=(0.1,))
+        metrics.observe("operation_seconds", 0.05, _LABELS)
+        metrics.increment("errors_total", dict(_LABELS, mac='a"b'))
+        labels = 'adapter="hci0",backend="MockBackend",mac="AA:BB",operation="read"'
+        self.assertEqual(
+            [
+                "# TYPE btlewrap_operation_seconds histogram",
+                'btlewrap_operation_seconds_bucket{%s,le="0.1"} 1' % labels,
+                'btlewrap_operation_seconds_bucket{%s,le="+Inf"} 1' % labels,
+                "btlewrap_operation_seconds_sum{%s} 0.05" % labels,
+                "btlewrap_operation_seconds_count{%s} 1" % labels,
+                "# TYPE btlewrap_errors_total counter",
+                "btlewrap_errors_total{%s} 1"
+                % labels.replace('mac="AA:BB"', 'mac="a\\"b"'),
+            ],
+            prometheus_text(metrics).splitlines(),
+        )
+        self.assertEqual("", prometheus_text(InMemoryMetrics()))
+
+
+class TestInterfaceMetrics(unittest.TestCase):
+    """Tests for the metrics of BluetoothInterface."""
+
+    def test_disabled(self):
+        """Without a sink the backend is not wrapped."""
+        interface = BluetoothInterface(MockBackend)
+        with interface.connect("aa:bb") as backend:
+            self.assertIsInstance(backend, MockBackend)
+
+    def test_connection(self):
+        """Lock waits, connects and operations are measured."""
+        metrics = InMemoryMetrics()
+        interface = BluetoothInterface(MockBackend, metrics=metrics)
+        with interface.connect("aa:bb") as backend:
+            self.assertIsInstance(backend, MeteredBackend)
+            backend.override_read_handles[0x38] = b"\x01"
+            self.assertEqual(b"\x01", backend.read_handle(0x38))
+            backend.write_handle(0x33, b"\x02")
+            with self.assertRaises(ValueError):
+                backend.read_handle(0x01)
+        self.assertEqual(1, metrics.histogram("lock_wait_seconds").count)
+        self.assertEqual(1, metrics.histogram("connect_seconds", mac="AA:BB").count)
+        self.assertEqual(
+            2, metrics.histogram("operation_seconds", operation="read").count
+        )
+        self.assertEqual(
+            1, metrics.histogram("operation_seconds", operation="write").count
+        )
+        self.assertEqual(1, metrics.counter("errors_total", operation="read"))
+
+    def test_notifications(self):
+        """Notifications are measured, the options are passed on."""
+        metrics = InMemoryMetrics()
+        interface = BluetoothInterface(MockBackend, metrics=metrics)
+        with interface.connect("aa:bb") as backend:
+            with mock.patch.object(
+                MockBackend, "wait_for_notification", return_value=True
+            ) as wait_mock:
+                self.assertTrue(
+                    backend.wait_for_notification(0x0E, None, 5, max_count=1)
+                )
+            wait_mock.assert_called_once_with(0x0E, None, 5, max_count=1)
+            with mock.patch.object(
+                MockBackend,
+                "iter_notifications",
+                return_value=iter([(0x0E, b"\x01"), (0x0E, b"\x02")]),
+            ):
+                values = list(backend.iter_notifications(0x0E, 5, max_count=2))
+            self.assertEqual(2, len(values))
+        self.assertEqual(
+            2, metrics.histogram("operation_seconds", operation="notification").count
+        )
+
+    def test_connect_error(self):
+        """Failed connects are counted."""
+        metrics = InMemoryMetrics()
+        interface = BluetoothInterface(MockBackend, metrics=metrics)
+        with mock.patch.object(
+            MockBackend, "connect", side_effect=BluetoothBackendException()
+        ):
+            with self.assertRaises(BluetoothBackendException):
+                with interface.connect("aa:bb"):
+                    pass
+        self.assertEqual(1, metrics.counter("errors_total", operation="connect"))
+        self.assertEqual(0, metrics.histogram("connect_seconds").count)
+
+    def test_cache_hits_not_measured(self):
+        """Reads answered by the ReadCache do not count as operations."""
+        metrics = InMemoryMetrics()
+        interface = BluetoothInterface(
+            MockBackend, metrics=metrics, read_cache=ReadCache(default_ttl=FOREVER)
+        )
+        for _ in range(3):
+            with interface.connect("aa:bb") as backend:
+                backend.override_read_handles[0x38] = b"\x01"
+                backend.read_handle(0x38)
+        self.assertEqual(1, metrics.histogram("operation_seconds").count)
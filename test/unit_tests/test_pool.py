@@ -0,0 +1,78 @@
+"""Tests for the BluetoothInterfacePool class."""
+import unittest
+from unittest import mock
+from threading import Event, Thread
+from test.helper import MockBackend
+from btlewrap.base import BluetoothBackendException
+from btlewrap.pool import BluetoothInterfacePool, local_adapters
+
+
+class TestBluetoothInterfacePool(unittest.TestCase):
+    """Tests for the BluetoothInterfacePool class."""
+
+    def test_round_robin(self):
+        """Consecutive connections are spread over all adapters."""
+        pool = BluetoothInterfacePool(MockBackend, ["hci0", "hci1"])
+        used = []
+        for mac in ["a", "b", "c"]:
+            with pool.connect(mac) as backend:
+                used.append(backend.adapter)
+        self.assertEqual(["hci0", "hci1", "hci0"], used)
+        self.assertFalse(pool.is_connected())
+
+    def test_parallel_connections(self):
+        """A second connection gets the adapter that is still free."""
+        pool = BluetoothInterfacePool(MockBackend, ["hci0", "hci1"])
+        connected = Event()
+        release = Event()
+
+        def _hold_connection():
+            with pool.connect("a"):
+                connected.set()
+                release.wait(5)
+
+        thread = Thread(target=_hold_connection)
+        thread.start()
+        self.assertTrue(connected.wait(5))
+        with pool.connect("b") as backend:
+            self.assertEqual("hci1", backend.adapter)
+        release.set()
+        thread.join()
+
+    def test_affinity(self):
+        """Bound macs always use the same adapter."""
+        pool = BluetoothInterfacePool(
+            MockBackend, ["hci0", "hci1"], affinity={"aa:bb": "hci1"}
+        )
+        for _ in range(3):
+            with pool.connect("AA:BB") as backend:
+                self.assertEqual("hci1", backend.adapter)
+        pool.set_affinity("aa:bb", None)
+        with pool.connect("AA:BB") as backend:
+            self.assertEqual("hci0", backend.adapter)
+
+    def test_invalid_affinity(self):
+        """Affinity to unknown adapters is rejected."""
+        pool = BluetoothInterfacePool(MockBackend, ["hci0"])
+        with self.assertRaises(BluetoothBackendException):
+            pool.set_affinity("aa:bb", "hci7")
+
+    def test_release_on_exception(self):
+        """Adapters are released if an exception is raised."""
+        pool = BluetoothInterfacePool(MockBackend, ["hci0"])
+        with self.assertRaises(ValueError):
+            with pool.connect("a"):
+                raise ValueError("some test exception")
+        self.assertFalse(pool.is_connected())
+        self.assertFalse(pool.interface("hci0").is_connected())
+
+    @mock.patch("os.listdir", return_value=["hci10", "hci1", "hci0", "other"])
+    def test_local_adapters(self, _):
+        """Adapters are found in sysfs and sorted by number."""
+        self.assertEqual(["hci0", "hci1", "hci10"], local_adapters())
+
+    @mock.patch("os.listdir", side_effect=OSError())
+    def test_no_adapters(self, _):
+        """Creating a pool without adapters fails."""
+        with self.assertRaises(BluetoothBackendException):
+            BluetoothInterfacePool(MockBackend)
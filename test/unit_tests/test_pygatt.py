@@ -1,6 +1,8 @@
 """Test pygatt backend."""
 
 import unittest
+from unittest import mock
+from test import TEST_MAC
 from btlewrap import PygattBackend
 
 
@@ -13,3 +15,42 @@ class TestGatttool(unittest.TestCase):
     def test_supports_scanning(self):
         """Check if scanning is set correctly."""
         self.assertFalse(PygattBackend.supports_scanning())
+
+    @mock.patch("pygatt.BGAPIBackend")
+    def test_read_handles(self, _):
+        """Read several handles with one device."""
+        backend = PygattBackend()
+        backend.connect(TEST_MAC)
+        device = backend._device  # pylint: disable=protected-access
+        device.char_read_handle.side_effect = lambda handle: bytes([handle])
+        self.assertEqual({1: b"\x01", 2: b"\x02"}, backend.read_handles([1, 2]))
+        self.assertTrue(backend.write_handles([(3, b"\x03"), (4, b"\x04")]))
+        device.char_write_handle.assert_has_calls(
+            [mock.call(3, b"\x03", True), mock.call(4, b"\x04", True)]
+        )
+        self.assertTrue(backend.write_handle(5, b"\x05", response=False))
+        device.char_write_handle.assert_called_with(5, b"\x05", False)
+
+    @mock.patch("pygatt.BGAPIBackend")
+    def test_iter_notifications(self, _):
+        """Notifications of the pygatt callback are yielded."""
+        backend = PygattBackend()
+        backend.connect(TEST_MAC)
+        device = backend._device  # pylint: disable=protected-access
+
+        def _subscribe(value_handle, callback):
+            for value in (b"\x01", b"\x02", b"\x03"):
+                callback(value_handle, bytearray(value))
+
+        device.subscribe_handle.side_effect = _subscribe
+        self.assertEqual(
+            [(0x0D, b"\x01"), (0x0D, b"\x02")],
+            list(backend.iter_notifications(0x0E, 5, max_count=2)),
+        )
+        device.subscribe_handle.assert_called_once_with(0x0D, mock.ANY)
+        device.unsubscribe_handle.assert_called_once_with(0x0D)
+
+        delegate = mock.Mock()
+        device.subscribe_handle.side_effect = None
+        self.assertTrue(backend.wait_for_notification(0x0E, delegate, 0.05))
+        delegate.handleNotification.assert_not_called()
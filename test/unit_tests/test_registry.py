@@ -0,0 +1,148 @@
+"""Tests for the DeviceRegistry."""
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+from test.helper import MockBackend
+from btlewrap.advertisement import AdvertisementRecord
+from btlewrap.base import BluetoothInterface, BluetoothBackendException
+from btlewrap.registry import DeviceRegistry
+
+
+class TestDeviceRegistry(unittest.TestCase):
+    """Tests for the DeviceRegistry."""
+
+    def test_seen(self):
+        """Sightings update the info of a device."""
+        registry = DeviceRegistry()
+        registry.seen("aa:bb", rssi=-70, name="sensor", timestamp=100)
+        registry.seen("AA:BB", rssi=-60)
+        info = registry.get("aa:bb")
+        self.assertIn("AA:BB", registry)
+        self.assertEqual(-60, info.rssi)
+        self.assertEqual("sensor", info.name)
+        self.assertGreater(info.last_seen, 100)
+
+    def test_failure_rate(self):
+        """Only the last outcomes are used for the failure rate."""
+        registry = DeviceRegistry(history=4)
+        for success in [False, False, True, True, False, True]:
+            registry.record_connection("aa", success)
+        self.assertEqual(0.25, registry.get("aa").failure_rate)
+
+    def test_is_absent(self):
+        """Devices that were not seen recently are absent, unknown ones are not."""
+        registry = DeviceRegistry()
+        registry.seen("old", timestamp=time.time() - 100)
+        registry.seen("new")
+        registry.record_connection("failed", False)
+        self.assertTrue(registry.is_absent("old", 60))
+        self.assertFalse(registry.is_absent("new", 60))
+        self.assertFalse(registry.is_absent("failed", 60))
+        self.assertFalse(registry.is_absent("unknown", 60))
+
+    def test_should_skip(self):
+        """Absent devices are probed once per max_absence."""
+        registry = DeviceRegistry()
+        registry.record_connection("failed", False)
+        self.assertFalse(registry.should_skip("failed", 60))
+        registry.seen("old", timestamp=time.time() - 100)
+        self.assertFalse(registry.should_skip("old", 60))
+        registry.record_connection("old", False)
+        self.assertTrue(registry.should_skip("old", 60))
+        registry.get("old").last_attempt -= 61
+        self.assertFalse(registry.should_skip("old", 60))
+        registry.record_connection("old", True)
+        self.assertFalse(registry.is_absent("old", 60))
+
+    def test_rank(self):
+        """Recently seen and reliable devices come first."""
+        registry = DeviceRegistry()
+        registry.seen("old", timestamp=time.time() - 100)
+        registry.seen("new")
+        registry.seen("flaky")
+        registry.record_connection("flaky", False)
+        self.assertEqual(
+            ["new", "old", "flaky", "unknown"],
+            registry.rank(["unknown", "flaky", "old", "new"]),
+        )
+
+    def test_observe(self):
+        """Scan results and advertisements are recorded while passing through."""
+        registry = DeviceRegistry()
+        results = [("aa", "sensor"), AdvertisementRecord("bb", -50, 0x01, b"\x06")]
+        self.assertEqual(results, list(registry.observe(results)))
+        self.assertEqual("sensor", registry.get("aa").name)
+        self.assertEqual(-50, registry.get("bb").rssi)
+
+    def test_save_load(self):
+        """The registry survives a round trip through a file."""
+        registry = DeviceRegistry()
+        registry.seen("aa", rssi=-70, name="sensor", timestamp=1234.5)
+        registry.record_connection("aa", False)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "registry.json")
+            registry.save(path)
+            loaded = DeviceRegistry.load(path)
+        info = loaded.get("aa")
+        self.assertEqual(
+            (1234.5, -70, "sensor"), (info.last_seen, info.rssi, info.name)
+        )
+        self.assertEqual([False], list(info.outcomes))
+
+
+class TestInterfaceRegistry(unittest.TestCase):
+    """Tests for the use of the registry by BluetoothInterface."""
+
+    def test_fail_fast(self):
+        """Absent devices are not connected, except for a probe."""
+        registry = DeviceRegistry()
+        registry.seen("aa", timestamp=time.time() - 100)
+        interface = BluetoothInterface(
+            MockBackend, adapter="hci6", registry=registry, max_absence=60
+        )
+        backend = interface._backend  # pylint: disable=protected-access
+        with mock.patch.object(
+            backend, "connect", side_effect=BluetoothBackendException("no device")
+        ) as connect:
+            for _ in range(2):
+                with self.assertRaises(BluetoothBackendException):
+                    with interface.connect("aa"):
+                        pass
+            self.assertEqual(1, connect.call_count)
+        self.assertFalse(interface.is_connected())
+        # the next probe succeeds
+        registry.get("aa").last_attempt -= 61
+        with interface.connect("aa"):
+            pass
+        self.assertFalse(registry.is_absent("aa", 60))
+
+    def test_failed_first_connect(self):
+        """A device that was never seen is not rejected after a failure."""
+        registry = DeviceRegistry()
+        interface = BluetoothInterface(
+            MockBackend, adapter="hci6", registry=registry, max_absence=60
+        )
+        backend = interface._backend  # pylint: disable=protected-access
+        with mock.patch.object(
+            backend, "connect", side_effect=BluetoothBackendException("no device")
+        ) as connect:
+            for _ in range(2):
+                with self.assertRaises(BluetoothBackendException):
+                    with interface.connect("aa"):
+                        pass
+            self.assertEqual(2, connect.call_count)
+
+    def test_record_outcomes(self):
+        """The outcome of connections is recorded."""
+        registry = DeviceRegistry()
+        interface = BluetoothInterface(MockBackend, adapter="hci6", registry=registry)
+        with interface.connect("aa"):
+            pass
+        with self.assertRaises(BluetoothBackendException):
+            with interface.connect("aa"):
+                raise BluetoothBackendException("read failed")
+        info = registry.get("aa")
+        self.assertEqual([True, False], list(info.outcomes))
+        self.assertIsNotNone(info.last_seen)
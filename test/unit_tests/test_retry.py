@@ -0,0 +1,97 @@
+"""Tests for the RetryPolicy class."""
+import unittest
+from unittest import mock
+from btlewrap.retry import RetryPolicy
+
+
+class TestRetryPolicy(unittest.TestCase):
+    """Tests for the RetryPolicy class."""
+
+    # pylint: disable=no-self-use
+
+    def test_exponential_delay(self):
+        """Delays grow exponentially up to max_delay."""
+        policy = RetryPolicy(5, 10, max_delay=30)
+        self.assertEqual([10, 20, 30, 30], [policy.delay(n) for n in range(1, 5)])
+
+    def test_jitter(self):
+        """Jitter varies the delay within the given fraction."""
+        policy = RetryPolicy(5, 10, jitter=0.5)
+        for _ in range(100):
+            self.assertTrue(5 <= policy.delay(1) <= 15)
+
+    def test_invalid_attempts(self):
+        """At least one attempt is required."""
+        with self.assertRaises(ValueError):
+            RetryPolicy(0)
+
+    @mock.patch("time.sleep")
+    def test_attempts(self, sleep_mock):
+        """Attempts are counted and delayed."""
+        policy = RetryPolicy(3, 1)
+        self.assertEqual([1, 2, 3], [attempt.number for attempt in policy.attempts()])
+        sleep_mock.assert_has_calls([mock.call(1), mock.call(2)])
+
+    @mock.patch("time.sleep")
+    @mock.patch("time.monotonic")
+    def test_deadline(self, monotonic_mock, sleep_mock):
+        """No retry is started if the deadline would be exceeded."""
+        clock = [100.0]
+        monotonic_mock.side_effect = lambda: clock[0]
+        sleep_mock.side_effect = lambda delay: clock.__setitem__(0, clock[0] + delay)
+        policy = RetryPolicy(10, 1, deadline=5)
+        attempts = []
+        for attempt in policy.attempts():
+            attempts.append(attempt.number)
+            self.assertLessEqual(attempt.timeout(20), 5)
+        # delays of 1 and 2 seconds fit into the deadline, 4 more do not
+        self.assertEqual([1, 2, 3], attempts)
+
+    @mock.patch("time.sleep")
+    @mock.patch("time.monotonic")
+    def test_absolute_deadline(self, monotonic_mock, sleep_mock):
+        """An absolute deadline limits the attempts like the deadline of the policy."""
+        clock = [100.0]
+        monotonic_mock.side_effect = lambda: clock[0]
+        sleep_mock.side_effect = lambda delay: clock.__setitem__(0, clock[0] + delay)
+        policy = RetryPolicy(10, 1, deadline=60)
+        attempts = []
+        for attempt in policy.attempts(deadline=105):
+            attempts.append(attempt.number)
+            self.assertLessEqual(attempt.timeout(20), 5)
+        self.assertEqual([1, 2, 3], attempts)
+
+    @mock.patch("time.sleep")
+    def test_call(self, sleep_mock):
+        """Calls are retried on the given exceptions."""
+        func = mock.Mock(side_effect=[IOError(), IOError(), 42])
+        policy = RetryPolicy(3, 0.5)
+        self.assertEqual(42, policy.call(func, 1, retry_on=(IOError,)))
+        func.assert_called_with(1)
+        self.assertEqual(2, sleep_mock.call_count)
+
+    @mock.patch("time.sleep")
+    def test_call_on_retry(self, _):
+        """on_retry is called with the exception before every retry."""
+        errors = [IOError(), IOError()]
+        func = mock.Mock(side_effect=errors + [42])
+        on_retry = mock.Mock()
+        RetryPolicy(3).call(func, retry_on=(IOError,), on_retry=on_retry)
+        self.assertEqual(
+            [mock.call(error) for error in errors], on_retry.call_args_list
+        )
+
+    @mock.patch("time.sleep")
+    def test_call_fails(self, _):
+        """The last exception is raised after all attempts failed."""
+        func = mock.Mock(side_effect=IOError())
+        with self.assertRaises(IOError):
+            RetryPolicy(2).call(func, retry_on=(IOError,))
+        self.assertEqual(2, func.call_count)
+
+    def test_call_other_exception(self):
+        """Other exceptions are not retried."""
+        func = mock.Mock(side_effect=ValueError())
+        with self.assertRaises(ValueError):
+            RetryPolicy(3).call(func, retry_on=(IOError,))
+        self.assertEqual(1, func.call_count)
@@ -0,0 +1,186 @@
+"""Tests for the PollScheduler."""
+import time
+import unittest
+from unittest import mock
+from threading import Event, Lock
+from test.helper import MockBackend
+from btlewrap.base import BluetoothInterface
+from btlewrap.scheduler import OVERRUN_COALESCE, PollScheduler
+
+
+class TestPollScheduler(unittest.TestCase):
+    """Tests for the PollScheduler."""
+
+    def setUp(self):
+        self.interface = BluetoothInterface(MockBackend, adapter="hci7")
+        self.scheduler = None
+
+    def tearDown(self):
+        if self.scheduler is not None:
+            self.scheduler.stop(5)
+
+    def test_polls_in_interval(self):
+        """Each device is polled in its own interval."""
+        polls = {"fast": 0, "slow": 0}
+        self.scheduler = PollScheduler(self.interface)
+
+        def _poll(name):
+            def _poll_fn(backend):
+                self.assertIsInstance(backend, MockBackend)
+                polls[name] += 1
+
+            return _poll_fn
+
+        self.scheduler.add("fast", _poll("fast"), 0.02)
+        self.scheduler.add("slow", _poll("slow"), 10)
+        self.scheduler.start()
+        time.sleep(0.3)
+        self.scheduler.stop(5)
+        self.assertGreater(polls["fast"], 3)
+        self.assertEqual(1, polls["slow"])
+        stats = self.scheduler.stats()
+        self.assertEqual(polls["fast"], stats["fast"].runs)
+        self.assertEqual(0, stats["fast"].failures)
+        self.assertGreaterEqual(stats["fast"].max_lateness, 0)
+
+    def test_priority(self):
+        """Jobs due at the same time run by priority."""
+        order = []
+        self.scheduler = PollScheduler(self.interface, workers=1)
+        self.scheduler.add("low", lambda backend: order.append("low"), 10, 0)
+        self.scheduler.add("high", lambda backend: order.append("high"), 10, 5)
+        self.scheduler.start()
+        time.sleep(0.1)
+        self.assertEqual(["high", "low"], order)
+
+    def test_priority_of_waiting_jobs(self):
+        """Jobs that became due while all workers were busy run by priority."""
+        order = []
+        self.scheduler = PollScheduler(self.interface, workers=1)
+        self.scheduler.add("busy", lambda backend: time.sleep(0.1), 10)
+        self.scheduler.add("low", lambda backend: order.append("low"), 10, delay=0.01)
+        self.scheduler.add(
+            "high", lambda backend: order.append("high"), 10, 5, delay=0.02
+        )
+        self.scheduler.start()
+        time.sleep(0.3)
+        self.assertEqual(["high", "low"], order)
+
+    def test_failures_are_counted(self):
+        """A failing poll does not stop the scheduler."""
+        self.scheduler = PollScheduler(self.interface)
+
+        def _fail(backend):
+            raise ValueError("sensor broken")
+
+        self.scheduler.add("abc", _fail, 0.02)
+        self.scheduler.start()
+        time.sleep(0.15)
+        self.scheduler.stop(5)
+        stats = self.scheduler.stats()["abc"]
+        self.assertGreater(stats.failures, 1)
+        self.assertEqual(stats.runs, stats.failures)
+        self.assertIsInstance(stats.last_error, ValueError)
+
+    def test_overrun_skip(self):
+        """Missed polls of a slow device are skipped."""
+        self.scheduler = PollScheduler(self.interface)
+        self.scheduler.add("abc", lambda backend: time.sleep(0.12), 0.05)
+        self.scheduler.start()
+        time.sleep(0.3)
+        self.scheduler.stop(5)
+        stats = self.scheduler.stats()["abc"]
+        self.assertLessEqual(stats.runs, 3)
+        self.assertGreater(stats.skipped, 0)
+        self.assertEqual(0, stats.coalesced)
+
+    def test_overrun_coalesce(self):
+        """Missed polls of a slow device are run once right away."""
+        self.scheduler = PollScheduler(self.interface, overrun=OVERRUN_COALESCE)
+        self.scheduler.add("abc", lambda backend: time.sleep(0.12), 0.05)
+        self.scheduler.start()
+        time.sleep(0.3)
+        self.scheduler.stop(5)
+        stats = self.scheduler.stats()["abc"]
+        self.assertGreater(stats.coalesced, 0)
+        self.assertEqual(0, stats.skipped)
+
+    def test_connect_rate_limit(self):
+        """Connections are limited to max_connect_rate."""
+        starts = []
+        lock = Lock()
+
+        def _poll(backend):
+            with lock:
+                starts.append(time.monotonic())
+
+        self.scheduler = PollScheduler(
+            self.interface, workers=4, max_connect_rate=20, burst=1
+        )
+        for number in range(5):
+            self.scheduler.add(str(number), _poll, 10)
+        self.scheduler.start()
+        time.sleep(0.4)
+        self.assertEqual(5, len(starts))
+        self.assertGreaterEqual(starts[-1] - starts[0], 0.15)
+
+    def test_remove(self):
+        """Removed devices are not polled any more."""
+        polled = Event()
+        self.scheduler = PollScheduler(self.interface)
+        self.scheduler.add("abc", lambda backend: polled.set(), 0.02, delay=0.1)
+        self.scheduler.remove("ABC")
+        self.scheduler.start()
+        time.sleep(0.2)
+        self.assertFalse(polled.is_set())
+        self.assertEqual({}, self.scheduler.stats())
+
+    def test_restart_while_waiting_for_token(self):
+        """A job waiting for the rate limit is kept when the scheduler stops."""
+        polled = []
+        self.scheduler = PollScheduler(
+            self.interface, workers=2, max_connect_rate=2, burst=1
+        )
+        self.scheduler.add("a", lambda backend: polled.append("a"), 10)
+        self.scheduler.add("b", lambda backend: polled.append("b"), 10)
+        self.scheduler.start()
+        time.sleep(0.1)
+        self.scheduler.stop(5)
+        self.assertEqual(1, len(polled))
+        self.scheduler.start()
+        time.sleep(0.8)
+        self.assertEqual(["a", "b"], sorted(polled))
+
+    def test_stop_while_waiting_for_token(self):
+        """Workers waiting for the rate limit stop right away."""
+        self.scheduler = PollScheduler(
+            self.interface, workers=2, max_connect_rate=0.01, burst=1
+        )
+        self.scheduler.add("a", lambda backend: None, 10)
+        self.scheduler.add("b", lambda backend: None, 10)
+        self.scheduler.start()
+        time.sleep(0.1)
+        start = time.monotonic()
+        self.scheduler.stop(5)
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_add_while_polling(self):
+        """A device added again while it is polled is not polled in parallel."""
+        running = Event()
+        release = Event()
+        second = Event()
+        # connections to different devices could run in parallel
+        self.scheduler = PollScheduler(mock.MagicMock(), workers=2)
+
+        def _slow(backend):
+            running.set()
+            release.wait(5)
+
+        self.scheduler.add("abc", _slow, 10)
+        self.scheduler.start()
+        self.assertTrue(running.wait(5))
+        self.scheduler.add("abc", lambda backend: second.set(), 10)
+        time.sleep(0.1)
+        self.assertFalse(second.is_set())
+        release.set()
+        self.assertTrue(second.wait(5))